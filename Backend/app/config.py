@@ -26,13 +26,86 @@ class Settings(BaseSettings):
     session_id_length: int = 8
     max_users_per_session: int = 10
     session_timeout_minutes: int = 60
+    # What happens to sessions idle for session_timeout_minutes: "archive", "delete" or "off"
+    session_expiry_mode: str = "archive"
+    session_reaper_interval_seconds: int = 60
+    # Typing flags clear themselves; users without activity (and no open socket) are removed
+    typing_timeout_seconds: int = 5
+    user_idle_timeout_seconds: int = 1800
+    presence_tick_seconds: float = 1.0
+    # isTyping/lastActivity live in memory and are written to the database this often
+    presence_snapshot_seconds: float = 30
+    # Per-connection token buckets for typing/code_update/language_update/execute messages
+    ws_message_rate_per_second: float = 20
+    ws_message_burst: int = 40
+    ws_execute_rate_per_second: float = 0.5
+    ws_execute_burst: int = 2
+    # A socket that does not take a frame within this time is dropped
+    ws_send_timeout_seconds: float = 5
     
     # Code Execution Settings
     code_execution_timeout_seconds: int = 5
+    code_execution_memory_limit_mb: int = 256
+    code_execution_max_output_bytes: int = 64 * 1024
+    python_worker_pool_size: int = 2
+    # "forkserver" forks workers from a pre-imported server; "spawn" starts a fresh interpreter
+    python_worker_start_method: str = "forkserver"
+    python_worker_max_jobs: int = 1
+    python_worker_low_watermark: int = 1
+    python_worker_prestart: bool = True
+    node_binary: str = "node"
+    node_worker_pool_size: int = 2
+    node_worker_max_jobs: int = 100
+    node_worker_prestart: bool = True
+    # Build cache for java/cpp/go/rust; empty means a directory under the system temp dir
+    compile_cache_dir: str = ""
+    compile_cache_max_bytes: int = 512 * 1024 * 1024
+    compile_max_concurrency: int = 2
+    compile_timeout_seconds: int = 30
     max_code_length: int = 10000
+    execution_max_concurrency: int = 4
+    execution_per_session_concurrency: int = 1
+    execution_max_queue_depth: int = 50
+    execution_cache_size: int = 256
+    execution_cache_ttl_seconds: int = 300
 
     # Database Settings
     database_url: str = "sqlite:///./codecollab.db"
+    session_cache_size: int = 1024
+    # "notify" shares session updates across workers via Postgres LISTEN/NOTIFY,
+    # "local" keeps them in-process (SQLite always uses "local")
+    session_bus: str = "notify"
+    # Postgres connection pool; every connection prepares the backend's statements when it opens
+    postgres_pool_min_size: int = 2
+    postgres_pool_max_size: int = 10
+    postgres_pool_max_inactive_seconds: float = 300
+    postgres_command_timeout_seconds: float = 30
+    # Read replicas (DSNs) for session lookups; a replica lagging more than the limit is skipped
+    postgres_replica_urls: list[str] = []
+    postgres_replica_max_lag_seconds: float = 5
+    postgres_replica_health_interval_seconds: float = 5
+    
+    # SQLite: WAL with one writer and a pool of read-only connections
+    sqlite_journal_mode: str = "wal"
+    sqlite_synchronous: str = "normal"
+    sqlite_mmap_size_bytes: int = 256 * 1024 * 1024
+    sqlite_page_cache_kib: int = 64 * 1024
+    sqlite_busy_timeout_ms: int = 5000
+    sqlite_reader_pool_size: int = 4
+    # Group commit: writes queued within this delay share one transaction
+    sqlite_write_batch_size: int = 256
+    sqlite_write_batch_delay_ms: float = 2
+    
+    # Write-behind persistence of code edits
+    code_write_behind: bool = True
+    code_flush_interval_ms: int = 1000
+    code_flush_max_dirty_bytes: int = 256 * 1024
+    
+    # Collaborative (Yjs) documents: updates are persisted and the code column refreshed this often
+    crdt_flush_interval_seconds: float = 1.0
+    # The update log is folded into a snapshot once it reaches either limit
+    crdt_compact_after_updates: int = 100
+    crdt_compact_after_bytes: int = 256 * 1024
     
     model_config = ConfigDict(
         env_file=".env",
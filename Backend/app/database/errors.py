@@ -0,0 +1,7 @@
+class UsernameTakenError(Exception):
+    """Another user of the session already has this username (compared case-insensitively)."""
+    
+    def __init__(self, session_id: str, username: str):
+        super().__init__(f"Username {username!r} is already taken in session {session_id}")
+        self.session_id = session_id
+        self.username = username
@@ -7,8 +7,35 @@ db = None
 
 def _create_db():
     if settings.database_url and settings.database_url.startswith("postgres"):
-        return PostgresDatabase(settings.database_url)
-    return SQLiteDatabase()
+        return PostgresDatabase(
+            settings.database_url,
+            cache_size=settings.session_cache_size,
+            write_interval_ms=settings.code_flush_interval_ms,
+            write_max_dirty_bytes=settings.code_flush_max_dirty_bytes,
+            presence_snapshot_seconds=settings.presence_snapshot_seconds,
+            notify_bus=settings.session_bus == "notify",
+            pool_min_size=settings.postgres_pool_min_size,
+            pool_max_size=settings.postgres_pool_max_size,
+            pool_max_inactive_seconds=settings.postgres_pool_max_inactive_seconds,
+            command_timeout_seconds=settings.postgres_command_timeout_seconds,
+            replica_urls=settings.postgres_replica_urls,
+            replica_max_lag_seconds=settings.postgres_replica_max_lag_seconds,
+            replica_health_interval_seconds=settings.postgres_replica_health_interval_seconds
+        )
+    return SQLiteDatabase(
+        cache_size=settings.session_cache_size,
+        write_interval_ms=settings.code_flush_interval_ms,
+        write_max_dirty_bytes=settings.code_flush_max_dirty_bytes,
+        presence_snapshot_seconds=settings.presence_snapshot_seconds,
+        journal_mode=settings.sqlite_journal_mode,
+        synchronous=settings.sqlite_synchronous,
+        mmap_size_bytes=settings.sqlite_mmap_size_bytes,
+        page_cache_kib=settings.sqlite_page_cache_kib,
+        busy_timeout_ms=settings.sqlite_busy_timeout_ms,
+        reader_pool_size=settings.sqlite_reader_pool_size,
+        write_batch_size=settings.sqlite_write_batch_size,
+        write_batch_delay_ms=settings.sqlite_write_batch_delay_ms
+    )
 
 db = _create_db()
 
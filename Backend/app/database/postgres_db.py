@@ -1,36 +1,437 @@
 import asyncpg
 import asyncio
-from typing import Optional, Dict, Set, Callable, Any, List
+import json
+import logging
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Optional, Dict, Set, Callable, Any, List, Tuple, AsyncIterator
 from app.models.schemas import Session, User
+from app.database.session_cache import SessionCache
+from app.database.write_behind import CodeWriteBuffer
+from app.database.presence import PresenceTable, PresenceRow
+from app.database.session_bus import InProcessBus, PostgresNotifyBus
+from app.database.session_archive import compress_session, decompress_session
+from app.database.errors import UsernameTakenError
+from app.database.usernames import username_key, renamed_duplicates
+from app.database.replicas import ReplicaSet
+
+logger = logging.getLogger(__name__)
+
+SESSION_WITH_USERS_QUERY = """
+    SELECT s.id, s.code, s.language, s.created_at, s.last_modified_by,
+           COALESCE(
+               (SELECT json_agg(json_build_object(
+                           'id', u.id,
+                           'username', u.username,
+                           'color', u.color,
+                           'isTyping', COALESCE(u.is_typing, FALSE),
+                           'lastActivity', u.last_activity
+                       ))
+                FROM users u
+                WHERE u.session_id = s.id),
+               '[]'::json
+           ) AS users
+    FROM sessions s
+    WHERE s.id = $1
+"""
+
+USER_JSON = """json_build_object(
+    'id', u.id,
+    'username', u.username,
+    'color', u.color,
+    'isTyping', COALESCE(u.is_typing, FALSE),
+    'lastActivity', u.last_activity
+)"""
+
+
+def _returning_session(with_clause: str, sessions: str, users: str, where: str = "") -> str:
+    """
+    A statement that runs the data-modifying CTEs in with_clause and returns
+    the resulting session in the shape of SESSION_WITH_USERS_QUERY.
+    
+    The final SELECT sees the tables as they were before the statement, so
+    `sessions` and `users` must fold in the rows the CTEs returned.
+    """
+    return f"""
+        {with_clause}
+        SELECT s.id, s.code, s.language, s.created_at, s.last_modified_by,
+               COALESCE((SELECT json_agg({USER_JSON}) FROM ({users}) u), '[]'::json) AS users
+        FROM {sessions} s
+        {where}
+    """
+
+
+# Every query the backend runs, with fixed text so each pooled connection
+# prepares it once (at connect) and reuses it for the life of the connection
+STATEMENTS = {
+    "load_session": SESSION_WITH_USERS_QUERY,
+    "insert_session": """
+        INSERT INTO sessions (id, code, language, created_at, last_modified_by, last_activity)
+        VALUES ($1, $2, $3, $4, $5, $6)
+    """,
+    # Each column is only written when its flag is set
+    "update_session": _returning_session(
+        """
+        WITH updated AS (
+            UPDATE sessions SET
+                code = CASE WHEN $2 THEN $3 ELSE code END,
+                language = CASE WHEN $4 THEN $5 ELSE language END,
+                last_modified_by = CASE WHEN $6 THEN $7 ELSE last_modified_by END,
+                created_at = CASE WHEN $8 THEN $9 ELSE created_at END,
+                last_activity = $10
+            WHERE id = $1
+            RETURNING *
+        )
+        """,
+        sessions="updated",
+        users="SELECT * FROM users WHERE session_id = s.id"
+    ),
+    "delete_session": "DELETE FROM sessions WHERE id = $1 RETURNING id",
+    "find_idle_sessions": "SELECT id FROM sessions WHERE last_activity < $1 ORDER BY last_activity LIMIT $2",
+    # Inserts nothing (and returns no row) if the session does not exist
+    "add_user": _returning_session(
+        """
+        WITH inserted AS (
+            INSERT INTO users (id, session_id, username, username_key, color, is_typing, last_activity)
+            SELECT $1::text, $2::text, $3::text, $8::text, $4::text, $5::boolean, $6::bigint
+            WHERE EXISTS (SELECT 1 FROM sessions WHERE id = $2)
+            RETURNING *
+        ), touched AS (
+            UPDATE sessions SET last_activity = $7
+            WHERE id = $2 AND EXISTS (SELECT 1 FROM inserted)
+            RETURNING *
+        )
+        """,
+        sessions="touched",
+        users="SELECT * FROM users WHERE session_id = s.id UNION ALL SELECT * FROM inserted"
+    ),
+    "update_user": _returning_session(
+        """
+        WITH updated AS (
+            UPDATE users SET
+                is_typing = CASE WHEN $3 THEN $4 ELSE is_typing END,
+                last_activity = CASE WHEN $5 THEN $6 ELSE last_activity END,
+                username = CASE WHEN $7 THEN $8 ELSE username END,
+                username_key = CASE WHEN $7 THEN $11 ELSE username_key END,
+                color = CASE WHEN $9 THEN $10 ELSE color END
+            WHERE id = $1 AND session_id = $2
+            RETURNING *
+        ), touched AS (
+            UPDATE sessions SET last_activity = $6
+            WHERE id = $2 AND $5 AND EXISTS (SELECT 1 FROM updated)
+        )
+        """,
+        sessions="sessions",
+        users="""
+            SELECT * FROM users WHERE session_id = s.id AND id NOT IN (SELECT id FROM updated)
+            UNION ALL SELECT * FROM updated
+        """,
+        where="WHERE s.id = $2"
+    ),
+    "remove_user": _returning_session(
+        "WITH removed AS (DELETE FROM users WHERE id = $1 AND session_id = $2 RETURNING id)",
+        sessions="sessions",
+        users="SELECT * FROM users WHERE session_id = s.id AND id NOT IN (SELECT id FROM removed)",
+        where="WHERE s.id = $2"
+    ),
+    "flush_code": """
+        UPDATE sessions SET code = $1, last_modified_by = COALESCE($2, last_modified_by), last_activity = $3
+        WHERE id = $4
+    """,
+    "flush_user_activity": "UPDATE users SET last_activity = $1 WHERE id = $2 AND session_id = $3",
+    # Another worker may have recorded newer activity for the same user
+    "flush_presence": """
+        UPDATE users SET is_typing = $1, last_activity = GREATEST(COALESCE(last_activity, 0), $2)
+        WHERE id = $3 AND session_id = $4
+    """,
+    "flush_session_activity": """
+        UPDATE sessions SET last_activity = GREATEST(COALESCE(last_activity, 0), $1) WHERE id = $2
+    """,
+    "clear_typing": """
+        WITH cleared AS (
+            UPDATE users SET is_typing = FALSE
+            WHERE session_id = $1 AND id = ANY($2::text[]) AND is_typing
+            RETURNING 1
+        )
+        SELECT count(*) FROM cleared
+    """,
+    "remove_users": """
+        WITH removed AS (
+            DELETE FROM users
+            WHERE session_id = $1 AND id = ANY($2::text[])
+                AND ($3::bigint IS NULL OR COALESCE(last_activity, 0) < $3)
+            RETURNING id
+        )
+        SELECT COALESCE(array_agg(id), '{}') FROM removed
+    """,
+    "append_document_update": """
+        INSERT INTO document_updates (session_id, data, created_at, version)
+        SELECT $1, $2, $3, $4 WHERE EXISTS (SELECT 1 FROM sessions WHERE id = $1)
+        RETURNING id
+    """,
+    "load_document_snapshot": "SELECT state, last_update_id, version FROM document_snapshots WHERE session_id = $1",
+    "load_document_updates": """
+        SELECT id, data, version FROM document_updates WHERE session_id = $1 AND id > $2 ORDER BY id
+    """,
+    "save_document_snapshot": """
+        INSERT INTO document_snapshots (session_id, state, last_update_id, updated_at, version)
+        VALUES ($1, $2, $3, $4, $5)
+        ON CONFLICT (session_id) DO UPDATE SET
+            state = EXCLUDED.state,
+            last_update_id = EXCLUDED.last_update_id,
+            updated_at = EXCLUDED.updated_at,
+            version = EXCLUDED.version
+    """,
+    "trim_document_updates": "DELETE FROM document_updates WHERE session_id = $1 AND id <= $2",
+    "archive_session": """
+        INSERT INTO session_archive (id, data, archived_at) VALUES ($1, $2, $3)
+        ON CONFLICT (id) DO UPDATE SET data = EXCLUDED.data, archived_at = EXCLUDED.archived_at
+    """,
+    # Deleting the archive row first makes concurrent restores race-free
+    "take_archived_session": "DELETE FROM session_archive WHERE id = $1 RETURNING data",
+    "restore_session": """
+        INSERT INTO sessions (id, code, language, created_at, last_modified_by, last_activity)
+        VALUES ($1, $2, $3, $4, $5, $6) ON CONFLICT (id) DO NOTHING
+    """,
+    "restore_user": """
+        INSERT INTO users (id, session_id, username, color, is_typing, last_activity, username_key)
+        VALUES ($1, $2, $3, $4, $5, $6, $7) ON CONFLICT (id) DO NOTHING
+    """,
+}
+
+
+class PreparedConnection(asyncpg.Connection):
+    """Pooled connection holding its prepared STATEMENTS by name."""
+    
+    __slots__ = ("statements",)
+
+
+# The statements replicas serve
+READ_STATEMENTS = ("load_session", "find_idle_sessions")
+
+
+async def _prepare_statements(conn: PreparedConnection):
+    """Pool init hook: prepare every statement on a new connection."""
+    conn.statements = {name: await conn.prepare(query) for name, query in STATEMENTS.items()}
+
+
+async def _prepare_read_statements(conn: PreparedConnection):
+    """Replica pool init hook: prepare the read-only statements."""
+    conn.statements = {name: await conn.prepare(STATEMENTS[name]) for name in READ_STATEMENTS}
+
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+def _row_to_session(row) -> Session:
+    return Session(
+        id=row['id'],
+        code=row['code'],
+        language=row['language'],
+        createdAt=row['created_at'],
+        lastModifiedBy=row['last_modified_by'],
+        users=[User.model_validate(u) for u in json.loads(row['users'])]
+    )
+
 
 class PostgresDatabase:
     """
     PostgreSQL implementation of the database using asyncpg.
+    
+    Connections come from a pool of pool_min_size to pool_max_size
+    connections, each with every query in STATEMENTS prepared. A public
+    operation holds one connection for all of its queries, including the
+    re-read of the session it returns.
+    
+    With replica_urls, session lookups (get_session on a cache miss) and
+    the idle-session scan are served by healthy read replicas. Writes and
+    the reads that back them stay on the primary, and so does any session
+    written by this process or announced by another one within the last
+    replica_max_lag_seconds, so a replica is never asked for a change it
+    may not have replayed yet.
     """
     
-    def __init__(self, db_url: str):
+    def __init__(
+        self,
+        db_url: str,
+        cache_size: int = 1024,
+        write_interval_ms: int = 1000,
+        write_max_dirty_bytes: int = 256 * 1024,
+        presence_snapshot_seconds: float = 30,
+        notify_bus: bool = True,
+        pool_min_size: int = 2,
+        pool_max_size: int = 10,
+        pool_max_inactive_seconds: float = 300,
+        command_timeout_seconds: Optional[float] = 30,
+        replica_urls: Optional[List[str]] = None,
+        replica_max_lag_seconds: float = 5,
+        replica_health_interval_seconds: float = 5
+    ):
         self.db_url = db_url
-        self.listeners: Dict[str, Set[Callable[[Session], None]]] = {}
+        self.pool_min_size = pool_min_size
+        self.pool_max_size = max(pool_min_size, pool_max_size)
+        self.pool_max_inactive_seconds = pool_max_inactive_seconds
+        self.command_timeout_seconds = command_timeout_seconds
+        self.replicas = ReplicaSet(
+            replica_urls or [], self._create_replica_pool, replica_max_lag_seconds, replica_health_interval_seconds
+        )
+        # Monotonic time of the last known write per session, kept for replica_max_lag_seconds
+        self._last_write: Dict[str, float] = {}
+        # LISTEN/NOTIFY lets every worker sharing this database see each other's updates
+        self.bus = (
+            PostgresNotifyBus(db_url, self._apply_remote_update, self._persist_before_reload)
+            if notify_bus else InProcessBus()
+        )
+        self.cache = SessionCache(cache_size)
+        self.write_buffer = CodeWriteBuffer(self._flush_code_batch, write_interval_ms, write_max_dirty_bytes)
+        self.presence = PresenceTable(self._flush_presence_batch, presence_snapshot_seconds)
         self._pool: Optional[asyncpg.Pool] = None
+        # (connection, task) of the operation the current task is running
+        self._held: ContextVar[Optional[Tuple[Any, asyncio.Task]]] = ContextVar(
+            f"postgres_connection_{id(self)}", default=None
+        )
+        
+        # Metrics
+        self.acquires = 0
+        self.acquire_wait_ms_total = 0.0
+        self.acquire_wait_ms_max = 0.0
+        self.replica_reads = 0
+        self.primary_reads = 0
         
     async def connect(self):
         """Connect to the database and initialize tables."""
         # Wait for DB to be ready? Usually handled by retry logic or docker depends_on healthy
-        self._pool = await asyncpg.create_pool(self.db_url)
         await self._init_tables()
+        self._pool = await asyncpg.create_pool(
+            self.db_url,
+            min_size=self.pool_min_size,
+            max_size=self.pool_max_size,
+            max_inactive_connection_lifetime=self.pool_max_inactive_seconds,
+            command_timeout=self.command_timeout_seconds,
+            connection_class=PreparedConnection,
+            init=_prepare_statements
+        )
+        await self.replicas.start()
+        await self.bus.start()
         
     async def disconnect(self):
         """Close the database connection."""
         if self._pool:
+            await self.write_buffer.stop()
+            await self.presence.stop()
+            await self.bus.stop()
+            await self.replicas.stop()
             await self._pool.close()
             self._pool = None
+        self.cache.clear()
+    
+    def stats(self) -> Dict[str, Any]:
+        """Connection pool counters."""
+        return {
+            "poolSize": self._pool.get_size() if self._pool else 0,
+            "idleConnections": self._pool.get_idle_size() if self._pool else 0,
+            "minSize": self.pool_min_size,
+            "maxSize": self.pool_max_size,
+            "acquires": self.acquires,
+            "acquireWaitMsAvg": round(self.acquire_wait_ms_total / self.acquires, 3) if self.acquires else 0,
+            "acquireWaitMsMax": round(self.acquire_wait_ms_max, 3),
+            "primaryReads": self.primary_reads,
+            "replicaReads": self.replica_reads,
+            "replicas": self.replicas.stats(),
+            "bus": self.bus.stats(),
+        }
+    
+    async def _create_replica_pool(self, url: str) -> asyncpg.Pool:
+        return await asyncpg.create_pool(
+            url,
+            min_size=self.pool_min_size,
+            max_size=self.pool_max_size,
+            max_inactive_connection_lifetime=self.pool_max_inactive_seconds,
+            command_timeout=self.command_timeout_seconds,
+            connection_class=PreparedConnection,
+            init=_prepare_read_statements
+        )
+    
+    def _mark_written(self, *session_ids: str):
+        """Keep reads of these sessions on the primary until replicas have caught up."""
+        if not self.replicas:
+            return
+        
+        now = time.monotonic()
+        if len(self._last_write) > 4096:
+            horizon = now - self.replicas.max_lag_seconds
+            self._last_write = {k: t for k, t in self._last_write.items() if t > horizon}
+        for session_id in session_ids:
+            self._last_write[session_id] = now
+    
+    def _replica_may_serve(self, session_id: str, since: float) -> bool:
+        """Whether no write to the session since `since` can be missing on a healthy replica."""
+        written = self._last_write.get(session_id)
+        return written is None or written < since - self.replicas.max_lag_seconds
+    
+    async def _replica_fetch(self, session_id: Optional[str], statement: str, *args) -> Optional[list]:
+        """
+        Rows of a read-only statement from a healthy replica, or None if the
+        primary has to answer (no replica, a recent write, or a failed read).
+        """
+        started = time.monotonic()
+        if session_id is not None and not self._replica_may_serve(session_id, started):
+            return None
+        replica = self.replicas.pick()
+        if replica is None:
+            return None
+        
+        try:
+            async with replica.pool.acquire() as conn:
+                rows = await conn.statements[statement].fetch(*args)
+        except (OSError, asyncio.TimeoutError, asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+            self.replicas.mark_failed(replica, e)
+            return None
+        
+        # A write that landed while we were reading wins
+        if session_id is not None and not self._replica_may_serve(session_id, started):
+            return None
+        replica.reads += 1
+        self.replica_reads += 1
+        return rows
+    
+    @asynccontextmanager
+    async def _acquire(self) -> AsyncIterator[PreparedConnection]:
+        """
+        A pooled connection for the current operation.
+        
+        Nested calls made by the same task (e.g. the re-read after a write)
+        reuse the connection it already holds instead of taking another.
+        """
+        if not self._pool:
+            await self.connect()
+        
+        task = asyncio.current_task()
+        held = self._held.get()
+        if held is not None and held[1] is task:
+            yield held[0]
+            return
+        
+        started = time.perf_counter()
+        async with self._pool.acquire() as conn:
+            wait_ms = (time.perf_counter() - started) * 1000
+            self.acquires += 1
+            self.acquire_wait_ms_total += wait_ms
+            self.acquire_wait_ms_max = max(self.acquire_wait_ms_max, wait_ms)
+            
+            token = self._held.set((conn, task))
+            try:
+                yield conn
+            finally:
+                self._held.reset(token)
 
     async def _init_tables(self):
         """Initialize database tables."""
-        if not self._pool:
-            raise RuntimeError("Database not connected")
-            
-        async with self._pool.acquire() as conn:
+        # On a connection of its own: pooled connections prepare statements against these tables
+        conn = await asyncpg.connect(self.db_url)
+        try:
             await conn.execute("""
                 CREATE TABLE IF NOT EXISTS sessions (
                     id TEXT PRIMARY KEY,
@@ -51,189 +452,492 @@ class PostgresDatabase:
                     last_activity BIGINT
                 )
             """)
+            
+            await conn.execute("CREATE INDEX IF NOT EXISTS idx_users_session_id ON users(session_id)")
+            await self._init_username_index(conn)
+            
+            await conn.execute("ALTER TABLE sessions ADD COLUMN IF NOT EXISTS last_activity BIGINT")
+            await conn.execute("UPDATE sessions SET last_activity = created_at WHERE last_activity IS NULL")
+            await conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_last_activity ON sessions(last_activity)")
+            
+            # Cold storage for expired sessions
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS session_archive (
+                    id TEXT PRIMARY KEY,
+                    data BYTEA,
+                    archived_at BIGINT
+                )
+            """)
+            
+            # Collaborative document (Yjs) updates, replayed in id order
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS document_updates (
+                    id BIGSERIAL PRIMARY KEY,
+                    session_id TEXT REFERENCES sessions(id) ON DELETE CASCADE,
+                    data BYTEA,
+                    created_at BIGINT
+                )
+            """)
+            await conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_document_updates_session_id ON document_updates(session_id, id)"
+            )
+            # Compacted document state covering every update up to last_update_id
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS document_snapshots (
+                    session_id TEXT PRIMARY KEY REFERENCES sessions(id) ON DELETE CASCADE,
+                    state BYTEA,
+                    last_update_id BIGINT,
+                    updated_at BIGINT
+                )
+            """)
+            # Document version after each update / snapshot, so it survives a reload
+            await conn.execute("ALTER TABLE document_updates ADD COLUMN IF NOT EXISTS version BIGINT")
+            await conn.execute("ALTER TABLE document_snapshots ADD COLUMN IF NOT EXISTS version BIGINT")
+        finally:
+            await conn.close()
 
-    async def create_session(self, session: Session) -> Session:
-        """Create a new session."""
-        if not self._pool:
-            await self.connect()
+    async def _init_username_index(self, conn: asyncpg.Connection):
+        """
+        Make usernames unique per session, so concurrent joins cannot both take one.
+        
+        The index is on username_key (see usernames.username_key), so it
+        matches SQLite. Rows from before the column existed are filled in,
+        and users that clash are renamed (see usernames.renamed_duplicates)
+        before it is created. Runs in one transaction under a lock, so
+        workers starting together do not race.
+        """
+        async with conn.transaction():
+            await conn.execute("LOCK TABLE users IN SHARE ROW EXCLUSIVE MODE")
+            await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS username_key TEXT")
+            await conn.execute("DROP INDEX IF EXISTS idx_users_session_username")
             
-        async with self._pool.acquire() as conn:
+            rows = await conn.fetch("SELECT id, username FROM users WHERE username_key IS NULL")
+            await conn.executemany(
+                "UPDATE users SET username_key = $1 WHERE id = $2",
+                [(username_key(row["username"] or ""), row["id"]) for row in rows]
+            )
+            
+            rows = await conn.fetch("SELECT id, session_id, username, username_key, last_activity FROM users ORDER BY id")
+            renames = renamed_duplicates([tuple(row) for row in rows])
+            for user_id, session_id, old, new in renames:
+                logger.warning("Renamed user %s in session %s from %r to %r: the username clashes", user_id, session_id, old, new)
+            await conn.executemany(
+                "UPDATE users SET username = $1, username_key = $2 WHERE id = $3",
+                [(new, username_key(new), user_id) for user_id, _, _, new in renames]
+            )
+            
+            # Fails startup if it still cannot be built
             await conn.execute(
-                "INSERT INTO sessions (id, code, language, created_at, last_modified_by) VALUES ($1, $2, $3, $4, $5)",
-                session.id, session.code, session.language, session.createdAt, session.lastModifiedBy
+                "CREATE UNIQUE INDEX IF NOT EXISTS idx_users_session_username_key ON users(session_id, username_key)"
+            )
+    
+    async def create_session(self, session: Session) -> Session:
+        """Create a new session."""
+        async with self._acquire() as conn:
+            await conn.statements["insert_session"].fetch(
+                session.id, session.code, session.language, session.createdAt, session.lastModifiedBy, _now_ms()
             )
             
             # Add users if any
             for user in session.users:
                 await self.add_user(session.id, user)
             
-        return session
+        return self.cache.put(session)
     
     async def get_session(self, session_id: str) -> Optional[Session]:
-        """Get a session by ID."""
-        if not self._pool:
-            await self.connect()
-            
-        async with self._pool.acquire() as conn:
-            row = await conn.fetchrow("SELECT * FROM sessions WHERE id = $1", session_id)
-            if not row:
-                return None
-            
-            # Get users
-            user_rows = await conn.fetch("SELECT * FROM users WHERE session_id = $1", session_id)
-            users = []
-            for u_row in user_rows:
-                users.append(User(
-                    id=u_row['id'],
-                    username=u_row['username'],
-                    color=u_row['color'],
-                    isTyping=u_row['is_typing'],
-                    lastActivity=u_row['last_activity']
-                ))
-                
-            return Session(
-                id=row['id'],
-                code=row['code'],
-                language=row['language'],
-                createdAt=row['created_at'],
-                lastModifiedBy=row['last_modified_by'],
-                users=users
-            )
+        """Get a session by ID, served from the cache (or a read replica) when possible."""
+        return await self._get_session(session_id, replica=True)
+    
+    async def _get_session(self, session_id: str, replica: bool = False) -> Optional[Session]:
+        """Get a session by ID; on a cache miss only read from a replica if asked to."""
+        session = self.cache.get(session_id)
+        if session:
+            return session
+        
+        rows = await self._replica_fetch(session_id, "load_session", session_id) if replica else None
+        if rows:
+            session = _row_to_session(rows[0])
+        else:
+            # Not on a replica (yet), or archived: the primary decides
+            async with self._acquire():
+                session = await self._load_session(session_id)
+                if not session:
+                    return await self._restore_session(session_id)
+        
+        # Edits still waiting in the write-behind buffer and live presence win over the rows
+        return self.cache.put(self.presence.overlay(self.write_buffer.overlay(session)))
+    
+    async def _load_session(self, session_id: str) -> Optional[Session]:
+        """Read a session and its users from the database."""
+        # One round trip: the users come back as a JSON array alongside the session row
+        async with self._acquire() as conn:
+            row = await conn.statements["load_session"].fetchrow(session_id)
+        self.primary_reads += 1
+        return _row_to_session(row) if row else None
+    
+    def _cache_row(self, session_id: str, row) -> Optional[Session]:
+        """Cache a session returned by a mutation, with buffered edits and live presence applied."""
+        self._mark_written(session_id)
+        if not row:
+            self.cache.invalidate(session_id)
+            return None
+        return self.cache.put(self.presence.overlay(self.write_buffer.overlay(_row_to_session(row))))
     
     async def update_session(self, session_id: str, updates: Dict[str, Any]) -> Optional[Session]:
         """Update a session."""
-        if not self._pool:
-            await self.connect()
-
-        fields = []
-        values = []
-        idx = 1
-        for key, value in updates.items():
-            if key == 'createdAt':
-                fields.append(f"created_at = ${idx}")
-                values.append(value)
-                idx += 1
-            elif key == 'lastModifiedBy':
-                fields.append(f"last_modified_by = ${idx}")
-                values.append(value)
-                idx += 1
-            elif key in ['code', 'language']:
-                fields.append(f"{key} = ${idx}")
-                values.append(value)
-                idx += 1
-        
-        if fields:
-            values.append(session_id)
-            query = f"UPDATE sessions SET {', '.join(fields)} WHERE id = ${idx}"
-            async with self._pool.acquire() as conn:
-                await conn.execute(query, *values)
-            
-        session = await self.get_session(session_id)
+        if "code" in updates:
+            # A direct code write supersedes anything still buffered
+            self.write_buffer.discard(session_id)
+        
+        if updates.keys() & {"code", "language", "lastModifiedBy", "createdAt"}:
+            # One statement updates the row and returns the whole session
+            async with self._acquire() as conn:
+                row = await conn.statements["update_session"].fetchrow(
+                    session_id,
+                    "code" in updates, updates.get("code"),
+                    "language" in updates, updates.get("language"),
+                    "lastModifiedBy" in updates, updates.get("lastModifiedBy"),
+                    "createdAt" in updates, updates.get("createdAt"),
+                    _now_ms()
+                )
+            session = self._cache_row(session_id, row)
+        else:
+            session = await self._get_session(session_id)
         if session:
-            await self._notify_listeners(session_id)
+            await self._notify_listeners(session_id, session)
+        return session
+    
+    async def stage_code(self, session_id: str, code: str, user_id: Optional[str], last_activity: int) -> Optional[Session]:
+        """
+        Write-behind code update: apply to the cache and notify listeners
+        immediately, persist on the next buffer flush.
+        """
+        session = await self._get_session(session_id)
+        if not session:
+            return None
+        
+        self.write_buffer.stage(session_id, code, user_id, last_activity)
+        session = self.cache.put(self.write_buffer.overlay(session))
+        
+        await self._notify_listeners(session_id, session)
         return session
     
+    async def flush_pending_writes(self):
+        """Persist every buffered code edit and presence change now."""
+        await self.write_buffer.flush()
+        await self.presence.flush()
+    
+    async def _flush_code_batch(self, batch: Dict[str, Dict[str, Any]]):
+        """Write a batch of buffered code edits in a single transaction."""
+        async with self._acquire() as conn:
+            async with conn.transaction():
+                await conn.statements["flush_code"].executemany([
+                    (entry["code"], entry["lastModifiedBy"], entry["lastActivity"], session_id)
+                    for session_id, entry in batch.items()
+                ])
+                await conn.statements["flush_user_activity"].executemany([
+                    (last_activity, user_id, session_id)
+                    for session_id, entry in batch.items()
+                    for user_id, last_activity in entry["users"].items()
+                ])
+        self._mark_written(*batch)
+    
     async def delete_session(self, session_id: str) -> bool:
         """Delete a session."""
-        if not self._pool:
-            await self.connect()
-            
-        async with self._pool.acquire() as conn:
-            result = await conn.execute("DELETE FROM sessions WHERE id = $1", session_id)
-            # result string is mostly "DELETE <count>"
-            if result != "DELETE 0":
-                if session_id in self.listeners:
-                    del self.listeners[session_id]
-                return True
+        async with self._acquire() as conn:
+            deleted = await conn.statements["delete_session"].fetchval(session_id)
+        self._mark_written(session_id)
+        self.cache.invalidate(session_id)
+        self.write_buffer.discard(session_id)
+        self.presence.drop(session_id)
+        if deleted is not None:
+            await self.bus.publish_delete(session_id)
+            return True
         return False
     
-    async def add_user(self, session_id: str, user: User) -> Optional[Session]:
-        """Add a user."""
-        if not self._pool:
-            await self.connect()
-            
-        async with self._pool.acquire() as conn:
-            # Check session exists
-            exists = await conn.fetchval("SELECT 1 FROM sessions WHERE id = $1", session_id)
-            if not exists:
+    async def append_document_update(self, session_id: str, update: bytes, version: int) -> Optional[int]:
+        """
+        Append one (merged) Yjs update and the document version after it to
+        the log; returns its id, or None if the session no longer exists.
+        """
+        async with self._acquire() as conn:
+            try:
+                return await conn.statements["append_document_update"].fetchval(session_id, update, _now_ms(), version)
+            except asyncpg.ForeignKeyViolationError:
+                # Deleted or archived between the check and the insert
                 return None
+    
+    async def load_document(
+        self,
+        session_id: str
+    ) -> Tuple[Optional[bytes], List[Tuple[int, bytes]], Optional[int]]:
+        """
+        A session's document snapshot (if any), the (id, update) log tail
+        after it, and the stored version of the latest of them (None if
+        there are none or they predate stored versions).
+        """
+        async with self._acquire() as conn:
+            async with conn.transaction(isolation="repeatable_read", readonly=True):
+                row = await conn.statements["load_document_snapshot"].fetchrow(session_id)
+                snapshot, after_id, version = (
+                    (bytes(row["state"]), row["last_update_id"], row["version"]) if row else (None, 0, None)
+                )
+                rows = await conn.statements["load_document_updates"].fetch(session_id, after_id)
+        if rows:
+            version = rows[-1]["version"]
+        return snapshot, [(row["id"], bytes(row["data"])) for row in rows], version
+    
+    async def compact_document(self, session_id: str, snapshot: bytes, through_id: int, version: int):
+        """Replace the log up to through_id with a snapshot (at document version), in one transaction."""
+        async with self._acquire() as conn:
+            async with conn.transaction():
+                await conn.statements["save_document_snapshot"].fetch(
+                    session_id, snapshot, through_id, _now_ms(), version
+                )
+                await conn.statements["trim_document_updates"].fetch(session_id, through_id)
+    
+    async def find_idle_sessions(self, idle_since_ms: int, limit: int = 500) -> List[str]:
+        """IDs of sessions with no activity since idle_since_ms, oldest first."""
+        # Archiving re-reads each session from the primary, so a replica's view is enough here
+        rows = await self._replica_fetch(None, "find_idle_sessions", idle_since_ms, limit)
+        if rows is None:
+            async with self._acquire() as conn:
+                rows = await conn.statements["find_idle_sessions"].fetch(idle_since_ms, limit)
+        return [row['id'] for row in rows]
+    
+    async def archive_session(self, session_id: str) -> bool:
+        """Move a session and its users into the compressed archive table."""
+        await self.write_buffer.flush()
+        
+        async with self._acquire() as conn:
+            session = await self._load_session(session_id)
+            if not session:
+                return False
+            session = self.presence.overlay(session)
+            
+            async with conn.transaction():
+                await conn.statements["archive_session"].fetch(session_id, compress_session(session), _now_ms())
+                # Users and document updates go with the session through ON DELETE CASCADE
+                await conn.statements["delete_session"].fetch(session_id)
+        self._mark_written(session_id)
+        
+        self.cache.invalidate(session_id)
+        self.write_buffer.discard(session_id)
+        self.presence.drop(session_id)
+        await self.bus.publish_delete(session_id)
+        return True
+    
+    async def _restore_session(self, session_id: str) -> Optional[Session]:
+        """Bring an archived session back into the live tables."""
+        async with self._acquire() as conn:
+            async with conn.transaction():
+                data = await conn.statements["take_archived_session"].fetchval(session_id)
+                if data is None:
+                    # A concurrent caller may have restored it already
+                    return self.cache.get(session_id)
                 
-            await conn.execute(
-                "INSERT INTO users (id, session_id, username, color, is_typing, last_activity) VALUES ($1, $2, $3, $4, $5, $6)",
-                user.id, session_id, user.username, user.color, user.isTyping, user.lastActivity
-            )
+                session = decompress_session(data)
+                await conn.statements["restore_session"].fetch(
+                    session.id, session.code, session.language, session.createdAt, session.lastModifiedBy, _now_ms()
+                )
+                await conn.statements["restore_user"].executemany([
+                    (u.id, session.id, u.username, u.color, u.isTyping, u.lastActivity, username_key(u.username))
+                    for u in session.users
+                ])
+        self._mark_written(session_id)
+        return self.cache.put(session)
+    
+    async def add_user(self, session_id: str, user: User) -> Optional[Session]:
+        """Add a user; raises UsernameTakenError if the session already has the username."""
+        # Existence check, insert, activity update and re-read in one statement
+        async with self._acquire() as conn:
+            try:
+                row = await conn.statements["add_user"].fetchrow(
+                    user.id, session_id, user.username, user.color, user.isTyping, user.lastActivity, _now_ms(),
+                    username_key(user.username)
+                )
+            except asyncpg.UniqueViolationError as e:
+                if e.constraint_name == "idx_users_session_username_key":
+                    raise UsernameTakenError(session_id, user.username)
+                raise
+            except asyncpg.ForeignKeyViolationError:
+                # The session was deleted while we were inserting
+                row = None
         
-        return await self._notify_and_return(session_id)
+        session = self._cache_row(session_id, row)
+        if session:
+            await self._notify_listeners(session_id, session)
+        return session
     
     async def remove_user(self, session_id: str, user_id: str) -> Optional[Session]:
         """Remove a user."""
-        if not self._pool:
-            await self.connect()
-            
-        async with self._pool.acquire() as conn:
-            await conn.execute("DELETE FROM users WHERE id = $1 AND session_id = $2", user_id, session_id)
-            
-        return await self._notify_and_return(session_id)
+        async with self._acquire() as conn:
+            row = await conn.statements["remove_user"].fetchrow(user_id, session_id)
+        self.presence.forget(session_id, user_id)
+        
+        session = self._cache_row(session_id, row)
+        if session:
+            await self._notify_listeners(session_id, session)
+        return session
     
     async def update_user(self, session_id: str, user_id: str, updates: Dict[str, Any]) -> Optional[Session]:
         """Update a user."""
-        if not self._pool:
-            await self.connect()
-            
-        fields = []
-        values = []
-        idx = 1
-        for key, value in updates.items():
-            if key == 'isTyping':
-                fields.append(f"is_typing = ${idx}")
-                values.append(value)
-                idx += 1
-            elif key == 'lastActivity':
-                fields.append(f"last_activity = ${idx}")
-                values.append(value)
-                idx += 1
-            elif key in ['username', 'color']:
-                fields.append(f"{key} = ${idx}")
-                values.append(value)
-                idx += 1
-                
-        if fields:
-            values.append(user_id)
-            values.append(session_id)
-            query = f"UPDATE users SET {', '.join(fields)} WHERE id = ${idx} AND session_id = ${idx+1}"
-            async with self._pool.acquire() as conn:
-                await conn.execute(query, *values)
-            
+        if not updates.keys() & {"isTyping", "lastActivity", "username", "color"}:
+            return await self._notify_and_return(session_id)
+        
+        # The user row, session activity and re-read in one statement
+        async with self._acquire() as conn:
+            try:
+                row = await conn.statements["update_user"].fetchrow(
+                    user_id, session_id,
+                    "isTyping" in updates, updates.get("isTyping"),
+                    "lastActivity" in updates, updates.get("lastActivity"),
+                    "username" in updates, updates.get("username"),
+                    "color" in updates, updates.get("color"),
+                    username_key(updates["username"]) if "username" in updates else None
+                )
+            except asyncpg.UniqueViolationError as e:
+                if e.constraint_name == "idx_users_session_username_key":
+                    raise UsernameTakenError(session_id, updates["username"])
+                raise
+        self.presence.apply(session_id, user_id, updates)
+        
+        session = self._cache_row(session_id, row)
+        if session:
+            await self._notify_listeners(session_id, session)
+        return session
+    
+    async def update_presence(
+        self,
+        session_id: str,
+        user_id: str,
+        is_typing: Optional[bool] = None,
+        last_activity: Optional[int] = None,
+        notify: bool = True
+    ) -> Optional[Session]:
+        """
+        Change a user's typing flag / last activity in memory only.
+        
+        The users table gets the new values with the next presence snapshot.
+        With notify=False listeners are not told (e.g. for activity alone).
+        """
+        session = await self._get_session(session_id)
+        if not session:
+            return None
+        
+        user = next((u for u in session.users if u.id == user_id), None)
+        if user is None:
+            return session
+        
+        presence = self.presence.update(session_id, user, is_typing, last_activity)
+        self.cache.update_user(session_id, user_id, {
+            "isTyping": presence.is_typing,
+            "lastActivity": presence.last_activity
+        })
+        if not notify:
+            return session
         return await self._notify_and_return(session_id)
     
-    async def _notify_and_return(self, session_id: str) -> Optional[Session]:
-        session = await self.get_session(session_id)
+    async def _flush_presence_batch(self, rows: List[PresenceRow]):
+        """Snapshot presence into the users table (and session activity) in one transaction."""
+        async with self._acquire() as conn:
+            async with conn.transaction():
+                await conn.statements["flush_presence"].executemany(
+                    [(is_typing, last_activity, user_id, session_id) for session_id, user_id, is_typing, last_activity in rows]
+                )
+                await conn.statements["flush_session_activity"].executemany(
+                    [(last_activity, session_id) for session_id, _, _, last_activity in rows]
+                )
+    
+    async def expire_presence(
+        self,
+        session_id: str,
+        stop_typing: List[str],
+        remove: List[str],
+        idle_before: Optional[int] = None
+    ) -> Optional[Session]:
+        """
+        Clear typing flags and remove users in one batch, then notify once.
+        
+        With idle_before (ms), only users whose lastActivity, in memory or
+        as stored by any worker, is older than that are removed.
+        """
+        changed = 0
+        untracked = []
+        for user_id in stop_typing:
+            cleared = self.presence.clear_typing(session_id, user_id)
+            if cleared is None:
+                untracked.append(user_id)
+            changed += bool(cleared)
+        remove = self.presence.idle_users(session_id, remove, idle_before)
+        
+        if untracked or remove:
+            async with self._acquire() as conn:
+                async with conn.transaction():
+                    # Flags loaded from the users table that were never touched in memory
+                    changed += await conn.statements["clear_typing"].fetchval(session_id, untracked)
+                    remove = await conn.statements["remove_users"].fetchval(session_id, remove, idle_before)
+                    changed += len(remove)
+            self._mark_written(session_id)
+        
+        if changed <= 0:
+            # Nothing to tell anyone (and no reason to load an archived session)
+            return None
+        
+        for user_id in stop_typing:
+            self.cache.update_user(session_id, user_id, {"isTyping": False})
+        for user_id in remove:
+            self.cache.remove_user(session_id, user_id)
+            self.presence.forget(session_id, user_id)
+        return await self._notify_and_return(session_id)
+    
+    async def _notify_and_return(self, session_id: str, session: Optional[Session] = None) -> Optional[Session]:
+        """Notify listeners of a session (re-read from the primary unless given) once its connection is released."""
+        if session is None:
+            session = await self._get_session(session_id)
         if session:
-            await self._notify_listeners(session_id)
+            await self._notify_listeners(session_id, session)
         return session
     
+    @property
+    def listeners(self) -> Dict[str, Set[Callable[[Session], None]]]:
+        return self.bus.listeners
+    
     def subscribe(self, session_id: str, callback: Callable[[Session], None]) -> Callable[[], None]:
-        if session_id not in self.listeners:
-            self.listeners[session_id] = set()
+        return self.bus.subscribe(session_id, callback)
+    
+    async def _notify_listeners(self, session_id: str, session: Optional[Session] = None):
+        if session is None:
+            session = await self._get_session(session_id)
+        if not session:
+            return
         
-        self.listeners[session_id].add(callback)
+        await self.bus.publish(session_id, session)
+    
+    async def _persist_before_reload(self, session_id: str):
+        """Commit buffered state of a session that other workers are about to reload."""
+        if session_id in self.write_buffer:
+            await self.write_buffer.flush()
+        if self.presence.dirty:
+            await self.presence.flush()
+    
+    async def _apply_remote_update(
+        self,
+        session_id: str,
+        session: Optional[Session],
+        deleted: bool
+    ) -> Optional[Session]:
+        """Bring the cache in line with a change made by another process."""
+        self._mark_written(session_id)
+        if deleted:
+            self.cache.invalidate(session_id)
+            self.write_buffer.discard(session_id)
+            self.presence.drop(session_id)
+            return None
         
-        def unsubscribe():
-            if session_id in self.listeners:
-                self.listeners[session_id].discard(callback)
+        if session is not None:
+            return self.cache.put(session)
         
-        return unsubscribe
-    
-    async def _notify_listeners(self, session_id: str):
-        if session_id in self.listeners:
-            session = await self.get_session(session_id)
-            if not session:
-                return
-                
-            for listener in self.listeners[session_id]:
-                try:
-                    result = listener(session)
-                    if asyncio.iscoroutine(result):
-                        await result
-                except Exception as e:
-                    print(f"Error in listener: {e}")
+        # The update was too large to inline; reload it
+        self.cache.invalidate(session_id)
+        return await self._get_session(session_id)
@@ -0,0 +1,184 @@
+import asyncio
+from typing import Optional, Dict, Any, Callable, Awaitable, List, Set, Tuple
+from app.models.schemas import Session, User
+
+# (session_id, user_id, is_typing, last_activity)
+PresenceRow = Tuple[str, str, bool, int]
+
+
+class UserPresence:
+    """Ephemeral state of one user: typing flag and last activity (ms)."""
+    
+    __slots__ = ("is_typing", "last_activity")
+    
+    def __init__(self, is_typing: bool, last_activity: int):
+        self.is_typing = is_typing
+        self.last_activity = last_activity
+
+
+class PresenceTable:
+    """
+    In-memory home of isTyping/lastActivity, per session and user.
+    
+    Presence changes on every keystroke but only matters to live clients,
+    so it is kept here instead of being written to the users table on the
+    hot path. Sessions read from the database are overlaid with it, and a
+    background task snapshots changed rows to the database every
+    interval_seconds (and on stop), so a restart loses at most one interval.
+    """
+    
+    def __init__(
+        self,
+        flush_batch: Callable[[List[PresenceRow]], Awaitable[None]],
+        interval_seconds: float = 30
+    ):
+        self._flush_batch = flush_batch
+        self.interval = interval_seconds
+        self._sessions: Dict[str, Dict[str, UserPresence]] = {}
+        self._dirty: Set[Tuple[str, str]] = set()
+        self._task: Optional[asyncio.Task] = None
+        self._lock: Optional[asyncio.Lock] = None
+    
+    def __len__(self) -> int:
+        return sum(len(users) for users in self._sessions.values())
+    
+    @property
+    def dirty(self) -> int:
+        return len(self._dirty)
+    
+    def get(self, session_id: str, user_id: str) -> Optional[UserPresence]:
+        return self._sessions.get(session_id, {}).get(user_id)
+    
+    def update(
+        self,
+        session_id: str,
+        user: User,
+        is_typing: Optional[bool] = None,
+        last_activity: Optional[int] = None
+    ) -> UserPresence:
+        """Change a user's presence (seeded from the user row) and mark it for the next snapshot."""
+        users = self._sessions.setdefault(session_id, {})
+        presence = users.get(user.id)
+        if presence is None:
+            presence = UserPresence(user.isTyping, user.lastActivity)
+            users[user.id] = presence
+        
+        if is_typing is not None:
+            presence.is_typing = is_typing
+        if last_activity is not None:
+            presence.last_activity = last_activity
+        
+        self._dirty.add((session_id, user.id))
+        self._ensure_started()
+        return presence
+    
+    def clear_typing(self, session_id: str, user_id: str) -> Optional[bool]:
+        """Turn a typing flag off; None if the user is not tracked, else whether it changed."""
+        presence = self.get(session_id, user_id)
+        if presence is None:
+            return None
+        if not presence.is_typing:
+            return False
+        
+        presence.is_typing = False
+        self._dirty.add((session_id, user_id))
+        self._ensure_started()
+        return True
+    
+    def apply(self, session_id: str, user_id: str, updates: Dict[str, Any]):
+        """Keep a tracked user in line with a direct write to the users table."""
+        presence = self.get(session_id, user_id)
+        if presence is None:
+            return
+        if "isTyping" in updates:
+            presence.is_typing = updates["isTyping"]
+        if "lastActivity" in updates:
+            presence.last_activity = updates["lastActivity"]
+    
+    def overlay(self, session: Session) -> Session:
+        """Apply in-memory presence to a session read from the database."""
+        users = self._sessions.get(session.id)
+        if not users:
+            return session
+        
+        return session.model_copy(update={"users": [
+            u.model_copy(update={"isTyping": users[u.id].is_typing, "lastActivity": users[u.id].last_activity})
+            if u.id in users else u
+            for u in session.users
+        ]})
+    
+    def idle_users(self, session_id: str, user_ids: List[str], idle_before: Optional[int]) -> List[str]:
+        """The users that have no activity in memory since idle_before (ms)."""
+        if idle_before is None:
+            return list(user_ids)
+        
+        idle = []
+        for user_id in user_ids:
+            presence = self.get(session_id, user_id)
+            if presence is None or presence.last_activity < idle_before:
+                idle.append(user_id)
+        return idle
+    
+    def forget(self, session_id: str, user_id: str):
+        users = self._sessions.get(session_id)
+        if users is not None:
+            users.pop(user_id, None)
+            if not users:
+                del self._sessions[session_id]
+        self._dirty.discard((session_id, user_id))
+    
+    def drop(self, session_id: str):
+        """Forget every user of a session (e.g. when it is deleted or archived)."""
+        for user_id in self._sessions.pop(session_id, {}):
+            self._dirty.discard((session_id, user_id))
+    
+    async def flush(self):
+        """Write every changed presence row to the database in one batch."""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        
+        async with self._lock:
+            if not self._dirty:
+                return
+            
+            dirty, self._dirty = self._dirty, set()
+            rows = []
+            for session_id, user_id in dirty:
+                presence = self.get(session_id, user_id)
+                if presence is not None:
+                    rows.append((session_id, user_id, presence.is_typing, presence.last_activity))
+            
+            try:
+                await self._flush_batch(rows)
+            except Exception as e:
+                print(f"Error snapshotting presence: {e}")
+                self._dirty |= dirty
+                raise
+    
+    async def stop(self):
+        """Stop the snapshot task and write whatever changed."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        
+        await self.flush()
+    
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+    
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                # Shielded so stop() never cancels a snapshot half-way
+                await asyncio.shield(self.flush())
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # Already logged and requeued; retry on the next tick
+                pass
@@ -0,0 +1,129 @@
+import asyncio
+import itertools
+from typing import Optional, Dict, Any, Callable, Awaitable, List
+import asyncpg
+
+# Seconds the replica is behind the primary; 0 once it has replayed everything it received
+REPLICATION_LAG_QUERY = """
+    SELECT CASE
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+
+class Replica:
+    """One read replica and its connection pool."""
+    
+    def __init__(self, url: str):
+        self.url = url
+        self.pool: Optional[asyncpg.Pool] = None
+        self.healthy = False
+        self.lag_seconds: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.reads = 0
+        self.failures = 0
+
+
+class ReplicaSet:
+    """
+    Read replicas of the primary database.
+    
+    Every replica gets its own pool (created by create_pool, so it can
+    prepare statements like the primary). A background task checks each
+    replica every health_interval_seconds: a replica is used only while it
+    answers and its replay lag is at most max_lag_seconds. A replica that
+    fails a query is taken out until the next check brings it back.
+    Healthy replicas are handed out round-robin.
+    """
+    
+    def __init__(
+        self,
+        urls: List[str],
+        create_pool: Callable[[str], Awaitable[asyncpg.Pool]],
+        max_lag_seconds: float = 5,
+        health_interval_seconds: float = 5,
+        health_timeout_seconds: float = 2
+    ):
+        self.replicas = [Replica(url) for url in urls]
+        self._create_pool = create_pool
+        self.max_lag_seconds = max_lag_seconds
+        self.interval = health_interval_seconds
+        self.timeout = health_timeout_seconds
+        self._next = itertools.cycle(self.replicas)
+        self._task: Optional[asyncio.Task] = None
+    
+    def __bool__(self) -> bool:
+        return bool(self.replicas)
+    
+    async def start(self):
+        """Open the replica pools and start the health checks."""
+        await self.check()
+        if self.replicas and (self._task is None or self._task.done()):
+            self._task = asyncio.get_running_loop().create_task(self._run())
+    
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        
+        for replica in self.replicas:
+            replica.healthy = False
+            if replica.pool is not None:
+                await replica.pool.close()
+                replica.pool = None
+    
+    def pick(self) -> Optional[Replica]:
+        """The next healthy replica, or None if there is none."""
+        for _ in range(len(self.replicas)):
+            replica = next(self._next)
+            if replica.healthy:
+                return replica
+        return None
+    
+    def mark_failed(self, replica: Replica, error: BaseException):
+        """Stop using a replica until the next health check passes."""
+        print(f"Error reading from replica {replica.url}: {error!r}")
+        replica.healthy = False
+        replica.failures += 1
+        replica.last_error = repr(error)
+    
+    async def check(self):
+        """Run one health check on every replica."""
+        for replica in self.replicas:
+            try:
+                if replica.pool is None:
+                    replica.pool = await asyncio.wait_for(self._create_pool(replica.url), self.timeout)
+                async with replica.pool.acquire(timeout=self.timeout) as conn:
+                    lag = await conn.fetchval(REPLICATION_LAG_QUERY, timeout=self.timeout)
+            except Exception as e:
+                if replica.healthy:
+                    print(f"Error checking replica {replica.url}: {e!r}")
+                replica.healthy = False
+                replica.last_error = repr(e)
+                continue
+            
+            replica.lag_seconds = float(lag)
+            replica.healthy = replica.lag_seconds <= self.max_lag_seconds
+            replica.last_error = None if replica.healthy else f"lag {replica.lag_seconds:.1f}s"
+    
+    def stats(self) -> List[Dict[str, Any]]:
+        return [
+            {
+                "healthy": replica.healthy,
+                "lagSeconds": replica.lag_seconds,
+                "reads": replica.reads,
+                "failures": replica.failures,
+                "lastError": replica.last_error,
+            }
+            for replica in self.replicas
+        ]
+    
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.check()
@@ -0,0 +1,15 @@
+import zlib
+from app.models.schemas import Session
+
+# Archived sessions are stored as zlib-compressed Session JSON
+COMPRESSION_LEVEL = 6
+
+
+def compress_session(session: Session) -> bytes:
+    """Serialize a session for the cold archive table."""
+    return zlib.compress(session.model_dump_json().encode("utf-8"), COMPRESSION_LEVEL)
+
+
+def decompress_session(data: bytes) -> Session:
+    """Inverse of compress_session."""
+    return Session.model_validate_json(zlib.decompress(data))
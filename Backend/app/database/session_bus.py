@@ -0,0 +1,293 @@
+import asyncio
+import json
+import uuid
+from typing import Optional, Dict, Set, Callable, Awaitable
+from app.models.schemas import Session
+
+
+class InProcessBus:
+    """
+    Session update bus that only reaches listeners in this process.
+    
+    Used by SQLite and in tests, and as the local dispatch layer of the
+    cross-process buses.
+    """
+    
+    def __init__(self):
+        self.listeners: Dict[str, Set[Callable[[Session], None]]] = {}
+    
+    async def start(self):
+        pass
+    
+    async def stop(self):
+        pass
+    
+    def subscribe(self, session_id: str, callback: Callable[[Session], None]) -> Callable[[], None]:
+        """Subscribe to session updates."""
+        if session_id not in self.listeners:
+            self.listeners[session_id] = set()
+        
+        self.listeners[session_id].add(callback)
+        
+        def unsubscribe():
+            listeners = self.listeners.get(session_id)
+            if listeners is not None:
+                listeners.discard(callback)
+                if not listeners:
+                    # Do not keep an entry for every session ever opened
+                    del self.listeners[session_id]
+        
+        return unsubscribe
+    
+    def drop(self, session_id: str):
+        """Forget every listener of a session."""
+        self.listeners.pop(session_id, None)
+    
+    async def publish(self, session_id: str, session: Session):
+        """Deliver a session update to every subscriber."""
+        await self._dispatch(session_id, session)
+    
+    async def publish_delete(self, session_id: str):
+        """Announce that a session was deleted."""
+        self.drop(session_id)
+    
+    def stats(self) -> dict:
+        return {}
+    
+    async def _dispatch(self, session_id: str, session: Session):
+        """Notify all local listeners of a session update."""
+        for listener in list(self.listeners.get(session_id, ())):
+            try:
+                result = listener(session)
+                if asyncio.iscoroutine(result):
+                    await result
+            except Exception as e:
+                print(f"Error in listener: {e}")
+
+
+class PostgresNotifyBus(InProcessBus):
+    """
+    Session update bus shared by every process on the same Postgres database.
+    
+    Updates are delivered to local listeners directly and announced to other
+    processes with NOTIFY. A dedicated asyncpg connection LISTENs for the
+    announcements of other processes and hands them to on_remote_update, which
+    refreshes the backend's cache and returns the session to dispatch locally.
+    
+    Announcements are coalesced per session: while one is being sent, later
+    updates of that session only replace the next one, so a burst of
+    keystrokes costs a NOTIFY per round trip rather than one per keystroke.
+    A session too large to inline is announced without its state, after
+    before_reload(session_id) has made what receivers will reload durable.
+    
+    Received announcements are queued and applied one at a time, in the
+    order they arrived. If the LISTEN connection drops, it is reopened with
+    backoff, and every session with local listeners is reloaded, since its
+    announcements may have been missed meanwhile.
+    """
+    
+    CHANNEL = "codecollab_session_updates"
+    # NOTIFY payloads must stay below 8000 bytes
+    MAX_PAYLOAD_BYTES = 7900
+    # Delay before reconnecting the LISTEN connection, doubled per failure
+    RECONNECT_MIN_SECONDS = 0.5
+    RECONNECT_MAX_SECONDS = 30
+    
+    def __init__(
+        self,
+        db_url: str,
+        on_remote_update: Callable[[str, Optional[Session], bool], Awaitable[Optional[Session]]],
+        before_reload: Optional[Callable[[str], Awaitable[None]]] = None
+    ):
+        super().__init__()
+        self.db_url = db_url
+        self.origin = uuid.uuid4().hex
+        self._on_remote_update = on_remote_update
+        self._before_reload = before_reload
+        self._conn = None
+        self._send_lock: Optional[asyncio.Lock] = None
+        self._stopping = False
+        self._reconnector: Optional[asyncio.Task] = None
+        # Remote announcements, applied in order by a single consumer
+        self._inbox: Optional[asyncio.Queue] = None
+        self._consumer: Optional[asyncio.Task] = None
+        # Latest unannounced update and the task announcing it, per session
+        self._outbox: Dict[str, Session] = {}
+        self._senders: Dict[str, asyncio.Task] = {}
+        
+        # Metrics
+        self.published = 0
+        self.notified = 0
+        self.reloads = 0
+        self.reconnects = 0
+    
+    async def start(self):
+        if self._conn is not None:
+            return
+        
+        self._stopping = False
+        self._send_lock = asyncio.Lock()
+        await self._connect()
+    
+    async def stop(self):
+        self._stopping = True
+        if self._senders:
+            await asyncio.gather(*self._senders.values(), return_exceptions=True)
+        
+        for task in (self._reconnector, self._consumer):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._reconnector = None
+        self._consumer = None
+        
+        if self._conn is None:
+            return
+        
+        conn, self._conn = self._conn, None
+        try:
+            conn.remove_termination_listener(self._on_terminated)
+            await conn.remove_listener(self.CHANNEL, self._on_notify)
+        finally:
+            await conn.close()
+    
+    async def _connect(self):
+        import asyncpg
+        conn = await asyncpg.connect(self.db_url)
+        conn.add_termination_listener(self._on_terminated)
+        await conn.add_listener(self.CHANNEL, self._on_notify)
+        self._conn = conn
+    
+    def _on_terminated(self, connection):
+        """asyncpg termination callback: the LISTEN connection is gone."""
+        if self._stopping or connection is not self._conn:
+            return
+        
+        print("Error: session bus connection lost, reconnecting")
+        self._conn = None
+        if self._reconnector is None or self._reconnector.done():
+            self._reconnector = asyncio.get_running_loop().create_task(self._reconnect())
+    
+    async def _reconnect(self):
+        delay = self.RECONNECT_MIN_SECONDS
+        while not self._stopping:
+            try:
+                await self._connect()
+            except Exception as e:
+                print(f"Error reconnecting session bus: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.RECONNECT_MAX_SECONDS)
+                continue
+            
+            self.reconnects += 1
+            # Announcements sent while we were away are lost: reload what we serve
+            for session_id in list(self.listeners):
+                self._enqueue({"sessionId": session_id})
+            return
+    
+    async def publish(self, session_id: str, session: Session):
+        await self._dispatch(session_id, session)
+        
+        self.published += 1
+        self._outbox[session_id] = session
+        if session_id not in self._senders:
+            self._senders[session_id] = asyncio.get_running_loop().create_task(self._announce(session_id))
+    
+    async def publish_delete(self, session_id: str):
+        self.drop(session_id)
+        # A pending update must not follow the delete
+        self._outbox.pop(session_id, None)
+        await self._notify(json.dumps({"origin": self.origin, "sessionId": session_id, "deleted": True}))
+    
+    def stats(self) -> dict:
+        return {
+            "published": self.published,
+            "notified": self.notified,
+            "reloads": self.reloads,
+            "reconnects": self.reconnects,
+            "pending": len(self._outbox),
+            "inbox": self._inbox.qsize() if self._inbox is not None else 0,
+        }
+    
+    async def _announce(self, session_id: str):
+        """Send the latest update of a session until no newer one is waiting."""
+        try:
+            while session_id in self._outbox:
+                session = self._outbox.pop(session_id)
+                
+                message = {"origin": self.origin, "sessionId": session_id, "session": session.model_dump()}
+                payload = json.dumps(message)
+                if len(payload.encode()) > self.MAX_PAYLOAD_BYTES:
+                    # Too large to inline; receivers reload the session from the database,
+                    # so it has to hold this state first
+                    del message["session"]
+                    payload = json.dumps(message)
+                    self.reloads += 1
+                    if self._before_reload:
+                        try:
+                            await self._before_reload(session_id)
+                        except Exception as e:
+                            print(f"Error persisting session {session_id} before reload: {e}")
+                
+                await self._notify(payload)
+        finally:
+            self._senders.pop(session_id, None)
+    
+    async def _notify(self, payload: str):
+        if self._conn is None:
+            return
+        
+        try:
+            # A single connection runs one statement at a time
+            async with self._send_lock:
+                await self._conn.execute("SELECT pg_notify($1, $2)", self.CHANNEL, payload)
+            self.notified += 1
+        except Exception as e:
+            print(f"Error publishing session update: {e}")
+    
+    def _on_notify(self, connection, pid: int, channel: str, payload: str):
+        """asyncpg listener callback; runs on the event loop."""
+        try:
+            message = json.loads(payload)
+        except json.JSONDecodeError:
+            return
+        
+        if message.get("origin") == self.origin:
+            return
+        
+        self._enqueue(message)
+    
+    def _enqueue(self, message: dict):
+        if self._inbox is None:
+            self._inbox = asyncio.Queue()
+        self._inbox.put_nowait(message)
+        if self._consumer is None or self._consumer.done():
+            self._consumer = asyncio.get_running_loop().create_task(self._consume())
+    
+    async def _consume(self):
+        """Apply remote announcements one at a time, oldest first."""
+        while True:
+            message = await self._inbox.get()
+            try:
+                await self._handle_remote(message)
+            except Exception as e:
+                print(f"Error applying remote session update: {e}")
+    
+    async def _handle_remote(self, message: dict):
+        session_id = message["sessionId"]
+        deleted = bool(message.get("deleted"))
+        session = Session.model_validate(message["session"]) if message.get("session") else None
+        
+        try:
+            session = await self._on_remote_update(session_id, session, deleted)
+        except Exception as e:
+            print(f"Error applying remote session update: {e}")
+            return
+        
+        if deleted:
+            self.drop(session_id)
+        elif session:
+            await self._dispatch(session_id, session)
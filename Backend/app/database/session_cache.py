@@ -0,0 +1,110 @@
+from collections import OrderedDict
+from typing import Optional, Dict, Any
+from app.models.schemas import Session, User
+
+# Fields that may be written through to a cached session or user
+SESSION_FIELDS = {"code", "language", "lastModifiedBy", "createdAt"}
+USER_FIELDS = {"isTyping", "lastActivity", "username", "color"}
+
+
+class SessionCache:
+    """
+    Bounded LRU cache of Session objects keyed by session id.
+    
+    Backends keep it current on every write (write-through), so reads and
+    the read-back after a write are served from memory. Cached sessions are
+    never mutated in place: every write replaces the entry with a copy, so
+    objects already handed to callers or listeners stay consistent.
+    """
+    
+    def __init__(self, max_size: int = 1024):
+        self.max_size = max_size
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def __len__(self) -> int:
+        return len(self._sessions)
+    
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self._sessions
+    
+    def get(self, session_id: str) -> Optional[Session]:
+        """Return a cached session and mark it as recently used."""
+        session = self._sessions.get(session_id)
+        if session is None:
+            self.misses += 1
+            return None
+        
+        self.hits += 1
+        self._sessions.move_to_end(session_id)
+        return session
+    
+    def put(self, session: Session) -> Session:
+        """Insert or replace a session, evicting the least recently used."""
+        self._sessions[session.id] = session
+        self._sessions.move_to_end(session.id)
+        
+        while len(self._sessions) > self.max_size:
+            self._sessions.popitem(last=False)
+            self.evictions += 1
+        
+        return session
+    
+    def invalidate(self, session_id: str):
+        """Drop a session from the cache."""
+        self._sessions.pop(session_id, None)
+    
+    def clear(self):
+        """Drop every cached session."""
+        self._sessions.clear()
+    
+    def update_session(self, session_id: str, updates: Dict[str, Any]) -> Optional[Session]:
+        """Apply session-level field updates. Returns None if not cached."""
+        session = self._sessions.get(session_id)
+        if session is None:
+            return None
+        
+        fields = {k: v for k, v in updates.items() if k in SESSION_FIELDS}
+        return self.put(session.model_copy(update=fields))
+    
+    def add_user(self, session_id: str, user: User) -> Optional[Session]:
+        """Append a user to a cached session. Returns None if not cached."""
+        session = self._sessions.get(session_id)
+        if session is None:
+            return None
+        
+        return self.put(session.model_copy(update={"users": session.users + [user]}))
+    
+    def remove_user(self, session_id: str, user_id: str) -> Optional[Session]:
+        """Remove a user from a cached session. Returns None if not cached."""
+        session = self._sessions.get(session_id)
+        if session is None:
+            return None
+        
+        users = [u for u in session.users if u.id != user_id]
+        return self.put(session.model_copy(update={"users": users}))
+    
+    def update_user(self, session_id: str, user_id: str, updates: Dict[str, Any]) -> Optional[Session]:
+        """Apply user field updates in a cached session. Returns None if not cached."""
+        session = self._sessions.get(session_id)
+        if session is None:
+            return None
+        
+        fields = {k: v for k, v in updates.items() if k in USER_FIELDS}
+        users = [
+            u.model_copy(update=fields) if u.id == user_id else u
+            for u in session.users
+        ]
+        return self.put(session.model_copy(update={"users": users}))
+    
+    def stats(self) -> Dict[str, int]:
+        """Cache counters for monitoring."""
+        return {
+            "size": len(self._sessions),
+            "maxSize": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -1,21 +1,90 @@
 import aiosqlite
 import json
+import logging
+import sqlite3
 import asyncio
 import time
-from typing import Optional, Dict, Set, Callable, Any, List
+from contextlib import asynccontextmanager
+from typing import Optional, Dict, Set, Callable, Any, List, Tuple, AsyncIterator
 from app.models.schemas import Session, User
+from app.database.session_cache import SessionCache
+from app.database.write_behind import CodeWriteBuffer
+from app.database.write_batcher import WriteBatcher
+from app.database.presence import PresenceTable, PresenceRow
+from app.database.session_bus import InProcessBus
+from app.database.session_archive import compress_session, decompress_session
+from app.database.errors import UsernameTakenError
+from app.database.usernames import username_key, renamed_duplicates
 
 DB_PATH = "codecollab.db"
 
+logger = logging.getLogger(__name__)
+
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+SESSION_WITH_USERS_QUERY = """
+    SELECT s.id, s.code, s.language, s.created_at, s.last_modified_by,
+           (SELECT json_group_array(json_object(
+                       'id', u.id,
+                       'username', u.username,
+                       'color', u.color,
+                       'isTyping', json(CASE WHEN u.is_typing THEN 'true' ELSE 'false' END),
+                       'lastActivity', u.last_activity
+                   ))
+            FROM (SELECT * FROM users WHERE session_id = s.id ORDER BY rowid) u) AS users
+    FROM sessions s
+    WHERE s.id = ?
+"""
+
 class SQLiteDatabase:
     """
     SQLite implementation of the database.
+    
+    With journal_mode "wal", one connection does every write and a pool of
+    reader_pool_size read-only connections serves the session and document
+    loads, so reads run in parallel with (and never wait for) a write.
+    Other journal modes, or a pool size of 0, use the single connection
+    for everything.
+    
+    Writes are group-committed: each mutation queues its statements with
+    the WriteBatcher, which commits everything queued in the same tick as
+    one transaction before the mutations return.
     """
     
-    def __init__(self, db_path: str = DB_PATH):
+    def __init__(
+        self,
+        db_path: str = DB_PATH,
+        cache_size: int = 1024,
+        write_interval_ms: int = 1000,
+        write_max_dirty_bytes: int = 256 * 1024,
+        presence_snapshot_seconds: float = 30,
+        journal_mode: str = "wal",
+        synchronous: str = "normal",
+        mmap_size_bytes: int = 256 * 1024 * 1024,
+        page_cache_kib: int = 64 * 1024,
+        busy_timeout_ms: int = 5000,
+        reader_pool_size: int = 4,
+        write_batch_size: int = 256,
+        write_batch_delay_ms: float = 2
+    ):
         self.db_path = db_path
-        self.listeners: Dict[str, Set[Callable[[Session], None]]] = {}
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
+        self.mmap_size_bytes = mmap_size_bytes
+        self.page_cache_kib = page_cache_kib
+        self.busy_timeout_ms = busy_timeout_ms
+        self.reader_pool_size = reader_pool_size
+        self.bus = InProcessBus()
+        self.cache = SessionCache(cache_size)
+        self.write_buffer = CodeWriteBuffer(self._flush_code_batch, write_interval_ms, write_max_dirty_bytes)
+        self.presence = PresenceTable(self._flush_presence_batch, presence_snapshot_seconds)
+        self.writes = WriteBatcher(lambda: self._db, write_batch_size, write_batch_delay_ms)
+        # The writer; also serves reads when there is no reader pool
         self._db: Optional[aiosqlite.Connection] = None
+        self._readers: List[aiosqlite.Connection] = []
+        self._idle_readers: Optional[asyncio.Queue] = None
         
     async def connect(self):
         """Connect to the database and initialize tables."""
@@ -24,13 +93,82 @@ class SQLiteDatabase:
             
         self._db = await aiosqlite.connect(self.db_path, check_same_thread=False)
         self._db.row_factory = aiosqlite.Row
+        journal_mode = await self._configure(self._db)
         await self._init_tables()
         
+        # Readers only help once WAL lets them run alongside the writer
+        if journal_mode == "wal" and self.db_path != ":memory:":
+            self._idle_readers = asyncio.Queue()
+            for _ in range(self.reader_pool_size):
+                reader = await aiosqlite.connect(f"file:{self.db_path}?mode=ro", uri=True, check_same_thread=False)
+                reader.row_factory = aiosqlite.Row
+                await self._configure(reader, read_only=True)
+                self._readers.append(reader)
+                self._idle_readers.put_nowait(reader)
+        await self.bus.start()
+        
     async def disconnect(self):
         """Close the database connection."""
         if self._db:
+            await self.write_buffer.stop()
+            await self.presence.stop()
+            await self.writes.stop()
+            await self.bus.stop()
+            for reader in self._readers:
+                await reader.close()
+            self._readers.clear()
+            self._idle_readers = None
             await self._db.close()
             self._db = None
+        self.cache.clear()
+    
+    async def _configure(self, connection: aiosqlite.Connection, read_only: bool = False) -> str:
+        """Apply the connection pragmas; returns the journal mode in effect."""
+        await connection.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout_ms)}")
+        await connection.execute(f"PRAGMA mmap_size = {int(self.mmap_size_bytes)}")
+        # Negative cache_size is in KiB rather than pages
+        await connection.execute(f"PRAGMA cache_size = -{int(self.page_cache_kib)}")
+        if read_only:
+            await connection.execute("PRAGMA query_only = 1")
+            return self.journal_mode
+        
+        async with connection.execute(f"PRAGMA journal_mode = {self.journal_mode}") as cursor:
+            journal_mode = (await cursor.fetchone())[0].lower()
+        # NORMAL is durable with WAL except for the last commits before a power loss
+        await connection.execute(f"PRAGMA synchronous = {self.synchronous}")
+        await connection.execute("PRAGMA temp_store = MEMORY")
+        return journal_mode
+    
+    def stats(self) -> Dict[str, Any]:
+        """Write batching and connection counters."""
+        return {
+            "writes": self.writes.stats(),
+            "readers": len(self._readers),
+            "idleReaders": self._idle_readers.qsize() if self._idle_readers is not None else 0,
+        }
+    
+    async def _write(self, work: Callable[[aiosqlite.Connection], Any]) -> Any:
+        """Run statements in the next group commit; returns work's result once committed."""
+        if not self._db:
+            await self.connect()
+        return await self.writes.run(work)
+    
+    @asynccontextmanager
+    async def _reader(self) -> AsyncIterator[aiosqlite.Connection]:
+        """A read-only connection from the pool (the writer if there is none)."""
+        if not self._db:
+            await self.connect()
+        
+        idle = self._idle_readers
+        if idle is None or not self._readers:
+            yield self._db
+            return
+        
+        reader = await idle.get()
+        try:
+            yield reader
+        finally:
+            idle.put_nowait(reader)
 
     async def _init_tables(self):
         """Initialize database tables."""
@@ -53,6 +191,22 @@ class SQLiteDatabase:
         except Exception:
              pass # Column likely exists
         
+        try:
+             await self._db.execute("ALTER TABLE sessions ADD COLUMN last_activity INTEGER")
+             await self._db.execute("UPDATE sessions SET last_activity = created_at WHERE last_activity IS NULL")
+        except Exception:
+             pass # Column likely exists
+        await self._db.execute("CREATE INDEX IF NOT EXISTS idx_sessions_last_activity ON sessions(last_activity)")
+        
+        # Cold storage for expired sessions
+        await self._db.execute("""
+            CREATE TABLE IF NOT EXISTS session_archive (
+                id TEXT PRIMARY KEY,
+                data BLOB,
+                archived_at INTEGER
+            )
+        """)
+        
         await self._db.execute("""
             CREATE TABLE IF NOT EXISTS users (
                 id TEXT PRIMARY KEY,
@@ -64,58 +218,122 @@ class SQLiteDatabase:
                 FOREIGN KEY(session_id) REFERENCES sessions(id) ON DELETE CASCADE
             )
         """)
+        await self._db.execute("CREATE INDEX IF NOT EXISTS idx_users_session_id ON users(session_id)")
+        await self._init_username_index()
+        
+        # Collaborative document (Yjs) updates, replayed in id order
+        await self._db.execute("""
+            CREATE TABLE IF NOT EXISTS document_updates (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT,
+                data BLOB,
+                created_at INTEGER
+            )
+        """)
+        await self._db.execute(
+            "CREATE INDEX IF NOT EXISTS idx_document_updates_session_id ON document_updates(session_id, id)"
+        )
+        # Compacted document state covering every update up to last_update_id
+        await self._db.execute("""
+            CREATE TABLE IF NOT EXISTS document_snapshots (
+                session_id TEXT PRIMARY KEY,
+                state BLOB,
+                last_update_id INTEGER,
+                updated_at INTEGER
+            )
+        """)
+        # Document version after each update / snapshot, so it survives a reload
+        for table in ("document_updates", "document_snapshots"):
+            try:
+                await self._db.execute(f"ALTER TABLE {table} ADD COLUMN version INTEGER")
+            except Exception:
+                pass # Column likely exists
         await self._db.commit()
 
+    async def _init_username_index(self):
+        """
+        Make usernames unique per session, so concurrent joins cannot both take one.
+        
+        The index is on username_key (see usernames.username_key). Rows from
+        before the column existed are filled in, and users that clash are
+        renamed (see usernames.renamed_duplicates) before it is created.
+        """
+        try:
+            await self._db.execute("ALTER TABLE users ADD COLUMN username_key TEXT")
+        except Exception:
+            pass # Column likely exists
+        # Replaced by the username_key index (lower() is ASCII-only here)
+        await self._db.execute("DROP INDEX IF EXISTS idx_users_session_username")
+        
+        async with self._db.execute("SELECT id, username FROM users WHERE username_key IS NULL") as cursor:
+            rows = await cursor.fetchall()
+        await self._db.executemany(
+            "UPDATE users SET username_key = ? WHERE id = ?",
+            [(username_key(row["username"] or ""), row["id"]) for row in rows]
+        )
+        
+        async with self._db.execute(
+            "SELECT id, session_id, username, username_key, last_activity FROM users ORDER BY rowid"
+        ) as cursor:
+            renames = renamed_duplicates([tuple(row) for row in await cursor.fetchall()])
+        for user_id, session_id, old, new in renames:
+            logger.warning("Renamed user %s in session %s from %r to %r: the username clashes", user_id, session_id, old, new)
+        await self._db.executemany(
+            "UPDATE users SET username = ?, username_key = ? WHERE id = ?",
+            [(new, username_key(new), user_id) for user_id, _, _, new in renames]
+        )
+        
+        # Fails startup if it still cannot be built
+        await self._db.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_users_session_username_key ON users(session_id, username_key)"
+        )
+    
     async def create_session(self, session: Session) -> Session:
         """Create a new session."""
-        if not self._db:
-            await self.connect()
-            
-        async with self._db.execute(
-            "INSERT INTO sessions (id, code, language, created_at, last_modified_by) VALUES (?, ?, ?, ?, ?)",
-            (session.id, session.code, session.language, session.createdAt, session.lastModifiedBy)
-        ):
-            await self._db.commit()
+        await self._write(lambda connection: connection.execute(
+            "INSERT INTO sessions (id, code, language, created_at, last_modified_by, last_activity) VALUES (?, ?, ?, ?, ?, ?)",
+            (session.id, session.code, session.language, session.createdAt, session.lastModifiedBy, _now_ms())
+        ))
             
         # Users should be empty on creation generally, but handle if not
         for user in session.users:
             await self.add_user(session.id, user)
             
-        return session
+        return self.cache.put(session)
     
     async def get_session(self, session_id: str) -> Optional[Session]:
-        """Get a session by ID."""
+        """Get a session by ID, served from the cache when possible."""
+        session = self.cache.get(session_id)
+        if session:
+            return session
+        
+        session = await self._load_session(session_id)
+        if session:
+            # Edits still waiting in the write-behind buffer and live presence win over the rows
+            session = self.cache.put(self.presence.overlay(self.write_buffer.overlay(session)))
+        else:
+            session = await self._restore_session(session_id)
+        return session
+    
+    async def _load_session(self, session_id: str) -> Optional[Session]:
+        """Read a session and its users from the database."""
         if not self._db:
             await self.connect()
             
-        async with self._db.execute("SELECT * FROM sessions WHERE id = ?", (session_id,)) as cursor:
-            row = await cursor.fetchone()
-            if not row:
-                return None
-            
-            # print(f"DEBUG: Found session {session_id}: {dict(row)}")
-            session_data = dict(row)
+        # One round trip: the users come back as a JSON array alongside the session row
+        async with self._reader() as connection:
+            async with connection.execute(SESSION_WITH_USERS_QUERY, (session_id,)) as cursor:
+                row = await cursor.fetchone()
+        if not row:
+            return None
             
-        # Get users
-        async with self._db.execute("SELECT * FROM users WHERE session_id = ?", (session_id,)) as cursor:
-            user_rows = await cursor.fetchall()
-            users = []
-            for u_row in user_rows:
-                users.append(User(
-                    id=u_row['id'],
-                    username=u_row['username'],
-                    color=u_row['color'],
-                    isTyping=bool(u_row['is_typing']),
-                    lastActivity=u_row['last_activity']
-                ))
-                
         return Session(
-            id=session_data['id'],
-            code=session_data['code'],
-            language=session_data['language'],
-            createdAt=session_data['created_at'],
-            lastModifiedBy=session_data.get('last_modified_by'),
-            users=users
+            id=row['id'],
+            code=row['code'],
+            language=row['language'],
+            createdAt=row['created_at'],
+            lastModifiedBy=row['last_modified_by'],
+            users=[User.model_validate(u) for u in json.loads(row['users'])]
         )
     
     async def update_session(self, session_id: str, updates: Dict[str, Any]) -> Optional[Session]:
@@ -138,57 +356,282 @@ class SQLiteDatabase:
                 values.append(value)
         
         if fields:
+            fields.append("last_activity = ?")
+            values.append(_now_ms())
             values.append(session_id)
             query = f"UPDATE sessions SET {', '.join(fields)} WHERE id = ?"
-            await self._db.execute(query, values)
-            await self._db.commit()
+            await self._write(lambda connection: connection.execute(query, values))
             
         # Check if we need to update users (not typical via update_session but possible)
         # For simplicity, we assume update_session mainly updates session-level fields
         
-        session = await self.get_session(session_id)
+        if "code" in updates:
+            # A direct code write supersedes anything still buffered
+            self.write_buffer.discard(session_id)
+        
+        session = self.cache.update_session(session_id, updates) or await self.get_session(session_id)
         if session:
-            await self._notify_listeners(session_id)
+            await self._notify_listeners(session_id, session)
         return session
     
+    async def stage_code(self, session_id: str, code: str, user_id: Optional[str], last_activity: int) -> Optional[Session]:
+        """
+        Write-behind code update: apply to the cache and notify listeners
+        immediately, persist on the next buffer flush.
+        """
+        session = await self.get_session(session_id)
+        if not session:
+            return None
+        
+        self.write_buffer.stage(session_id, code, user_id, last_activity)
+        session = self.cache.put(self.write_buffer.overlay(session))
+        
+        await self._notify_listeners(session_id, session)
+        return session
+    
+    async def flush_pending_writes(self):
+        """Persist every buffered code edit and presence change now."""
+        await self.write_buffer.flush()
+        await self.presence.flush()
+    
+    async def _flush_code_batch(self, batch: Dict[str, Dict[str, Any]]):
+        """Write a batch of buffered code edits in a single transaction."""
+        async def write(connection):
+            await connection.executemany(
+                "UPDATE sessions SET code = ?, last_modified_by = COALESCE(?, last_modified_by), last_activity = ? "
+                "WHERE id = ?",
+                [
+                    (entry["code"], entry["lastModifiedBy"], entry["lastActivity"], session_id)
+                    for session_id, entry in batch.items()
+                ]
+            )
+            await connection.executemany(
+                "UPDATE users SET last_activity = ? WHERE id = ? AND session_id = ?",
+                [
+                    (last_activity, user_id, session_id)
+                    for session_id, entry in batch.items()
+                    for user_id, last_activity in entry["users"].items()
+                ]
+            )
+        
+        await self._write(write)
+    
     async def delete_session(self, session_id: str) -> bool:
         """Delete a session."""
+        async def write(connection):
+            await connection.execute("DELETE FROM document_updates WHERE session_id = ?", (session_id,))
+            await connection.execute("DELETE FROM document_snapshots WHERE session_id = ?", (session_id,))
+            async with connection.execute("DELETE FROM sessions WHERE id = ?", (session_id,)) as cursor:
+                return cursor.rowcount
+        
+        deleted = await self._write(write)
+        self.cache.invalidate(session_id)
+        self.write_buffer.discard(session_id)
+        self.presence.drop(session_id)
+        if deleted > 0:
+            await self.bus.publish_delete(session_id)
+            return True
+        return False
+    
+    async def append_document_update(self, session_id: str, update: bytes, version: int) -> Optional[int]:
+        """
+        Append one (merged) Yjs update and the document version after it to
+        the log; returns its id, or None if the session no longer exists.
+        """
+        async def write(connection):
+            async with connection.execute(
+                "INSERT INTO document_updates (session_id, data, created_at, version) "
+                "SELECT ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM sessions WHERE id = ?)",
+                (session_id, update, _now_ms(), version, session_id)
+            ) as cursor:
+                return cursor.lastrowid if cursor.rowcount else None
+        
+        return await self._write(write)
+    
+    async def load_document(
+        self,
+        session_id: str
+    ) -> Tuple[Optional[bytes], List[Tuple[int, bytes]], Optional[int]]:
+        """
+        A session's document snapshot (if any), the (id, update) log tail
+        after it, and the stored version of the latest of them (None if
+        there are none or they predate stored versions).
+        """
+        if not self._db:
+            await self.connect()
+        
+        async with self._reader() as connection:
+            # Snapshot and log tail must come from one read transaction (the
+            # writer cannot have changed them in between if it is the reader)
+            own_transaction = connection is not self._db
+            if own_transaction:
+                await connection.execute("BEGIN")
+            try:
+                async with connection.execute(
+                    "SELECT state, last_update_id, version FROM document_snapshots WHERE session_id = ?", (session_id,)
+                ) as cursor:
+                    row = await cursor.fetchone()
+                snapshot, after_id, version = (
+                    (bytes(row["state"]), row["last_update_id"], row["version"]) if row else (None, 0, None)
+                )
+                
+                async with connection.execute(
+                    "SELECT id, data, version FROM document_updates WHERE session_id = ? AND id > ? ORDER BY id",
+                    (session_id, after_id)
+                ) as cursor:
+                    rows = await cursor.fetchall()
+                if rows:
+                    version = rows[-1]["version"]
+                return snapshot, [(row["id"], bytes(row["data"])) for row in rows], version
+            finally:
+                if own_transaction:
+                    await connection.execute("COMMIT")
+    
+    async def compact_document(self, session_id: str, snapshot: bytes, through_id: int, version: int):
+        """Replace the log up to through_id with a snapshot (at document version), in one transaction."""
+        async def write(connection):
+            await connection.execute(
+                """
+                INSERT INTO document_snapshots (session_id, state, last_update_id, updated_at, version)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(session_id) DO UPDATE SET
+                    state = excluded.state, last_update_id = excluded.last_update_id,
+                    updated_at = excluded.updated_at, version = excluded.version
+                """,
+                (session_id, snapshot, through_id, _now_ms(), version)
+            )
+            await connection.execute(
+                "DELETE FROM document_updates WHERE session_id = ? AND id <= ?", (session_id, through_id)
+            )
+        
+        await self._write(write)
+    
+    async def find_idle_sessions(self, idle_since_ms: int, limit: int = 500) -> List[str]:
+        """IDs of sessions with no activity since idle_since_ms, oldest first."""
+        if not self._db:
+            await self.connect()
+        
+        async with self._reader() as connection:
+            async with connection.execute(
+                "SELECT id FROM sessions WHERE last_activity < ? ORDER BY last_activity LIMIT ?",
+                (idle_since_ms, limit)
+            ) as cursor:
+                return [row['id'] for row in await cursor.fetchall()]
+    
+    async def archive_session(self, session_id: str) -> bool:
+        """Move a session and its users into the compressed archive table."""
         if not self._db:
             await self.connect()
+        
+        await self.write_buffer.flush()
+        session = await self._load_session(session_id)
+        if not session:
+            return False
+        session = self.presence.overlay(session)
+        
+        async def write(connection):
+            await connection.execute(
+                "INSERT OR REPLACE INTO session_archive (id, data, archived_at) VALUES (?, ?, ?)",
+                (session_id, compress_session(session), _now_ms())
+            )
+            # The archive keeps the code; the document is re-seeded from it on restore
+            await connection.execute("DELETE FROM document_updates WHERE session_id = ?", (session_id,))
+            await connection.execute("DELETE FROM document_snapshots WHERE session_id = ?", (session_id,))
+            await connection.execute("DELETE FROM users WHERE session_id = ?", (session_id,))
+            await connection.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+        
+        await self._write(write)
+        
+        self.cache.invalidate(session_id)
+        self.write_buffer.discard(session_id)
+        self.presence.drop(session_id)
+        await self.bus.publish_delete(session_id)
+        return True
+    
+    async def _restore_session(self, session_id: str) -> Optional[Session]:
+        """Bring an archived session back into the live tables."""
+        # Most misses are unknown IDs; only take the write path for archived ones
+        async with self._reader() as connection:
+            async with connection.execute("SELECT 1 FROM session_archive WHERE id = ?", (session_id,)) as cursor:
+                archived = await cursor.fetchone() is not None
+        
+        async def write(connection):
+            async with connection.execute("SELECT data FROM session_archive WHERE id = ?", (session_id,)) as cursor:
+                row = await cursor.fetchone()
+            if not row:
+                return None
             
-        async with self._db.execute("DELETE FROM sessions WHERE id = ?", (session_id,)) as cursor:
-            if cursor.rowcount > 0:
-                await self._db.commit()
-                if session_id in self.listeners:
-                    del self.listeners[session_id]
-                return True
-        return False
+            session = decompress_session(row['data'])
+            await connection.execute(
+                "INSERT OR IGNORE INTO sessions (id, code, language, created_at, last_modified_by, last_activity) VALUES (?, ?, ?, ?, ?, ?)",
+                (session.id, session.code, session.language, session.createdAt, session.lastModifiedBy, _now_ms())
+            )
+            await connection.executemany(
+                """
+                INSERT OR IGNORE INTO users (id, session_id, username, username_key, color, is_typing, last_activity)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                [
+                    (u.id, session.id, u.username, username_key(u.username), u.color, u.isTyping, u.lastActivity)
+                    for u in session.users
+                ]
+            )
+            await connection.execute("DELETE FROM session_archive WHERE id = ?", (session_id,))
+            return session
+        
+        session = await self._write(write) if archived else None
+        if session is None:
+            # Not archived, or a concurrent caller has restored it already
+            return self.cache.get(session_id)
+        return self.cache.put(session)
     
     async def add_user(self, session_id: str, user: User) -> Optional[Session]:
         """Add a user to a session."""
         if not self._db:
             await self.connect()
             
-        # Verify session exists
+        # Verify session exists (restoring it if it was archived)
         session = await self.get_session(session_id)
         if not session:
             return None
             
-        await self._db.execute(
-            "INSERT INTO users (id, session_id, username, color, is_typing, last_activity) VALUES (?, ?, ?, ?, ?, ?)",
-            (user.id, session_id, user.username, user.color, user.isTyping, user.lastActivity)
-        )
-        await self._db.commit()
+        async def write(connection):
+            # Inserts nothing if the session was deleted in the meantime
+            async with connection.execute(
+                """
+                INSERT INTO users (id, session_id, username, username_key, color, is_typing, last_activity)
+                SELECT ?, ?, ?, ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM sessions WHERE id = ?)
+                """,
+                (
+                    user.id, session_id, user.username, username_key(user.username),
+                    user.color, user.isTyping, user.lastActivity, session_id
+                )
+            ) as cursor:
+                if cursor.rowcount == 0:
+                    return False
+            await connection.execute("UPDATE sessions SET last_activity = ? WHERE id = ?", (_now_ms(), session_id))
+            return True
+        
+        try:
+            added = await self._write(write)
+        except sqlite3.IntegrityError as e:
+            if "users.session_id, users.username_key" in str(e):
+                raise UsernameTakenError(session_id, user.username)
+            raise
+        if not added:
+            self.cache.invalidate(session_id)
+            return None
+        self.cache.add_user(session_id, user)
         
         return await self._notify_and_return(session_id)
     
     async def remove_user(self, session_id: str, user_id: str) -> Optional[Session]:
         """Remove a user from a session."""
-        if not self._db:
-            await self.connect()
-            
-        await self._db.execute("DELETE FROM users WHERE id = ? AND session_id = ?", (user_id, session_id))
-        await self._db.commit()
+        await self._write(lambda connection: connection.execute(
+            "DELETE FROM users WHERE id = ? AND session_id = ?", (user_id, session_id)
+        ))
+        self.cache.remove_user(session_id, user_id)
+        self.presence.forget(session_id, user_id)
         
         return await self._notify_and_return(session_id)
     
@@ -209,50 +652,156 @@ class SQLiteDatabase:
             elif key in ['username', 'color']:
                 fields.append(f"{key} = ?")
                 values.append(value)
+                if key == 'username':
+                    fields.append("username_key = ?")
+                    values.append(username_key(value))
                 
         if fields:
             values.append(user_id)
             values.append(session_id)
             query = f"UPDATE users SET {', '.join(fields)} WHERE id = ? AND session_id = ?"
-            await self._db.execute(query, values)
-            await self._db.commit()
             
+            async def write(connection):
+                await connection.execute(query, values)
+                if "lastActivity" in updates:
+                    await connection.execute(
+                        "UPDATE sessions SET last_activity = ? WHERE id = ?", (updates["lastActivity"], session_id)
+                    )
+            
+            await self._write(write)
+            self.cache.update_user(session_id, user_id, updates)
+            self.presence.apply(session_id, user_id, updates)
+            
+        return await self._notify_and_return(session_id)
+    
+    async def update_presence(
+        self,
+        session_id: str,
+        user_id: str,
+        is_typing: Optional[bool] = None,
+        last_activity: Optional[int] = None,
+        notify: bool = True
+    ) -> Optional[Session]:
+        """
+        Change a user's typing flag / last activity in memory only.
+        
+        The users table gets the new values with the next presence snapshot.
+        With notify=False listeners are not told (e.g. for activity alone).
+        """
+        session = await self.get_session(session_id)
+        if not session:
+            return None
+        
+        user = next((u for u in session.users if u.id == user_id), None)
+        if user is None:
+            return session
+        
+        presence = self.presence.update(session_id, user, is_typing, last_activity)
+        self.cache.update_user(session_id, user_id, {
+            "isTyping": presence.is_typing,
+            "lastActivity": presence.last_activity
+        })
+        if not notify:
+            return session
+        return await self._notify_and_return(session_id)
+    
+    async def _flush_presence_batch(self, rows: List[PresenceRow]):
+        """Snapshot presence into the users table (and session activity) in one transaction."""
+        async def write(connection):
+            await connection.executemany(
+                "UPDATE users SET is_typing = ?, last_activity = MAX(COALESCE(last_activity, 0), ?) "
+                "WHERE id = ? AND session_id = ?",
+                [(is_typing, last_activity, user_id, session_id) for session_id, user_id, is_typing, last_activity in rows]
+            )
+            await connection.executemany(
+                "UPDATE sessions SET last_activity = MAX(COALESCE(last_activity, 0), ?) WHERE id = ?",
+                [(last_activity, session_id) for session_id, _, _, last_activity in rows]
+            )
+        
+        await self._write(write)
+    
+    async def expire_presence(
+        self,
+        session_id: str,
+        stop_typing: List[str],
+        remove: List[str],
+        idle_before: Optional[int] = None
+    ) -> Optional[Session]:
+        """
+        Clear typing flags and remove users in one batch, then notify once.
+        
+        With idle_before (ms), only users whose lastActivity, in memory or
+        as stored, is older than that are removed.
+        """
+        if not self._db:
+            await self.connect()
+        
+        changed = 0
+        untracked = []
+        for user_id in stop_typing:
+            cleared = self.presence.clear_typing(session_id, user_id)
+            if cleared is None:
+                untracked.append(user_id)
+            changed += bool(cleared)
+        remove = self.presence.idle_users(session_id, remove, idle_before)
+        
+        async def write(connection):
+            rowcount = 0
+            if untracked:
+                # Flags loaded from the users table that were never touched in memory
+                cursor = await connection.executemany(
+                    "UPDATE users SET is_typing = 0 WHERE id = ? AND session_id = ? AND is_typing",
+                    [(user_id, session_id) for user_id in untracked]
+                )
+                rowcount += cursor.rowcount
+            removed = []
+            for user_id in remove:
+                cursor = await connection.execute(
+                    "DELETE FROM users WHERE id = ? AND session_id = ? AND (? IS NULL OR COALESCE(last_activity, 0) < ?)",
+                    (user_id, session_id, idle_before, idle_before)
+                )
+                if cursor.rowcount:
+                    removed.append(user_id)
+            return rowcount, removed
+        
+        if untracked or remove:
+            rowcount, remove = await self._write(write)
+            changed += rowcount + len(remove)
+        
+        if changed <= 0:
+            # Nothing to tell anyone (and no reason to load an archived session)
+            return None
+        
+        for user_id in stop_typing:
+            self.cache.update_user(session_id, user_id, {"isTyping": False})
+        for user_id in remove:
+            self.cache.remove_user(session_id, user_id)
+            self.presence.forget(session_id, user_id)
         return await self._notify_and_return(session_id)
     
     async def _notify_and_return(self, session_id: str) -> Optional[Session]:
         """Helper to get fresh session and notify listeners."""
         session = await self.get_session(session_id)
         if session:
-            await self._notify_listeners(session_id)
+            await self._notify_listeners(session_id, session)
         return session
     
+    @property
+    def listeners(self) -> Dict[str, Set[Callable[[Session], None]]]:
+        """Local subscribers per session."""
+        return self.bus.listeners
+    
     def subscribe(self, session_id: str, callback: Callable[[Session], None]) -> Callable[[], None]:
         """Subscribe to session updates."""
-        if session_id not in self.listeners:
-            self.listeners[session_id] = set()
-        
-        self.listeners[session_id].add(callback)
-        
-        def unsubscribe():
-            if session_id in self.listeners:
-                self.listeners[session_id].discard(callback)
-        
-        return unsubscribe
+        return self.bus.subscribe(session_id, callback)
     
-    async def _notify_listeners(self, session_id: str):
-        """Notify all listeners of a session update."""
-        if session_id in self.listeners:
+    async def _notify_listeners(self, session_id: str, session: Optional[Session] = None):
+        """Publish a session update on the bus."""
+        if session is None:
             session = await self.get_session(session_id)
-            if not session:
-                return
-                
-            for listener in self.listeners[session_id]:
-                try:
-                    result = listener(session)
-                    if asyncio.iscoroutine(result):
-                        await result
-                except Exception as e:
-                    print(f"Error in listener: {e}")
+        if not session:
+            return
+        
+        await self.bus.publish(session_id, session)
 
 # SQLiteDatabase class definition only
-
@@ -0,0 +1,52 @@
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# Matches the User and JoinSessionRequest schemas
+MAX_USERNAME_LENGTH = 50
+
+
+def username_key(username: str) -> str:
+    """
+    The form usernames are compared in: full Unicode case folding.
+    
+    It is computed here and stored (users.username_key) rather than left to
+    the database's lower(), which is ASCII-only in SQLite but not in
+    PostgreSQL, so every backend agrees on which usernames collide.
+    """
+    return username.casefold()
+
+
+def renamed_duplicates(
+    rows: Iterable[Tuple[str, str, str, str, Optional[int]]],
+    max_length: int = MAX_USERNAME_LENGTH
+) -> List[Tuple[str, str, str, str]]:
+    """
+    Renames that leave no two users of a session sharing a username key.
+    
+    Rows are (id, session_id, username, username_key, last_activity). The
+    most recently active user of each clash keeps the name; the others get
+    the first free " (2)", " (3)", ... suffix, with the name shortened to
+    fit max_length. Returns (id, session_id, old username, new username).
+    """
+    rows = list(rows)
+    taken: Dict[str, Set[str]] = {}
+    for _, session_id, _, key, _ in rows:
+        taken.setdefault(session_id, set()).add(key)
+    
+    kept: Set[Tuple[str, str]] = set()
+    renames = []
+    # Most recently active first; ties keep their stored order
+    for user_id, session_id, username, key, _ in sorted(rows, key=lambda row: -(row[4] or 0)):
+        if (session_id, key) not in kept:
+            kept.add((session_id, key))
+            continue
+        
+        number = 2
+        while True:
+            suffix = f" ({number})"
+            candidate = username[:max_length - len(suffix)] + suffix
+            if username_key(candidate) not in taken[session_id]:
+                break
+            number += 1
+        taken[session_id].add(username_key(candidate))
+        renames.append((user_id, session_id, username, candidate))
+    return renames
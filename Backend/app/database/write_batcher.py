@@ -0,0 +1,137 @@
+import asyncio
+from typing import Optional, Any, Callable, Awaitable, List, Tuple, TypeVar
+import aiosqlite
+
+T = TypeVar("T")
+
+WriteWork = Callable[[aiosqlite.Connection], Awaitable[Any]]
+
+
+class WriteBatcher:
+    """
+    Group commit for the SQLite writer connection.
+
+    Writers hand over a coroutine function that executes their statements
+    on the connection (without committing) and await its result. A single
+    flusher task collects the writes queued within max_delay_ms of each
+    other, up to max_batch of them, runs each one in its own savepoint and
+    commits them all in one transaction. Callers are resolved only after
+    that commit, so a write that returned is as durable as it was with a
+    commit per write. A failing write is rolled back to its savepoint and
+    raises for its own caller only.
+
+    Every write to the connection goes through here, so the flusher is the
+    only code that ever has a transaction open on it.
+    """
+
+    def __init__(
+        self,
+        connection: Callable[[], aiosqlite.Connection],
+        max_batch: int = 256,
+        max_delay_ms: float = 2
+    ):
+        self._connection = connection
+        self.max_batch = max(1, max_batch)
+        self.max_delay = max_delay_ms / 1000
+        self._queue: List[Tuple[WriteWork, asyncio.Future]] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+
+        # Metrics
+        self.writes = 0
+        self.transactions = 0
+        self.failed = 0
+        self.max_batch_seen = 0
+
+    @property
+    def queued(self) -> int:
+        return len(self._queue)
+
+    async def run(self, work: Callable[[aiosqlite.Connection], Awaitable[T]]) -> T:
+        """Run work in the next group transaction and return its result once committed."""
+        future = asyncio.get_running_loop().create_future()
+        self._queue.append((work, future))
+        self._ensure_started()
+        self._wakeup.set()
+        return await future
+
+    async def stop(self):
+        """Commit everything still queued and stop the flusher."""
+        if self._task:
+            self._closing = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+            self._closing = False
+
+    def stats(self) -> dict:
+        return {
+            "writes": self.writes,
+            "transactions": self.transactions,
+            "failed": self.failed,
+            "writesPerTransaction": round(self.writes / self.transactions, 2) if self.transactions else 0,
+            "maxBatch": self.max_batch_seen,
+            "queued": len(self._queue),
+        }
+
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while True:
+            if not self._queue:
+                if self._closing:
+                    return
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                # Give concurrent writers one tick to join this transaction
+                if self.max_delay and not self._closing:
+                    await asyncio.sleep(self.max_delay)
+
+            batch, self._queue = self._queue[:self.max_batch], self._queue[self.max_batch:]
+            if batch:
+                await self._commit(batch)
+
+    async def _commit(self, batch: List[Tuple[WriteWork, asyncio.Future]]):
+        """Run a batch of writes in one transaction and resolve their callers."""
+        connection = self._connection()
+        done = []
+        failed = []
+
+        try:
+            await connection.execute("BEGIN IMMEDIATE")
+            for work, future in batch:
+                await connection.execute("SAVEPOINT write")
+                try:
+                    result = await work(connection)
+                except Exception as e:
+                    await connection.execute("ROLLBACK TO write")
+                    await connection.execute("RELEASE write")
+                    failed.append((future, e))
+                else:
+                    await connection.execute("RELEASE write")
+                    done.append((future, result))
+            await connection.commit()
+        except Exception as e:
+            print(f"Error committing write batch: {e}")
+            try:
+                await connection.rollback()
+            except Exception:
+                pass
+            failed = [(future, e) for _, future in batch]
+            done = []
+
+        self.transactions += 1
+        self.writes += len(done)
+        self.failed += len(failed)
+        self.max_batch_seen = max(self.max_batch_seen, len(batch))
+
+        for future, result in done:
+            if not future.done():
+                future.set_result(result)
+        for future, error in failed:
+            if not future.done():
+                future.set_exception(error)
@@ -0,0 +1,149 @@
+import asyncio
+from typing import Optional, Dict, Any, Callable, Awaitable
+from app.models.schemas import Session
+
+
+class CodeWriteBuffer:
+    """
+    Write-behind buffer for code edits.
+    
+    Only the latest code per session is kept (edits coalesce), together with
+    the last activity timestamp of every user who edited since the previous
+    flush. A background task hands the whole batch to the backend on a fixed
+    interval, or sooner once the dirty code exceeds max_dirty_bytes.
+    
+    A batch stays visible to overlay() until its commit finishes, so a
+    cache miss during a flush cannot read the old row without the edits.
+    """
+    
+    def __init__(
+        self,
+        flush_batch: Callable[[Dict[str, Dict[str, Any]]], Awaitable[None]],
+        interval_ms: int = 1000,
+        max_dirty_bytes: int = 256 * 1024
+    ):
+        self._flush_batch = flush_batch
+        self.interval = interval_ms / 1000
+        self.max_dirty_bytes = max_dirty_bytes
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        # The batch being written, until it is committed
+        self._flushing: Dict[str, Dict[str, Any]] = {}
+        self._dirty_bytes = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+        self._lock: Optional[asyncio.Lock] = None
+    
+    @property
+    def dirty_bytes(self) -> int:
+        return self._dirty_bytes
+    
+    def __contains__(self, session_id: str) -> bool:
+        """Whether a session has edits that are not committed yet."""
+        return session_id in self._pending or session_id in self._flushing
+    
+    def stage(self, session_id: str, code: str, user_id: Optional[str], last_activity: int):
+        """
+        Record the latest code for a session and schedule a flush.
+        
+        Without a user_id (an edit nobody is known for) the session keeps its
+        lastModifiedBy and no user's activity changes.
+        """
+        entry = self._pending.get(session_id)
+        if entry is None:
+            # lastModifiedBy None: leave the stored value alone
+            entry = {"code": "", "lastModifiedBy": None, "users": {}, "lastActivity": last_activity}
+            self._pending[session_id] = entry
+        
+        self._dirty_bytes += len(code) - len(entry["code"])
+        entry["code"] = code
+        entry["lastActivity"] = last_activity
+        if user_id:
+            entry["lastModifiedBy"] = user_id
+            entry["users"][user_id] = last_activity
+        
+        self._ensure_started()
+        if self._dirty_bytes >= self.max_dirty_bytes:
+            self._wakeup.set()
+    
+    def overlay(self, session: Session) -> Session:
+        """Apply not-yet-committed edits to a session read from the database."""
+        # In-flight edits first; anything staged since then is newer
+        for entry in (self._flushing.get(session.id), self._pending.get(session.id)):
+            if entry is None:
+                continue
+            
+            users = [
+                u.model_copy(update={"lastActivity": entry["users"][u.id]}) if u.id in entry["users"] else u
+                for u in session.users
+            ]
+            session = session.model_copy(update={
+                "code": entry["code"],
+                "lastModifiedBy": entry["lastModifiedBy"] or session.lastModifiedBy,
+                "users": users
+            })
+        return session
+    
+    def discard(self, session_id: str):
+        """Forget pending edits for a session (e.g. when it is deleted)."""
+        entry = self._pending.pop(session_id, None)
+        if entry is not None:
+            self._dirty_bytes -= len(entry["code"])
+        self._flushing.pop(session_id, None)
+    
+    async def flush(self):
+        """Write every pending edit to the database in one batch."""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        
+        async with self._lock:
+            if not self._pending:
+                return
+            
+            batch, self._pending = self._pending, {}
+            self._flushing = batch
+            self._dirty_bytes = 0
+            
+            try:
+                await self._flush_batch(batch)
+            except Exception as e:
+                print(f"Error flushing code edits: {e}")
+                # Requeue, keeping anything staged while we were flushing
+                for session_id, entry in batch.items():
+                    if session_id not in self._pending and session_id in self._flushing:
+                        self._pending[session_id] = entry
+                        self._dirty_bytes += len(entry["code"])
+                raise
+            finally:
+                self._flushing = {}
+    
+    async def stop(self):
+        """Stop the background flusher and flush whatever is left."""
+        if self._task:
+            # Let an in-flight flush finish rather than cancelling it mid-batch
+            self._closing = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+            self._closing = False
+        
+        await self.flush()
+    
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+    
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                # Already logged and requeued; retry on the next tick
+                pass
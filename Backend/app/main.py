@@ -1,17 +1,62 @@
+import asyncio
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.config import settings
-from app.routers import sessions, users, code, websocket
+from app.routers import sessions, users, code, websocket, yjs
 from contextlib import asynccontextmanager
 
+
+def _report_warm_up(task: asyncio.Task):
+    """Done callback for a warm-up task: surface its failure instead of dropping it."""
+    if not task.cancelled() and task.exception() is not None:
+        print(f"Error during {task.get_name()}: {task.exception()!r}")
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
     from app.database.instance import db
+    from app.services.session_reaper import SessionReaper
+    from app.services.crdt_documents import document_store
     await db.connect()
+    
+    reaper = SessionReaper(
+        db,
+        settings.session_timeout_minutes,
+        settings.session_reaper_interval_seconds,
+        settings.session_expiry_mode,
+        # Sessions with a session socket or a Yjs socket are in use
+        is_active=lambda session_id: bool(db.listeners.get(session_id)) or document_store.is_active(session_id),
+        # A document opened while the session was being expired must not flush into it
+        on_expired=document_store.discard
+    )
+    reaper.start()
+    
+    from app.services.presence_reaper import presence_reaper
+    presence_reaper.start(db)
+    
+    from app.services.code_executor import python_pool, node_pool, compiled_runner
+    # Warm the interpreter pools in the background; startup does not wait for them
+    warm_ups = []
+    if settings.python_worker_prestart:
+        warm_ups.append(asyncio.create_task(python_pool.start(), name="Python worker prestart"))
+    if settings.node_worker_prestart:
+        warm_ups.append(asyncio.create_task(node_pool.start(), name="Node.js worker prestart"))
+    # Toolchain versions are part of the result and build cache keys
+    warm_ups.append(asyncio.create_task(compiled_runner.load_versions(), name="toolchain version probe"))
+    for task in warm_ups:
+        task.add_done_callback(_report_warm_up)
     yield
-    # Shutdown
+    # Shutdown: stop unfinished warm-ups, then persist buffered code edits before closing the connection
+    for task in warm_ups:
+        task.cancel()
+    await asyncio.gather(*warm_ups, return_exceptions=True)
+    await reaper.stop()
+    await presence_reaper.stop()
+    await document_store.stop()
+    await db.flush_pending_writes()
     await db.disconnect()
+    await python_pool.shutdown()
+    await node_pool.shutdown()
 
 # Create FastAPI application
 app = FastAPI(
@@ -45,6 +90,7 @@ app.include_router(sessions.router, prefix=settings.api_v1_prefix)
 app.include_router(users.router, prefix=settings.api_v1_prefix)
 app.include_router(code.router, prefix=settings.api_v1_prefix)
 app.include_router(websocket.router, prefix=settings.api_v1_prefix)
+app.include_router(yjs.router)
 
 
 @app.get("/")
@@ -63,6 +109,23 @@ async def health_check():
     return {"status": "healthy"}
 
 
+@app.get("/metrics")
+async def metrics():
+    """Cache, database and execution pool counters."""
+    from app.database.instance import db
+    from app.services.code_executor import python_pool, node_pool, compiled_runner, result_cache
+    from app.services.crdt_documents import document_store
+    return {
+        "sessionCache": db.cache.stats(),
+        "database": db.stats(),
+        "documents": document_store.stats(),
+        "pythonPool": python_pool.stats(),
+        "nodePool": node_pool.stats(),
+        "builds": compiled_runner.stats(),
+        "resultCache": result_cache.stats()
+    }
+
+
 
 
 
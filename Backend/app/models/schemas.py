@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import Optional
+from typing import Optional, Tuple
 from pydantic import BaseModel, Field, ConfigDict
 
 
@@ -54,12 +54,19 @@ class ExecutionResult(BaseModel):
     output: str = Field(..., description="Standard output from code execution")
     error: Optional[str] = Field(None, description="Error message if execution failed")
     executionTime: int = Field(..., description="Execution time in milliseconds")
+    queueWaitTime: Optional[int] = Field(None, description="Time spent waiting in the execution queue in milliseconds")
+    executionId: Optional[str] = Field(None, description="ID of the execution_output/execution_done WebSocket events for this run")
+    cached: bool = Field(False, description="Whether the result was served from the execution cache")
+    compileTime: Optional[int] = Field(None, description="Compilation time in milliseconds (compiled languages)")
+    runTime: Optional[int] = Field(None, description="Time spent running the compiled program in milliseconds")
+    compileCached: Optional[bool] = Field(None, description="Whether a cached build was reused instead of compiling")
     
     model_config = ConfigDict(
         json_schema_extra={
             "example": {
                 "output": "Hello, World!",
-                "executionTime": 45
+                "executionTime": 45,
+                "queueWaitTime": 3
             }
         }
     )
@@ -108,6 +115,41 @@ class UpdateCodeRequest(BaseModel):
     userId: str = Field(..., description="ID of the user making the change")
 
 
+class PatchCodeRequest(BaseModel):
+    """Request model for editing code with range edits."""
+    
+    baseVersion: int = Field(..., description="Code version the edits were made against")
+    edits: list[Tuple[int, int, str]] = Field(
+        ...,
+        min_length=1,
+        description="Range edits [offset, deleteCount, insertText] in UTF-16 code units, applied in order"
+    )
+    userId: str = Field(..., description="ID of the user making the change")
+    
+    model_config = ConfigDict(
+        json_schema_extra={
+            "example": {
+                "baseVersion": 1718000000000000,
+                "edits": [[12, 0, "x"]],
+                "userId": "550e8400-e29b-41d4-a716-446655440000"
+            }
+        }
+    )
+
+
+class CodeVersionResponse(BaseModel):
+    """Response model for a code edit."""
+    
+    version: int = Field(..., description="Code version after the edit")
+
+
+class SessionCodeResponse(BaseModel):
+    """Response model for the current code and its version."""
+    
+    code: str = Field(..., description="Current code content")
+    version: int = Field(..., description="Code version to send as baseVersion")
+
+
 class UpdateLanguageRequest(BaseModel):
     """Request model for updating language."""
     
@@ -134,6 +176,7 @@ class ExecuteCodeRequest(BaseModel):
     
     code: str = Field(..., description="Code to execute")
     language: str = Field(..., description="Programming language")
+    stdin: str = Field("", description="Standard input passed to the program")
     
     model_config = ConfigDict(
         json_schema_extra={
@@ -1,6 +1,9 @@
 from fastapi import APIRouter, HTTPException, status, Depends
 from app.models.schemas import (
     UpdateCodeRequest,
+    PatchCodeRequest,
+    CodeVersionResponse,
+    SessionCodeResponse,
     UpdateLanguageRequest,
     ExecuteCodeRequest,
     ExecutionResult,
@@ -8,21 +11,18 @@ from app.models.schemas import (
 )
 from app.database.instance import get_db
 from app.services.session_service import SessionService
+from app.services.crdt_documents import StaleVersionError
+from app.services.session_execution import (
+    SUPPORTED_LANGUAGES,
+    ExecutionRejected,
+    execute_in_session,
+    invalid_language_message
+)
+from app.routers.websocket import manager
 
 
 router = APIRouter(prefix="/sessions", tags=["Code"])
 
-# Supported languages
-SUPPORTED_LANGUAGES = [
-    "javascript",
-    "typescript",
-    "python",
-    "java",
-    "cpp",
-    "go",
-    "rust"
-]
-
 
 @router.put(
     "/{session_id}/code",
@@ -51,6 +51,73 @@ async def update_code(
     return None
 
 
+@router.get(
+    "/{session_id}/code",
+    response_model=SessionCodeResponse,
+    responses={
+        404: {"model": ErrorResponse, "description": "Session not found"}
+    },
+    summary="Get session code",
+    description="Returns the current code with the version to base PATCH edits on"
+)
+async def get_code(session_id: str, db=Depends(get_db)) -> SessionCodeResponse:
+    """Get the code of a session and its version."""
+    service = SessionService(db)
+    result = await service.get_code(session_id)
+    
+    if result is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Session not found"
+        )
+    
+    code, version = result
+    return SessionCodeResponse(code=code, version=version)
+
+
+@router.patch(
+    "/{session_id}/code",
+    response_model=CodeVersionResponse,
+    responses={
+        400: {"model": ErrorResponse, "description": "Edit outside the code or inside a surrogate pair"},
+        404: {"model": ErrorResponse, "description": "Session not found"},
+        409: {"model": ErrorResponse, "description": "Base version is stale"}
+    },
+    summary="Edit session code",
+    description="Applies range edits [offset, deleteCount, insertText] made against baseVersion. "
+                "Offsets and counts are UTF-16 code units (JavaScript string indices) and each edit "
+                "applies to the result of the previous one. "
+                "Returns 409 if the code changed since baseVersion."
+)
+async def patch_code(
+    session_id: str,
+    request: PatchCodeRequest,
+    db=Depends(get_db)
+) -> CodeVersionResponse:
+    """Apply range edits to the code in a session."""
+    service = SessionService(db)
+    try:
+        version = await service.patch_code(session_id, request.baseVersion, request.edits, request.userId)
+    except StaleVersionError as e:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Code changed since baseVersion; current version is {e.version}"
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    
+    if version is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Session not found"
+        )
+    
+    return CodeVersionResponse(version=version)
+
+
 @router.put(
     "/{session_id}/language",
     status_code=status.HTTP_204_NO_CONTENT,
@@ -70,7 +137,7 @@ async def update_language(
     if request.language not in SUPPORTED_LANGUAGES:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Invalid language. Supported languages: {', '.join(SUPPORTED_LANGUAGES)}"
+            detail=invalid_language_message()
         )
     
     service = SessionService(db)
@@ -85,4 +152,30 @@ async def update_language(
     return None
 
 
-
+@router.post(
+    "/{session_id}/execute",
+    response_model=ExecutionResult,
+    responses={
+        400: {"model": ErrorResponse, "description": "Invalid language or code too long"},
+        404: {"model": ErrorResponse, "description": "Session not found"},
+        429: {"model": ErrorResponse, "description": "Execution queue is full"}
+    },
+    summary="Execute code",
+    description="Runs code through the shared execution queue and returns its output. "
+                "Output is also streamed to the session's WebSockets as execution_output events, "
+                "followed by an execution_done event."
+)
+async def execute_code(
+    session_id: str,
+    request: ExecuteCodeRequest,
+    db=Depends(get_db)
+) -> ExecutionResult:
+    """Execute code for a session."""
+    try:
+        return await execute_in_session(db, session_id, request, manager.broadcast)
+    except ExecutionRejected as e:
+        raise HTTPException(
+            status_code=e.status_code,
+            detail=e.detail,
+            headers={"Retry-After": "1"} if e.status_code == status.HTTP_429_TOO_MANY_REQUESTS else None
+        )
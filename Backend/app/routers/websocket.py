@@ -1,7 +1,29 @@
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends
-from typing import Set
+from pydantic import ValidationError
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+import asyncio
 import json
-from app.models.schemas import Session
+import math
+import time
+from app.config import settings
+from app.models.schemas import (
+    Session,
+    UpdateCodeRequest,
+    UpdateLanguageRequest,
+    UpdateTypingRequest,
+    ExecuteCodeRequest
+)
+from app.services.session_delta import diff_session
+from app.services.presence_reaper import presence_reaper
+from app.services.rate_limiter import TokenBucket
+from app.services.session_service import SessionService
+from app.services.user_service import UserService
+from app.services.session_execution import (
+    SUPPORTED_LANGUAGES,
+    ExecutionRejected,
+    execute_in_session,
+    invalid_language_message
+)
 # from app.managers.connection_manager import ConnectionManager (Removed)
 
 router = APIRouter(prefix="/ws", tags=["WebSocket"])
@@ -10,44 +32,176 @@ router = APIRouter(prefix="/ws", tags=["WebSocket"])
 active_connections: dict[str, Set[WebSocket]] = {}
 
 
+class SessionHub:
+    """
+    Fan-out point for a single session.
+    
+    The hub holds the one database subscription for its session and
+    serializes every update exactly once before pushing the same text
+    frame to all member sockets.
+    
+    Every change bumps a per-session version. Sockets that opted into the
+    delta protocol receive only what changed since the previous version;
+    the others keep receiving full snapshots.
+    
+    Frames go to all sockets concurrently, each bounded by
+    ws_send_timeout_seconds, so one slow client cannot hold up the write
+    that caused the update or the other members. Sockets that fail or time
+    out are dropped, and on_empty is called once the last one is gone.
+    """
+    
+    def __init__(
+        self,
+        session_id: str,
+        db=None,
+        session: Optional[Session] = None,
+        on_empty: Optional[Callable[[], None]] = None
+    ):
+        self.session_id = session_id
+        self.on_empty = on_empty
+        self.connections: Set[WebSocket] = set()
+        self.delta_connections: Set[WebSocket] = set()
+        # Users identified by their sockets (?userId=...)
+        self.socket_users: Dict[WebSocket, str] = {}
+        self.version = 0
+        self.snapshot: Optional[dict] = session.model_dump() if session else None
+        self._unsubscribe: Optional[Callable[[], None]] = None
+        
+        if db is not None:
+            self._unsubscribe = db.subscribe(session_id, self.on_session_update)
+    
+    def snapshot_message(self) -> dict:
+        """Full session state at the current version."""
+        return {
+            "event": "session_update",
+            "version": self.version,
+            "data": self.snapshot
+        }
+    
+    async def on_session_update(self, session: Session):
+        """Database listener: serialize once per protocol, send to every member."""
+        data = session.model_dump()
+        delta = diff_session(self.snapshot, data) if self.snapshot is not None else None
+        if delta == {}:
+            # Nothing visible changed
+            return
+        
+        self.version += 1
+        self.snapshot = data
+        
+        full_frame = json.dumps(self.snapshot_message())
+        delta_frame = None
+        if delta is not None and self.delta_connections:
+            delta_frame = json.dumps({
+                "event": "session_delta",
+                "version": self.version,
+                "baseVersion": self.version - 1,
+                "data": delta
+            })
+        
+        await self._send_all([
+            (connection, delta_frame if delta_frame is not None and connection in self.delta_connections else full_frame)
+            for connection in self.connections
+        ])
+    
+    async def send_text(self, text: str):
+        """Send a pre-serialized frame to every connection in the hub."""
+        await self._send_all([(connection, text) for connection in self.connections])
+    
+    async def _send_all(self, frames: List[Tuple[WebSocket, str]]):
+        if not frames:
+            return
+        
+        await asyncio.gather(*(self._send(connection, text) for connection, text in frames))
+        if not self.connections and self.on_empty:
+            self.on_empty()
+    
+    async def _send(self, connection: WebSocket, text: str):
+        try:
+            await asyncio.wait_for(connection.send_text(text), settings.ws_send_timeout_seconds)
+        except Exception:
+            # Remove dead and stalled connections
+            self.remove(connection)
+    
+    @property
+    def user_ids(self) -> Set[str]:
+        """Users with at least one open socket in this session."""
+        return set(self.socket_users.values())
+    
+    def add(self, websocket: WebSocket, delta: bool = False, user_id: Optional[str] = None):
+        self.connections.add(websocket)
+        if delta:
+            self.delta_connections.add(websocket)
+        if user_id:
+            self.socket_users[websocket] = user_id
+    
+    def remove(self, websocket: WebSocket):
+        self.connections.discard(websocket)
+        self.delta_connections.discard(websocket)
+        self.socket_users.pop(websocket, None)
+    
+    def close(self):
+        """Drop the database subscription."""
+        if self._unsubscribe:
+            self._unsubscribe()
+            self._unsubscribe = None
+
+
 class ConnectionManager:
     """Manage WebSocket connections for real-time updates."""
     
     def __init__(self):
-        self.active_connections: dict[str, Set[WebSocket]] = {}
+        self.hubs: dict[str, SessionHub] = {}
+    
+    @property
+    def active_connections(self) -> dict[str, Set[WebSocket]]:
+        """Connections per session, derived from the hubs."""
+        return {session_id: hub.connections for session_id, hub in self.hubs.items()}
     
-    async def connect(self, websocket: WebSocket, session_id: str):
-        """Accept a new WebSocket connection."""
+    async def connect(
+        self,
+        websocket: WebSocket,
+        session_id: str,
+        db=None,
+        session: Optional[Session] = None,
+        delta: bool = False,
+        user_id: Optional[str] = None
+    ) -> SessionHub:
+        """Accept a new WebSocket connection and join the session hub."""
         await websocket.accept()
         
-        if session_id not in self.active_connections:
-            self.active_connections[session_id] = set()
+        hub = self.hubs.get(session_id)
+        if hub is None:
+            hub = SessionHub(session_id, db, session, on_empty=lambda: self._release_if_empty(session_id))
+            self.hubs[session_id] = hub
         
-        self.active_connections[session_id].add(websocket)
+        hub.add(websocket, delta, user_id)
+        return hub
     
     def disconnect(self, websocket: WebSocket, session_id: str):
         """Remove a WebSocket connection."""
-        if session_id in self.active_connections:
-            self.active_connections[session_id].discard(websocket)
-            
-            # Clean up empty sets
-            if not self.active_connections[session_id]:
-                del self.active_connections[session_id]
+        hub = self.hubs.get(session_id)
+        if hub is None:
+            return
+        
+        hub.remove(websocket)
+        self._release_if_empty(session_id)
+    
+    def _release_if_empty(self, session_id: str):
+        """Tear a hub down once its last member is gone."""
+        hub = self.hubs.get(session_id)
+        if hub is not None and not hub.connections:
+            hub.close()
+            del self.hubs[session_id]
     
     async def broadcast(self, session_id: str, message: dict):
         """Broadcast a message to all connections in a session."""
-        if session_id not in self.active_connections:
+        hub = self.hubs.get(session_id)
+        if hub is None:
             return
         
-        # Create a copy of the set to avoid modification during iteration
-        connections = self.active_connections[session_id].copy()
-        
-        for connection in connections:
-            try:
-                await connection.send_json(message)
-            except Exception:
-                # Remove dead connections
-                self.disconnect(connection, session_id)
+        # The hub releases itself if it dropped its last connection while sending
+        await hub.send_text(json.dumps(message))
 
 
 # Global connection manager
@@ -56,17 +210,131 @@ manager = ConnectionManager()
 
 from app.database.instance import get_db
 
+
+class ConnectionLimits:
+    """Per-connection rate limits for inbound messages."""
+    
+    def __init__(self):
+        self.messages = TokenBucket(settings.ws_message_rate_per_second, settings.ws_message_burst)
+        self.executions = TokenBucket(settings.ws_execute_rate_per_second, settings.ws_execute_burst)
+
+
+def _ack(seq: Any, version: Optional[int] = None, **fields) -> dict:
+    ack = {"type": "ack", "seq": seq, "ok": True, **fields}
+    if version is not None:
+        ack["version"] = version
+    return ack
+
+
+def _nack(seq: Any, status: int, error: str, **fields) -> dict:
+    return {"type": "ack", "seq": seq, "ok": False, "status": status, "error": error, **fields}
+
+
+def _rate_limited(seq: Any, bucket: TokenBucket) -> dict:
+    return _nack(seq, 429, "Rate limit exceeded", retryAfterMs=math.ceil(bucket.retry_after() * 1000))
+
+
+async def handle_client_message(
+    db,
+    hub: SessionHub,
+    user_id: Optional[str],
+    message: dict,
+    limits: ConnectionLimits
+) -> dict:
+    """
+    Apply a typing/code_update/language_update/execute message.
+    
+    Goes through the same services as the REST endpoints and returns the
+    ack for the message's seq: ok with the session version that includes
+    the change, or an error with an HTTP-style status.
+    """
+    kind = message.get("type")
+    seq = message.get("seq")
+    session_id = hub.session_id
+    
+    if not limits.messages.allow():
+        return _rate_limited(seq, limits.messages)
+    
+    try:
+        if kind == "typing":
+            request = UpdateTypingRequest(userId=user_id, isTyping=message.get("isTyping"))
+            session = await UserService(db).set_typing_status(session_id, request.userId, request.isTyping)
+            if not session:
+                return _nack(seq, 404, "Session or user not found")
+        
+        elif kind == "code_update":
+            request = UpdateCodeRequest(userId=user_id, code=message.get("code"))
+            session = await SessionService(db).update_code(session_id, request.code, request.userId)
+            if not session:
+                return _nack(seq, 404, "Session not found")
+        
+        elif kind == "language_update":
+            request = UpdateLanguageRequest(language=message.get("language"))
+            if request.language not in SUPPORTED_LANGUAGES:
+                return _nack(seq, 400, invalid_language_message())
+            session = await SessionService(db).update_language(session_id, request.language)
+            if not session:
+                return _nack(seq, 404, "Session not found")
+        
+        elif kind == "execute":
+            if not limits.executions.allow():
+                return _rate_limited(seq, limits.executions)
+            request = ExecuteCodeRequest(
+                code=message.get("code"),
+                language=message.get("language"),
+                stdin=message.get("stdin") or ""
+            )
+            result = await execute_in_session(db, session_id, request, manager.broadcast)
+            return _ack(seq, data=result.model_dump())
+        
+        else:
+            return _nack(seq, 400, f"Unknown message type: {kind}")
+    
+    except ValidationError as e:
+        return _nack(seq, 400, "Invalid message", details=str(e))
+    except ExecutionRejected as e:
+        return _nack(seq, e.status_code, e.detail)
+    
+    return _ack(seq, hub.version)
+
+
+async def _execute_and_ack(websocket: WebSocket, db, hub: SessionHub, user_id: Optional[str], message: dict, limits: ConnectionLimits):
+    """Run an execute message off the receive loop and ack it when done."""
+    ack = await handle_client_message(db, hub, user_id, message, limits)
+    try:
+        await websocket.send_json(ack)
+    except Exception:
+        # The socket closed while the program ran; the session still got the output
+        pass
+
 @router.websocket("/sessions/{session_id}")
 async def websocket_endpoint(
     websocket: WebSocket,
     session_id: str,
+    protocol: str = "full",
+    userId: Optional[str] = None,
     db=Depends(get_db)
 ):
     """
     WebSocket endpoint for real-time session updates.
     
     Events sent to client:
-    - session_update: Full session state when any change occurs
+    - session_update: Full session state with its version (on connect, on
+      resync, and on every change unless the delta protocol is used)
+    - session_delta: Changes since baseVersion (with ?protocol=delta)
+    
+    With ?userId=..., the socket keeps that user present: messages count as
+    activity and the user is not removed for idling while connected.
+    
+    Messages accepted from client:
+    - ping: Keep-alive, answered with pong
+    - resync: Request a full session_update, e.g. after a version gap
+    - typing {isTyping}, code_update {code}, language_update {language},
+      execute {code, language, stdin}: same as the REST endpoints, acting as
+      the socket's user (or the message's userId). Each is answered with
+      {"type": "ack", "seq", "ok", ...}; errors carry an HTTP-style status,
+      and rate-limited messages a 429 with retryAfterMs. Execute acks carry
+      the ExecutionResult as data and arrive once the program finishes.
     """
     # Verify session exists
     session = await db.get_session(session_id)
@@ -74,41 +342,50 @@ async def websocket_endpoint(
         await websocket.close(code=1008, reason="Session not found")
         return
     
-    # Accept connection
-    await manager.connect(websocket, session_id)
-    
-    # Subscribe to database updates
-    def on_session_update(updated_session: Session):
-        """Callback for session updates."""
-        # Schedule broadcast in the event loop
-        import asyncio
-        asyncio.create_task(manager.broadcast(
-            session_id,
-            {
-                "event": "session_update",
-                "data": updated_session.model_dump()
-            }
-        ))
-    
-    unsubscribe = db.subscribe(session_id, on_session_update)
+    # Accept connection; the session hub subscribes to database updates
+    # once for all sockets in the session
+    hub = await manager.connect(websocket, session_id, db, session, delta=protocol == "delta", user_id=userId)
+    presence_reaper.track_session(session, int(time.time() * 1000))
+    if userId:
+        await presence_reaper.record_activity(session_id, userId)
+    limits = ConnectionLimits()
+    executions: Set[asyncio.Task] = set()
     
     try:
         # Send initial session state
-        await websocket.send_json({
-            "event": "session_update",
-            "data": session.model_dump()
-        })
+        await websocket.send_text(json.dumps(hub.snapshot_message()))
         
         # Keep connection alive and handle incoming messages
         while True:
             data = await websocket.receive_text()
+            if userId:
+                await presence_reaper.record_activity(session_id, userId)
             
             # Handle client messages (e.g., ping/pong for keep-alive)
             try:
                 message = json.loads(data)
+                if not isinstance(message, dict):
+                    # Valid JSON but not a message object; ignore like malformed JSON
+                    continue
                 
                 if message.get("type") == "ping":
                     await websocket.send_json({"type": "pong"})
+                
+                elif message.get("type") == "resync":
+                    await websocket.send_text(json.dumps(hub.snapshot_message()))
+                
+                elif message.get("type") == "execute":
+                    # Keep receiving (and acking edits) while the program runs
+                    task = asyncio.create_task(
+                        _execute_and_ack(websocket, db, hub, userId or message.get("userId"), message, limits)
+                    )
+                    executions.add(task)
+                    task.add_done_callback(executions.discard)
+                
+                elif message.get("type") in ("typing", "code_update", "language_update"):
+                    await websocket.send_json(
+                        await handle_client_message(db, hub, userId or message.get("userId"), message, limits)
+                    )
             
             except json.JSONDecodeError:
                 pass
@@ -117,6 +394,11 @@ async def websocket_endpoint(
         pass
     
     finally:
-        # Clean up
+        # Clean up; programs still running for this socket are killed
+        for task in executions:
+            task.cancel()
+        # The last socket out tears the hub down
         manager.disconnect(websocket, session_id)
-        unsubscribe()
+        if userId:
+            # The idle countdown starts when the socket goes away
+            presence_reaper.touch(session_id, userId)
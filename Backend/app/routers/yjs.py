@@ -0,0 +1,50 @@
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends
+from typing import Optional
+from app.database.instance import get_db
+from app.services.crdt_documents import document_store
+from app.services.presence_reaper import presence_reaper
+
+# Mounted at the application root: y-websocket clients connect to <url>/<room>
+router = APIRouter(prefix="/yjs-ws", tags=["Collaboration"])
+
+
+@router.websocket("/{session_id}")
+async def yjs_endpoint(
+    websocket: WebSocket,
+    session_id: str,
+    userId: Optional[str] = None,
+    db=Depends(get_db)
+):
+    """
+    Yjs sync protocol for a session's shared document (y-websocket compatible).
+    
+    Binary sync and awareness messages are applied to the session's
+    in-process document and relayed to the other sockets of the session.
+    With ?userId=..., edits from this socket are attributed to that user,
+    its messages count as activity and the user is not removed for idling
+    while it is connected.
+    """
+    document = await document_store.open(db, session_id)
+    if document is None:
+        await websocket.close(code=1008, reason="Session not found")
+        return
+    
+    await websocket.accept()
+    try:
+        await document.connect(websocket, userId)
+        if userId:
+            await presence_reaper.record_activity(session_id, userId)
+        while True:
+            message = await websocket.receive_bytes()
+            if userId:
+                await presence_reaper.record_activity(session_id, userId)
+            await document.handle_message(websocket, message)
+    
+    except WebSocketDisconnect:
+        pass
+    
+    finally:
+        await document.disconnect(websocket)
+        if userId:
+            # The idle countdown starts when the socket goes away
+            presence_reaper.touch(session_id, userId)
@@ -1,8 +1,70 @@
-import time
-import io
+import re
 import sys
-from contextlib import redirect_stdout, redirect_stderr
+import time
+from typing import Optional, Callable, Awaitable
+from app.config import settings
 from app.models.schemas import ExecutionResult
+from app.services.python_sandbox import PythonWorkerPool
+from app.services.node_sandbox import NodeWorkerPool
+from app.services.compiled_runner import CompiledRunner, TOOLCHAINS
+from app.services.result_cache import ExecutionResultCache
+
+
+# Shared pool of warm, sandboxed Python workers (pre-started in the app lifespan)
+python_pool = PythonWorkerPool(
+    size=settings.python_worker_pool_size,
+    timeout_seconds=settings.code_execution_timeout_seconds,
+    memory_limit_mb=settings.code_execution_memory_limit_mb,
+    max_output_bytes=settings.code_execution_max_output_bytes,
+    start_method=settings.python_worker_start_method,
+    max_jobs_per_worker=settings.python_worker_max_jobs,
+    low_watermark=settings.python_worker_low_watermark
+)
+
+# Shared pool of long-lived Node.js workers for JavaScript/TypeScript
+node_pool = NodeWorkerPool(
+    size=settings.node_worker_pool_size,
+    timeout_seconds=settings.code_execution_timeout_seconds,
+    memory_limit_mb=settings.code_execution_memory_limit_mb,
+    max_output_bytes=settings.code_execution_max_output_bytes,
+    node_binary=settings.node_binary,
+    max_jobs_per_worker=settings.node_worker_max_jobs
+)
+
+# Shared compile-and-run backend for java/cpp/go/rust
+compiled_runner = CompiledRunner(
+    cache_dir=settings.compile_cache_dir or None,
+    compile_concurrency=settings.compile_max_concurrency,
+    compile_timeout_seconds=settings.compile_timeout_seconds,
+    timeout_seconds=settings.code_execution_timeout_seconds,
+    memory_limit_mb=settings.code_execution_memory_limit_mb,
+    max_output_bytes=settings.code_execution_max_output_bytes,
+    max_cache_bytes=settings.compile_cache_max_bytes
+)
+
+# Shared memo of deterministic execution results
+result_cache = ExecutionResultCache(
+    max_entries=settings.execution_cache_size,
+    ttl_seconds=settings.execution_cache_ttl_seconds
+)
+
+
+# APIs whose output can differ between runs of the same source: randomness,
+# clocks, threads, and hash-ordered containers (string hashing is salted per
+# interpreter in Python, map iteration order is randomized in Go and Rust).
+# A match only costs the cache, so the patterns err on the side of matching.
+NONDETERMINISTIC_APIS = {
+    "python": re.compile(r"\b(random|secrets|uuid|time|datetime|os|hash|id|set|frozenset|threading|multiprocessing|asyncio)\b"),
+    "javascript": re.compile(r"\b(Math\.random|Date|performance|crypto|process\.hrtime)\b"),
+    "java": re.compile(
+        r"\b(Random|random|SecureRandom|ThreadLocalRandom|currentTimeMillis|nanoTime|UUID|Instant|Clock|"
+        r"LocalDate|LocalTime|LocalDateTime|ZonedDateTime|Thread|hashCode|HashMap|HashSet)\b"
+    ),
+    "cpp": re.compile(r"\b(rand|srand|random_device|mt19937|mt19937_64|time|clock|chrono|thread|unordered_map|unordered_set)\b"),
+    "go": re.compile(r"(\b(rand|time|go|select)\b|\bmap\[)"),
+    "rust": re.compile(r"\b(rand|SystemTime|Instant|thread|HashMap|HashSet|RandomState)\b"),
+}
+NONDETERMINISTIC_APIS["typescript"] = NONDETERMINISTIC_APIS["javascript"]
 
 
 class CodeExecutor:
@@ -18,86 +80,159 @@ class CodeExecutor:
         "rust"
     ]
     
-    async def execute_code(self, code: str, language: str) -> ExecutionResult:
+    def __init__(
+        self,
+        python_workers: Optional[PythonWorkerPool] = None,
+        results: Optional[ExecutionResultCache] = None,
+        node_workers: Optional[NodeWorkerPool] = None,
+        compiled: Optional[CompiledRunner] = None
+    ):
+        self.python_workers = python_workers or python_pool
+        self.results = results or result_cache
+        self.node_workers = node_workers or node_pool
+        self.compiled = compiled or compiled_runner
+    
+    def runtime_version(self, language: str) -> str:
+        """Version of the runtime that executes a language (part of the cache key)."""
+        if language == "python":
+            return sys.version
+        if language in ["javascript", "typescript"]:
+            return self.node_workers.version()
+        return self.compiled.version(language)
+    
+    @staticmethod
+    def is_deterministic(result: ExecutionResult) -> bool:
+        """Whether a result may be memoized: timeouts, resource kills and missing runtimes are not."""
+        return not (result.error or "").startswith(("TimeoutError", "ResourceError", "EnvironmentError"))
+    
+    @staticmethod
+    def is_cacheable(code: str, language: str) -> bool:
+        """Whether code may be memoized: it uses none of its language's nondeterministic APIs."""
+        pattern = NONDETERMINISTIC_APIS.get(language)
+        return pattern is not None and pattern.search(code) is None
+    
+    def cached_result(self, code: str, language: str, stdin: str = "") -> Optional[ExecutionResult]:
+        """Return a memoized result without executing anything."""
+        if not self.is_cacheable(code, language):
+            return None
+        key = self.results.make_key(language, code, stdin, self.runtime_version(language))
+        result = self.results.get(key)
+        return result.model_copy(update={"cached": True}) if result else None
+    
+    async def execute_code(
+        self,
+        code: str,
+        language: str,
+        on_output: Optional[Callable[[str], Awaitable[None]]] = None,
+        stdin: str = ""
+    ) -> ExecutionResult:
         """
         Execute code and return the result.
         
-        Note: This is a mock implementation for demonstration.
-        In production, use sandboxed containers (Docker, gVisor) or 
-        services like Judge0, Piston API for secure code execution.
+        Deterministic results are memoized by content, and identical
+        executions already in progress are shared rather than re-run. Code
+        that uses randomness, clocks or threads always runs on its own.
+        
+        If on_output is given it receives the program's output as it is
+        produced (in a single chunk for cached results).
+        
+        Note: workers are isolated processes with rlimits, not containers.
+        For hostile workloads, run the backend itself in a sandbox (gVisor,
+        Firecracker) or use services like Judge0, Piston API.
         """
+        if not self.is_cacheable(code, language):
+            self.results.bypassed += 1
+            return await self._execute(code, language, on_output, stdin)
+        
+        key = self.results.make_key(language, code, stdin, self.runtime_version(language))
+        result, source = await self.results.get_or_run(
+            key,
+            lambda: self._execute(code, language, on_output, stdin),
+            self.is_deterministic
+        )
+        
+        if source != "run":
+            if on_output:
+                await on_output(result.output)
+            result = result.model_copy(update={"cached": True})
+        return result
+    
+    async def _execute(
+        self,
+        code: str,
+        language: str,
+        on_output: Optional[Callable[[str], Awaitable[None]]],
+        stdin: str
+    ) -> ExecutionResult:
+        """Dispatch to the executor for a language."""
         start_time = time.time()
         
+        if language == "python":
+            return await self._execute_python(code, start_time, on_output, stdin)
+        
         if language in ["javascript", "typescript"]:
-            return await self._execute_javascript_mock(code, start_time)
-        elif language == "python":
-            return await self._execute_python(code, start_time)
-        else:
-            return await self._execute_mock(code, language, start_time)
+            return await self._execute_javascript(code, language, start_time, on_output, stdin)
+        
+        if language not in TOOLCHAINS:
+            return ExecutionResult(
+                output="No output",
+                error=f"EnvironmentError: unsupported language: {language}",
+                executionTime=int((time.time() - start_time) * 1000)
+            )
+        
+        return await self._execute_compiled(code, language, start_time, on_output, stdin)
     
-    async def _execute_javascript_mock(self, code: str, start_time: float) -> ExecutionResult:
-        """Mock JavaScript/TypeScript execution."""
-        # For now, return mock output
-        # In production, use Node.js subprocess or a JS engine
-        output = "[Mock JavaScript Output]\nJavaScript execution is simulated.\n"
-        output += f"Code received:\n{code[:100]}..."
+    async def _execute_javascript(
+        self,
+        code: str,
+        language: str,
+        start_time: float,
+        on_output: Optional[Callable[[str], Awaitable[None]]] = None,
+        stdin: str = ""
+    ) -> ExecutionResult:
+        """
+        Execute JavaScript (or transpiled TypeScript) in a Node.js worker.
+        
+        Each job runs in a fresh vm context with a timeout and a capped V8
+        heap; TypeScript is transpiled once per distinct source.
+        """
+        if language == "typescript":
+            code, error_msg = await self.node_workers.transpile(code)
+            if error_msg:
+                return ExecutionResult(
+                    output="No output",
+                    error=error_msg,
+                    executionTime=int((time.time() - start_time) * 1000)
+                )
+        
+        result = await self.node_workers.run(code, on_output, stdin)
         
         execution_time = int((time.time() - start_time) * 1000)
         
         return ExecutionResult(
-            output=output,
+            output=result["output"] or "No output",
+            error=result["error"],
             executionTime=execution_time
         )
     
-    async def _execute_python(self, code: str, start_time: float) -> ExecutionResult:
+    async def _execute_python(
+        self,
+        code: str,
+        start_time: float,
+        on_output: Optional[Callable[[str], Awaitable[None]]] = None,
+        stdin: str = ""
+    ) -> ExecutionResult:
         """
-        Execute Python code in a restricted environment.
+        Execute Python code in a sandboxed worker process.
         
-        WARNING: This is still not fully secure. For production, use:
-        - Docker containers with resource limits
-        - RestrictedPython library
-        - External sandboxed execution services
+        Workers run with a restricted set of builtins, a wall-clock timeout,
+        CPU/memory rlimits and an output cap; hung or crashed workers are
+        killed and replaced by the pool.
         """
-        output_buffer = io.StringIO()
-        error_buffer = io.StringIO()
-        error_msg = None
-        
-        try:
-            # Redirect stdout and stderr
-            with redirect_stdout(output_buffer), redirect_stderr(error_buffer):
-                # Create a restricted namespace
-                namespace = {
-                    '__builtins__': {
-                        'print': print,
-                        'len': len,
-                        'range': range,
-                        'str': str,
-                        'int': int,
-                        'float': float,
-                        'list': list,
-                        'dict': dict,
-                        'tuple': tuple,
-                        'set': set,
-                        'True': True,
-                        'False': False,
-                        'None': None,
-                    }
-                }
-                
-                # Execute the code
-                exec(code, namespace)
-        
-        except Exception as e:
-            error_msg = f"{type(e).__name__}: {str(e)}"
-        
-        output = output_buffer.getvalue()
-        error_output = error_buffer.getvalue()
-        
-        if error_output and not error_msg:
-            error_msg = error_output
-        
-        if not output and not error_msg:
-            output = "No output"
+        result = await self.python_workers.run(code, on_output, stdin)
+        
+        output = result["output"]
+        error_msg = result["error"]
         
         execution_time = int((time.time() - start_time) * 1000)
         
@@ -107,15 +242,28 @@ class CodeExecutor:
             executionTime=execution_time
         )
     
-    async def _execute_mock(self, code: str, language: str, start_time: float) -> ExecutionResult:
-        """Mock execution for unsupported languages."""
-        output = f"[Mock {language.title()} Output]\n"
-        output += f"Execution for {language} is simulated.\n"
-        output += f"Code received:\n{code[:100]}..."
+    async def _execute_compiled(
+        self,
+        code: str,
+        language: str,
+        start_time: float,
+        on_output: Optional[Callable[[str], Awaitable[None]]] = None,
+        stdin: str = ""
+    ) -> ExecutionResult:
+        """
+        Compile with the local toolchain (or reuse a cached build) and run.
+        
+        Compile and run phases are timed separately.
+        """
+        result = await self.compiled.run(code, language, on_output, stdin)
         
         execution_time = int((time.time() - start_time) * 1000)
         
         return ExecutionResult(
-            output=output,
-            executionTime=execution_time
+            output=result["output"] or "No output",
+            error=result["error"],
+            executionTime=execution_time,
+            compileTime=result["compileTime"],
+            runTime=result["runTime"],
+            compileCached=result["compileCached"]
         )
@@ -0,0 +1,452 @@
+"""
+Compile-and-run backends for Java, C++, Go and Rust using local toolchains.
+
+Build outputs are kept in a content-addressed directory cache, so running
+unchanged code again skips the compiler.
+"""
+import asyncio
+import codecs
+import hashlib
+import os
+import shutil
+import signal
+import tempfile
+import time
+from dataclasses import dataclass
+from typing import Optional, Dict, Any, Callable, Awaitable, List, Tuple
+
+try:
+    import resource
+except ImportError:  # pragma: no cover - non-POSIX platforms
+    resource = None
+
+from app.services.python_sandbox import TRUNCATED_MARKER
+
+
+@dataclass(frozen=True)
+class Toolchain:
+    """How to build and run one language."""
+    
+    source_name: str
+    compiler: str
+    compile_args: List[str]
+    run_args: List[str]
+    version_args: List[str]
+    # Go and the JVM reserve far more address space than they use
+    limit_address_space: bool = True
+
+
+TOOLCHAINS: Dict[str, Toolchain] = {
+    "cpp": Toolchain(
+        source_name="main.cpp",
+        compiler="g++",
+        compile_args=["g++", "-O2", "-std=c++17", "-o", "{out}/main", "{src}"],
+        run_args=["{out}/main"],
+        version_args=["g++", "--version"]
+    ),
+    "rust": Toolchain(
+        source_name="main.rs",
+        compiler="rustc",
+        compile_args=["rustc", "-O", "--edition", "2021", "-o", "{out}/main", "{src}"],
+        run_args=["{out}/main"],
+        version_args=["rustc", "--version"]
+    ),
+    "go": Toolchain(
+        source_name="main.go",
+        compiler="go",
+        compile_args=["go", "build", "-o", "{out}/main", "{src}"],
+        run_args=["{out}/main"],
+        version_args=["go", "version"],
+        limit_address_space=False
+    ),
+    "java": Toolchain(
+        source_name="Main.java",
+        compiler="javac",
+        compile_args=["javac", "-d", "{out}", "{src}"],
+        run_args=["java", "-Xss8m", "-Xmx{memory}m", "-cp", "{out}", "Main"],
+        version_args=["javac", "-version"],
+        limit_address_space=False
+    ),
+}
+
+COMPILE_ERROR_FILE = "compile_error.txt"
+
+
+class CompiledRunner:
+    """
+    Compiles submissions with local toolchains and runs the binaries.
+    
+    Artifacts live under cache_dir/<key>, where key hashes the language,
+    toolchain version and source; compiler errors are cached the same way.
+    Compilation is bounded by its own semaphore (separate from the
+    execution queue that bounds runs), identical concurrent builds share
+    one compiler process, and the cache is trimmed least-recently-used
+    once it grows past max_cache_bytes.
+    """
+    
+    def __init__(
+        self,
+        cache_dir: Optional[str] = None,
+        compile_concurrency: int = 2,
+        compile_timeout_seconds: float = 30,
+        timeout_seconds: float = 5,
+        memory_limit_mb: int = 256,
+        max_output_bytes: int = 64 * 1024,
+        max_cache_bytes: int = 512 * 1024 * 1024
+    ):
+        self.cache_dir = cache_dir or os.path.join(tempfile.gettempdir(), "codecollab-build-cache")
+        self.compile_timeout_seconds = compile_timeout_seconds
+        self.timeout_seconds = timeout_seconds
+        self.memory_limit_mb = memory_limit_mb
+        self.max_output_bytes = max_output_bytes
+        self.max_cache_bytes = max_cache_bytes
+        self._compile_concurrency = compile_concurrency
+        self._compile_slots: Optional[asyncio.Semaphore] = None
+        self._building: Dict[str, asyncio.Future] = {}
+        self._versions: Dict[str, str] = {}
+        
+        # Metrics
+        self.compiles = 0
+        self.cache_hits = 0
+    
+    def version(self, language: str) -> str:
+        """Toolchain version for a language, "unavailable", or "unknown" until load_versions() ran."""
+        return self._versions.get(language, "unknown")
+    
+    async def load_versions(self, languages: Optional[List[str]] = None):
+        """Ask each toolchain for its version (once), without blocking the event loop."""
+        pending = [language for language in (languages or list(TOOLCHAINS)) if language not in self._versions]
+        versions = await asyncio.gather(*(self._probe_version(TOOLCHAINS[language]) for language in pending))
+        for language, version in zip(pending, versions):
+            self._versions.setdefault(language, version)
+    
+    async def _probe_version(self, toolchain: Toolchain) -> str:
+        if not shutil.which(toolchain.compiler):
+            return "unavailable"
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *toolchain.version_args,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+        except OSError:
+            return "unavailable"
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(), 10)
+            return (stdout or stderr).decode("utf-8", "replace").strip().splitlines()[0]
+        except (asyncio.TimeoutError, IndexError):
+            return "unavailable"
+        finally:
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+    
+    def artifact_key(self, language: str, code: str) -> str:
+        digest = hashlib.sha256()
+        for part in (language, self.version(language), " ".join(TOOLCHAINS[language].compile_args), code):
+            data = part.encode("utf-8")
+            digest.update(len(data).to_bytes(8, "big"))
+            digest.update(data)
+        return digest.hexdigest()
+    
+    async def run(
+        self,
+        code: str,
+        language: str,
+        on_output: Optional[Callable[[str], Awaitable[None]]] = None,
+        stdin: str = ""
+    ) -> Dict[str, Any]:
+        """
+        Compile (or reuse a cached build of) code and run it.
+        
+        Returns a dict with "output", "error", "truncated", "compileTime",
+        "runTime" (milliseconds) and "compileCached".
+        """
+        toolchain = TOOLCHAINS[language]
+        await self.load_versions([language])
+        if self.version(language) == "unavailable":
+            return self._result(error=f"EnvironmentError: {toolchain.compiler} is not installed on the server")
+        
+        compile_start = time.perf_counter()
+        artifact_dir, compile_error, compile_cached = await self._build(language, code)
+        compile_ms = int((time.perf_counter() - compile_start) * 1000)
+        
+        if compile_error is not None:
+            return self._result(error=compile_error, compile_ms=compile_ms, compile_cached=compile_cached)
+        
+        run_start = time.perf_counter()
+        command = [arg.format(out=artifact_dir, memory=self.memory_limit_mb) for arg in toolchain.run_args]
+        output, error, truncated = await self._run_binary(command, toolchain, on_output, stdin)
+        run_ms = int((time.perf_counter() - run_start) * 1000)
+        
+        return self._result(output, error, truncated, compile_ms, run_ms, compile_cached)
+    
+    def stats(self) -> Dict[str, Any]:
+        return {"compiles": self.compiles, "cacheHits": self.cache_hits, "building": len(self._building)}
+    
+    @staticmethod
+    def _result(
+        output: str = "",
+        error: Optional[str] = None,
+        truncated: bool = False,
+        compile_ms: Optional[int] = None,
+        run_ms: Optional[int] = None,
+        compile_cached: Optional[bool] = None
+    ) -> Dict[str, Any]:
+        return {
+            "output": output,
+            "error": error,
+            "truncated": truncated,
+            "compileTime": compile_ms,
+            "runTime": run_ms,
+            "compileCached": compile_cached
+        }
+    
+    async def _build(self, language: str, code: str) -> Tuple[str, Optional[str], bool]:
+        """Return (artifact_dir, compile_error, cached), compiling at most once per key."""
+        key = self.artifact_key(language, code)
+        artifact_dir = os.path.join(self.cache_dir, key[:2], key)
+        
+        if os.path.isdir(artifact_dir):
+            self.cache_hits += 1
+            # Touch for least-recently-used trimming
+            os.utime(artifact_dir)
+            return artifact_dir, self._read_compile_error(artifact_dir), True
+        
+        building = self._building.get(key)
+        if building is not None:
+            # Share the build already in progress, then look again
+            await asyncio.shield(building)
+            return await self._build(language, code)
+        
+        future = asyncio.get_running_loop().create_future()
+        self._building[key] = future
+        try:
+            error = await self._compile(language, code, artifact_dir)
+        finally:
+            del self._building[key]
+            future.set_result(None)
+        return artifact_dir, error, False
+    
+    async def _compile(self, language: str, code: str, artifact_dir: str) -> Optional[str]:
+        """Compile into a scratch directory and move it into the cache atomically."""
+        toolchain = TOOLCHAINS[language]
+        if self._compile_slots is None:
+            self._compile_slots = asyncio.Semaphore(self._compile_concurrency)
+        
+        os.makedirs(os.path.dirname(artifact_dir), exist_ok=True)
+        scratch = tempfile.mkdtemp(prefix="build-", dir=self.cache_dir)
+        try:
+            source = os.path.join(scratch, toolchain.source_name)
+            with open(source, "w", encoding="utf-8") as f:
+                f.write(code)
+            command = [arg.format(out=scratch, src=source) for arg in toolchain.compile_args]
+            
+            async with self._compile_slots:
+                self.compiles += 1
+                process = await asyncio.create_subprocess_exec(
+                    *command,
+                    cwd=scratch,
+                    env=self._build_env(),
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.STDOUT,
+                    start_new_session=True
+                )
+                try:
+                    stdout, _ = await asyncio.wait_for(process.communicate(), self.compile_timeout_seconds)
+                except asyncio.TimeoutError:
+                    # Not cached: a slow compile may succeed on a less busy server
+                    return f"TimeoutError: compilation exceeded {self.compile_timeout_seconds} seconds"
+                finally:
+                    # Timed out, or the caller was cancelled: never leave the compiler running
+                    if process.returncode is None:
+                        self._kill_group(process)
+                        await process.wait()
+            
+            error = None
+            if process.returncode != 0:
+                message = stdout.decode("utf-8", "replace").replace(scratch + os.sep, "")
+                error = "CompileError: " + message[:self.max_output_bytes]
+                with open(os.path.join(scratch, COMPILE_ERROR_FILE), "w", encoding="utf-8") as f:
+                    f.write(error)
+            
+            os.remove(source)
+            try:
+                os.rename(scratch, artifact_dir)
+            except OSError:
+                # Another process published the same artifact first
+                pass
+            await asyncio.to_thread(self._trim_cache)
+            return error
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+    
+    def _build_env(self) -> Dict[str, str]:
+        env = {
+            "PATH": os.environ.get("PATH", "/usr/bin:/bin"),
+            # rustup and friends find their toolchains through HOME
+            "HOME": os.environ.get("HOME", self.cache_dir),
+            "LANG": "C.UTF-8",
+            # Go keeps its own build cache next to ours
+            "GOCACHE": os.path.join(self.cache_dir, "gocache"),
+            "GOPATH": os.path.join(self.cache_dir, "gopath"),
+            "GO111MODULE": "off",
+        }
+        for name in ("JAVA_HOME", "RUSTUP_HOME", "CARGO_HOME"):
+            if name in os.environ:
+                env[name] = os.environ[name]
+        return env
+    
+    @staticmethod
+    def _read_compile_error(artifact_dir: str) -> Optional[str]:
+        try:
+            with open(os.path.join(artifact_dir, COMPILE_ERROR_FILE), encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+    
+    def _trim_cache(self):
+        """Delete least recently used artifacts beyond max_cache_bytes (blocking; run in a thread)."""
+        entries = []
+        total = 0
+        for shard in os.scandir(self.cache_dir):
+            if not shard.is_dir() or len(shard.name) != 2:
+                continue
+            for entry in os.scandir(shard.path):
+                try:
+                    size = sum(
+                        os.path.getsize(os.path.join(root, name))
+                        for root, _, names in os.walk(entry.path)
+                        for name in names
+                    )
+                    entries.append((entry.stat().st_mtime, size, entry.path))
+                except OSError:
+                    # Removed by a concurrent trim
+                    continue
+                total += size
+        
+        for _, size, path in sorted(entries):
+            if total <= self.max_cache_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+    
+    def _limits(self, toolchain: Toolchain):
+        """preexec_fn for the run phase: CPU and address-space rlimits."""
+        cpu_seconds = int(self.timeout_seconds) + 1
+        memory_bytes = self.memory_limit_mb * 1024 * 1024
+        
+        def apply():
+            if resource is None:
+                return
+            resource.setrlimit(resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds))
+            if toolchain.limit_address_space:
+                resource.setrlimit(resource.RLIMIT_AS, (memory_bytes, memory_bytes))
+        
+        return apply
+    
+    async def _run_binary(
+        self,
+        command: List[str],
+        toolchain: Toolchain,
+        on_output: Optional[Callable[[str], Awaitable[None]]],
+        stdin: str
+    ) -> Tuple[str, Optional[str], bool]:
+        """Run a built program with limits; returns (output, error, truncated)."""
+        workdir = tempfile.mkdtemp(prefix="run-")
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *command,
+                cwd=workdir,
+                env={"PATH": os.environ.get("PATH", "/usr/bin:/bin"), "HOME": workdir, "LANG": "C.UTF-8"},
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                preexec_fn=self._limits(toolchain),
+                start_new_session=True
+            )
+        except OSError as e:
+            shutil.rmtree(workdir, ignore_errors=True)
+            return "", f"EnvironmentError: {e}", False
+        
+        output_parts: List[str] = []
+        state = {"size": 0, "truncated": False}
+        decoder = codecs.getincrementaldecoder("utf-8")("replace")
+        
+        async def read_stdout():
+            while True:
+                data = await process.stdout.read(4096)
+                if not data:
+                    break
+                if state["truncated"]:
+                    # Keep draining so the program is not blocked on a full pipe
+                    continue
+                room = self.max_output_bytes - state["size"]
+                if len(data) > room:
+                    data = data[:room]
+                    state["truncated"] = True
+                state["size"] += len(data)
+                text = decoder.decode(data, final=state["truncated"])
+                if text:
+                    output_parts.append(text)
+                    if on_output is not None:
+                        await on_output(text)
+        
+        async def read_stderr() -> bytes:
+            data = b""
+            while True:
+                chunk = await process.stderr.read(4096)
+                if not chunk:
+                    return data[:self.max_output_bytes]
+                if len(data) < self.max_output_bytes:
+                    data += chunk
+        
+        async def feed_stdin():
+            try:
+                process.stdin.write(stdin.encode("utf-8"))
+                await process.stdin.drain()
+                process.stdin.close()
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+        
+        stderr_task = asyncio.ensure_future(read_stderr())
+        timed_out = False
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(feed_stdin(), read_stdout(), process.wait()),
+                self.timeout_seconds
+            )
+        except asyncio.TimeoutError:
+            timed_out = True
+        finally:
+            # Timed out, or the caller was cancelled (client gone, queue timeout):
+            # kill the program before waiting for its pipes to close
+            if process.returncode is None:
+                self._kill_group(process)
+                await process.wait()
+            stderr_output = (await stderr_task).decode("utf-8", "replace")
+            shutil.rmtree(workdir, ignore_errors=True)
+        
+        output = "".join(output_parts)
+        if state["truncated"]:
+            output += TRUNCATED_MARKER
+        
+        error = None
+        if timed_out:
+            error = f"TimeoutError: execution exceeded {self.timeout_seconds} seconds"
+        elif process.returncode in (-signal.SIGKILL, -signal.SIGXCPU):
+            error = "ResourceError: execution was terminated (CPU or memory limit exceeded)"
+        elif process.returncode < 0:
+            error = stderr_output or f"RuntimeError: process killed by {signal.Signals(-process.returncode).name}"
+        elif process.returncode != 0:
+            error = stderr_output or f"RuntimeError: process exited with status {process.returncode}"
+        elif stderr_output:
+            error = stderr_output
+        return output, error, state["truncated"]
+    
+    @staticmethod
+    def _kill_group(process: asyncio.subprocess.Process):
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
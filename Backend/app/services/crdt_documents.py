@@ -0,0 +1,525 @@
+"""
+Server side of the Yjs sync protocol (compatible with the y-websocket client).
+
+Every collaboratively edited session has one pycrdt document in memory,
+shared by all of its Yjs sockets. Document updates are appended to a
+per-session log in the session backend, which is periodically compacted
+into a snapshot, and the session's `code` column is derived from the
+document's text.
+
+Each process keeps its own copy of a document. When another process
+announces a new code column for the session over the session bus, the
+local copy merges the stored log, so peers on every process converge.
+"""
+import asyncio
+import time
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from pycrdt import (
+    Awareness,
+    Decoder,
+    Doc,
+    Text,
+    YMessageType,
+    YSyncMessageType,
+    create_awareness_message,
+    create_sync_message,
+    create_update_message,
+    handle_sync_message,
+    merge_updates,
+    read_message
+)
+from app.config import settings
+from app.models.schemas import Session
+from app.services.session_delta import diff_text, from_utf16_edits
+
+# The shared text the editor binds to (yDoc.getText('monaco') in the frontend)
+TEXT_NAME = "monaco"
+
+# Yjs client that writes the seed text. Processes that seed the same code
+# produce identical items, which merge into one copy instead of repeating it.
+SEED_CLIENT_ID = 0
+
+
+def _awareness_client_ids(update: bytes) -> List[int]:
+    """Client IDs described by an encoded awareness update."""
+    decoder = Decoder(update)
+    client_ids = []
+    for _ in range(decoder.read_var_uint()):
+        client_ids.append(decoder.read_var_uint())
+        decoder.read_var_uint()  # clock
+        decoder.read_var_string()  # state
+    return client_ids
+
+
+class StaleVersionError(Exception):
+    """Edits were made against a version of the text that is no longer current."""
+    
+    def __init__(self, version: int):
+        super().__init__(f"Code is at version {version}")
+        self.version = version
+
+
+class SessionGoneError(Exception):
+    """The document's session was deleted or archived; its pending updates are dropped."""
+
+
+class SessionDocument:
+    """
+    One session's Yjs document and the sockets editing it.
+    
+    Updates received from a peer are applied and relayed to the other peers.
+    Every change to the document, whatever its origin, is queued in
+    `pending` until the next flush appends it (merged into a single update)
+    to the session's update log. Once the log holds compact_after_updates
+    entries or compact_after_bytes bytes, the flush replaces it with a
+    snapshot of the document, so loading stays one snapshot plus a short tail.
+    
+    `version` identifies the current text for PATCH clients. It goes up by
+    one per transaction that changes the text and is stored with every log
+    entry and snapshot, so a reloaded document resumes at the version its
+    stored text had. A document stored before versions were kept starts
+    from the load time in microseconds instead.
+    """
+    
+    def __init__(
+        self,
+        session_id: str,
+        db,
+        snapshot: Optional[bytes],
+        log: List[Tuple[int, bytes]],
+        code: str,
+        compact_after_updates: int = 100,
+        compact_after_bytes: int = 256 * 1024,
+        version: Optional[int] = None
+    ):
+        self.session_id = session_id
+        self.db = db
+        self.compact_after_updates = compact_after_updates
+        self.compact_after_bytes = compact_after_bytes
+        self.doc = Doc()
+        self.text = self.doc.get(TEXT_NAME, type=Text)
+        self.awareness = Awareness(self.doc)
+        # The server has no cursor of its own
+        self.awareness.set_local_state(None)
+        
+        # Awareness clients announced by each socket, and who it belongs to
+        self.peers: Dict[Any, Set[int]] = {}
+        self.peer_users: Dict[Any, Optional[str]] = {}
+        self.pending: List[bytes] = []
+        self.last_editor: Optional[str] = None
+        self._outgoing: List[bytes] = []
+        self._lock: Optional[asyncio.Lock] = None
+        # Set while merging stored updates, which need no persisting
+        self._merging = False
+        self._unsubscribe: Optional[Callable[[], None]] = None
+        # When a socket or a code write last opened the document
+        self.touched = time.monotonic()
+        
+        # Stored log entries not covered by the snapshot yet
+        self.log_length = len(log)
+        self.log_bytes = sum(len(update) for _, update in log)
+        self.last_update_id: Optional[int] = log[-1][0] if log else None
+        
+        updates = ([snapshot] if snapshot else []) + [update for _, update in log]
+        for update in updates:
+            self.doc.apply_update(update)
+        self._subscription = self.doc.observe(self._on_update)
+        if version is None:
+            version = time.time_ns() // 1000 if updates else 0
+        self.version = version
+        self._text_subscription = self.text.observe(self._on_text_change)
+        
+        if not updates and code:
+            # First collaborative use of this session: seed the text from the code column
+            seed = Doc(client_id=SEED_CLIENT_ID)
+            seed.get(TEXT_NAME, type=Text).insert(0, code)
+            self.doc.apply_update(seed.get_update())
+            self._outgoing.clear()
+        # The code column as of the last flush
+        self.code = str(self.text) if updates else code
+    
+    def _on_update(self, event):
+        if not self._merging:
+            self.pending.append(event.update)
+        self._outgoing.append(event.update)
+    
+    def _on_text_change(self, event):
+        self.version += 1
+    
+    async def connect(self, peer, user_id: Optional[str] = None):
+        """Add a socket and start the sync handshake (SYNC_STEP1 plus current awareness)."""
+        self.peers[peer] = set()
+        self.peer_users[peer] = user_id
+        await peer.send_bytes(create_sync_message(self.doc))
+        
+        client_ids = list(self.awareness.states)
+        if client_ids:
+            await peer.send_bytes(create_awareness_message(self.awareness.encode_awareness_update(client_ids)))
+    
+    async def disconnect(self, peer):
+        """Remove a socket and tell the others its cursors are gone."""
+        client_ids = list(self.peers.pop(peer, ()))
+        self.peer_users.pop(peer, None)
+        if client_ids:
+            self.awareness.remove_awareness_states(client_ids, peer)
+            message = create_awareness_message(self.awareness.encode_awareness_update(client_ids))
+            await self._broadcast(message, exclude=peer)
+    
+    async def handle_message(self, peer, message: bytes):
+        """Process one sync or awareness message from a socket."""
+        if len(message) < 2:
+            return
+        
+        if message[0] == YMessageType.SYNC:
+            reply = handle_sync_message(message[1:], self.doc)
+            if reply is not None:
+                await peer.send_bytes(reply)
+            if message[1] != YSyncMessageType.SYNC_STEP1:
+                if self._outgoing:
+                    self.last_editor = self.peer_users.get(peer)
+                await self._relay(exclude=peer)
+        
+        elif message[0] == YMessageType.AWARENESS:
+            update = read_message(message[1:])
+            self.peers.setdefault(peer, set()).update(_awareness_client_ids(update))
+            self.awareness.apply_awareness_update(update, peer)
+            await self._broadcast(message, exclude=peer)
+    
+    async def replace_text(self, code: str, user_id: Optional[str] = None) -> str:
+        """
+        Turn the shared text into `code` by replacing only the changed range.
+        
+        Peers receive a small update (and keep their cursors) instead of a
+        whole new text. Returns the resulting text.
+        """
+        edits = diff_text(str(self.text), code)
+        if edits:
+            self._apply_edits(edits)
+            self.last_editor = user_id
+            await self._relay()
+        return str(self.text)
+    
+    async def apply_edits(self, base_version: int, edits: List[Tuple[int, int, str]], user_id: Optional[str] = None) -> int:
+        """
+        Apply range edits (offset, delete count, insert text) made against
+        `base_version`, in order and as one transaction. Offsets and counts
+        are UTF-16 code units, as in the editor.
+        
+        Raises StaleVersionError if the text changed since base_version and
+        ValueError if an edit falls outside the text or inside a surrogate
+        pair. Returns the new version.
+        """
+        if base_version != self.version:
+            raise StaleVersionError(self.version)
+        
+        edits = from_utf16_edits(str(self.text), edits)
+        if any(delete_count or insert for _, delete_count, insert in edits):
+            self._apply_edits(edits)
+            self.last_editor = user_id
+            await self._relay()
+        return self.version
+    
+    def _apply_edits(self, edits: List[Tuple[int, int, str]]):
+        current = str(self.text)
+        with self.doc.transaction():
+            for offset, delete_count, insert in edits:
+                # pycrdt addresses text by UTF-8 byte offset
+                start = len(current[:offset].encode("utf-8"))
+                if delete_count:
+                    end = start + len(current[offset:offset + delete_count].encode("utf-8"))
+                    del self.text[start:end]
+                if insert:
+                    self.text.insert(start, insert)
+                current = current[:offset] + insert + current[offset + delete_count:]
+    
+    async def pull(self, code: str):
+        """
+        Merge the stored updates (written by another process) into the
+        document and relay what changed to the peers. `code` is the code
+        column that process wrote.
+        """
+        await self._merge_stored()
+        self.code = code
+        await self._relay()
+    
+    async def _merge_stored(self):
+        snapshot, log, _ = await self.db.load_document(self.session_id)
+        self._merging = True
+        try:
+            for update in ([snapshot] if snapshot else []) + [update for _, update in log]:
+                self.doc.apply_update(update)
+        finally:
+            self._merging = False
+    
+    async def flush(self) -> Optional[float]:
+        """
+        Persist queued updates as one merged update, compact the log if it
+        grew past its limits, then refresh the code column.
+        
+        Returns how long compaction took (ms), or None if it did not run.
+        Raises SessionGoneError, with the queued updates dropped, if the
+        session no longer exists.
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        
+        async with self._lock:
+            if self.pending:
+                updates, self.pending = self.pending, []
+                update = merge_updates(*updates)
+                try:
+                    update_id = await self.db.append_document_update(self.session_id, update, self.version)
+                except Exception as e:
+                    print(f"Error persisting document updates: {e}")
+                    self.pending[:0] = updates
+                    raise
+                if update_id is None:
+                    raise SessionGoneError(self.session_id)
+                self.last_update_id = update_id
+                self.log_length += 1
+                self.log_bytes += len(update)
+            
+            compaction_ms = None
+            if self.last_update_id is not None and (
+                self.log_length >= self.compact_after_updates or self.log_bytes >= self.compact_after_bytes
+            ):
+                compaction_ms = await self._compact()
+            
+            await self.save_code()
+            return compaction_ms
+    
+    async def _compact(self) -> float:
+        """Fold the stored log into a snapshot of the document."""
+        started = time.perf_counter()
+        # Other processes may have logged updates this copy has not merged
+        # yet; anything newer it holds is still pending and applying it twice
+        # is harmless
+        await self._merge_stored()
+        snapshot = self.doc.get_update()
+        try:
+            await self.db.compact_document(self.session_id, snapshot, self.last_update_id, self.version)
+        except Exception as e:
+            print(f"Error compacting document log: {e}")
+            raise
+        
+        self.log_length = 0
+        self.log_bytes = 0
+        self.last_update_id = None
+        return (time.perf_counter() - started) * 1000
+    
+    async def save_code(self) -> Optional[Session]:
+        """Write the text derived from the document to the code column if it changed."""
+        code = str(self.text)
+        if code == self.code:
+            return None
+        
+        self.code = code
+        # Edits from a socket without ?userId= have no editor: lastModifiedBy
+        # keeps its value and no user's activity is touched
+        if settings.code_write_behind:
+            return await self.db.stage_code(self.session_id, code, self.last_editor, int(time.time() * 1000))
+        
+        updates = {"code": code}
+        if self.last_editor:
+            updates["lastModifiedBy"] = self.last_editor
+        return await self.db.update_session(self.session_id, updates)
+    
+    def close(self):
+        if self._unsubscribe is not None:
+            self._unsubscribe()
+            self._unsubscribe = None
+        if self._subscription is not None:
+            self.doc.unobserve(self._subscription)
+            self.text.unobserve(self._text_subscription)
+            self._subscription = None
+            self._text_subscription = None
+    
+    async def _relay(self, exclude=None):
+        """Send document changes made since the last relay to the peers."""
+        if not self._outgoing:
+            return
+        
+        updates, self._outgoing = self._outgoing, []
+        message = create_update_message(merge_updates(*updates) if len(updates) > 1 else updates[0])
+        await self._broadcast(message, exclude)
+    
+    async def _broadcast(self, message: bytes, exclude=None):
+        for peer in list(self.peers):
+            if peer is exclude:
+                continue
+            try:
+                await peer.send_bytes(message)
+            except Exception:
+                # The peer's own receive loop cleans it up
+                pass
+
+
+class DocumentStore:
+    """
+    Open session documents.
+    
+    A document is loaded from its stored updates on first use (a Yjs socket
+    or a code write) and kept while it has peers. A background task flushes
+    every open document each flush_interval_seconds and closes the ones
+    nobody is connected to any more and nothing has used for an interval.
+    Open documents listen for session updates and pull in edits stored by
+    other processes. Documents of deleted or archived sessions are closed
+    without being flushed.
+    """
+    
+    def __init__(
+        self,
+        flush_interval_seconds: float = 1.0,
+        compact_after_updates: int = 100,
+        compact_after_bytes: int = 256 * 1024
+    ):
+        self.interval = flush_interval_seconds
+        self.compact_after_updates = compact_after_updates
+        self.compact_after_bytes = compact_after_bytes
+        self.documents: Dict[str, SessionDocument] = {}
+        self._opening: Dict[str, asyncio.Future] = {}
+        self._task: Optional[asyncio.Task] = None
+        
+        # Metrics
+        self.loaded = 0
+        self.discarded = 0
+        self.pulls = 0
+        self.flushes = 0
+        self.compactions = 0
+        self.compaction_ms_total = 0.0
+        self.compaction_ms_max = 0.0
+        self.loaded_log_length_max = 0
+    
+    def is_active(self, session_id: str) -> bool:
+        """Whether a Yjs socket is editing the session."""
+        document = self.documents.get(session_id)
+        return document is not None and bool(document.peers)
+    
+    async def open(self, db, session_id: str) -> Optional[SessionDocument]:
+        """The session's document, loaded if needed; None if the session does not exist."""
+        document = self.documents.get(session_id)
+        if document is None:
+            future = self._opening.get(session_id)
+            if future is None:
+                future = asyncio.ensure_future(self._load(db, session_id))
+                self._opening[session_id] = future
+                future.add_done_callback(lambda _: self._opening.pop(session_id, None))
+            document = await asyncio.shield(future)
+        if document is not None:
+            # Keeps the flusher from closing it under the caller
+            document.touched = time.monotonic()
+        return document
+    
+    def discard(self, session_id: str):
+        """Close a deleted or archived session's document, dropping its unflushed updates."""
+        document = self.documents.pop(session_id, None)
+        if document is not None:
+            document.close()
+            self.discarded += 1
+    
+    async def flush(self):
+        """Flush every open document and close the idle ones."""
+        for session_id, document in list(self.documents.items()):
+            try:
+                compaction_ms = await document.flush()
+            except SessionGoneError:
+                if self.documents.get(session_id) is document:
+                    self.discard(session_id)
+                continue
+            except Exception:
+                # Logged by the document; retried on the next flush
+                continue
+            
+            self.flushes += 1
+            if compaction_ms is not None:
+                self.compactions += 1
+                self.compaction_ms_total += compaction_ms
+                self.compaction_ms_max = max(self.compaction_ms_max, compaction_ms)
+            if (
+                not document.peers and not document.pending
+                and time.monotonic() - document.touched >= self.interval
+                and self.documents.get(session_id) is document
+            ):
+                document.close()
+                del self.documents[session_id]
+    
+    async def stop(self):
+        """Stop the flusher, persist every open document and close them all."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        
+        await self.flush()
+        for document in self.documents.values():
+            document.close()
+        self.documents.clear()
+    
+    def stats(self) -> Dict[str, Any]:
+        documents = list(self.documents.values())
+        return {
+            "open": len(documents),
+            "peers": sum(len(d.peers) for d in documents),
+            "pendingUpdates": sum(len(d.pending) for d in documents),
+            "loaded": self.loaded,
+            "discarded": self.discarded,
+            "pulls": self.pulls,
+            "flushes": self.flushes,
+            # Uncompacted log entries of the open documents
+            "logLength": sum(d.log_length for d in documents),
+            "logBytes": sum(d.log_bytes for d in documents),
+            "maxLogLength": max((d.log_length for d in documents), default=0),
+            "maxLoadedLogLength": self.loaded_log_length_max,
+            "compactions": self.compactions,
+            "compactionMsAvg": round(self.compaction_ms_total / self.compactions, 2) if self.compactions else 0,
+            "compactionMsMax": round(self.compaction_ms_max, 2),
+        }
+    
+    async def _load(self, db, session_id: str) -> Optional[SessionDocument]:
+        session = await db.get_session(session_id)
+        if not session:
+            return None
+        
+        snapshot, log, version = await db.load_document(session_id)
+        self.loaded_log_length_max = max(self.loaded_log_length_max, len(log))
+        document = self.documents.get(session_id)
+        if document is None:
+            document = SessionDocument(
+                session_id, db, snapshot, log, session.code,
+                self.compact_after_updates, self.compact_after_bytes, version
+            )
+            document._unsubscribe = db.subscribe(
+                session_id, lambda session: self._on_session_update(document, session)
+            )
+            self.documents[session_id] = document
+            self.loaded += 1
+            self._ensure_started()
+        return document
+    
+    async def _on_session_update(self, document: SessionDocument, session: Session):
+        # Writes from this process set document.code first; a different code
+        # column was written by another process
+        if session.code != document.code and self.documents.get(document.session_id) is document:
+            self.pulls += 1
+            await document.pull(session.code)
+    
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+    
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            # Shielded so stop() never cancels a flush half-way
+            await asyncio.shield(self.flush())
+
+
+# Global document store
+document_store = DocumentStore(
+    settings.crdt_flush_interval_seconds,
+    settings.crdt_compact_after_updates,
+    settings.crdt_compact_after_bytes
+)
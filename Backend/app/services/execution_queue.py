@@ -0,0 +1,139 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Dict, Tuple
+from app.config import settings
+
+
+class QueueFullError(Exception):
+    """Raised when the execution queue is at its maximum depth."""
+
+
+class ExecutionQueue:
+    """
+    Bounded job queue in front of the code executors.
+    
+    At most max_concurrency jobs run at once, and at most
+    per_session_concurrency of them belong to the same session. A free slot
+    goes to the waiting session that was served least recently (FIFO within
+    a session), so one busy session cannot starve the others. Submissions
+    beyond max_queue_depth waiting jobs are rejected with QueueFullError.
+    """
+    
+    def __init__(
+        self,
+        max_concurrency: int = 4,
+        per_session_concurrency: int = 1,
+        max_queue_depth: int = 50
+    ):
+        self.max_concurrency = max_concurrency
+        self.per_session_concurrency = per_session_concurrency
+        self.max_queue_depth = max_queue_depth
+        self._waiting: "OrderedDict[str, deque]" = OrderedDict()
+        self._running: Dict[str, int] = {}
+        # Tick at which each active session last got a slot
+        self._last_served: Dict[str, int] = {}
+        self._tick = 0
+        self._total_running = 0
+        self._depth = 0
+    
+    @property
+    def depth(self) -> int:
+        """Number of jobs waiting for a slot."""
+        return self._depth
+    
+    @property
+    def running(self) -> int:
+        """Number of jobs currently running."""
+        return self._total_running
+    
+    async def submit(
+        self,
+        session_id: str,
+        job: Callable[[], Awaitable[Any]]
+    ) -> Tuple[Any, int, int]:
+        """
+        Run job once a slot is free.
+        
+        Returns (result, queue_wait_ms, run_ms).
+        """
+        if self._depth >= self.max_queue_depth:
+            raise QueueFullError(f"Execution queue is full ({self._depth} jobs waiting)")
+        
+        enqueued_at = time.perf_counter()
+        ticket = asyncio.get_running_loop().create_future()
+        self._waiting.setdefault(session_id, deque()).append(ticket)
+        self._depth += 1
+        self._dispatch()
+        
+        try:
+            await ticket
+        except asyncio.CancelledError:
+            if ticket.done() and not ticket.cancelled():
+                # Granted a slot just before being cancelled
+                self._release(session_id)
+            else:
+                self._withdraw(session_id, ticket)
+            raise
+        
+        started_at = time.perf_counter()
+        try:
+            result = await job()
+        finally:
+            self._release(session_id)
+        
+        queue_wait_ms = int((started_at - enqueued_at) * 1000)
+        run_ms = int((time.perf_counter() - started_at) * 1000)
+        return result, queue_wait_ms, run_ms
+    
+    def _dispatch(self):
+        """Grant free slots to waiting jobs, least recently served session first."""
+        while self._total_running < self.max_concurrency:
+            eligible = [
+                session_id for session_id in self._waiting
+                if self._running.get(session_id, 0) < self.per_session_concurrency
+            ]
+            if not eligible:
+                return
+            
+            session_id = min(eligible, key=lambda s: self._last_served.get(s, -1))
+            tickets = self._waiting[session_id]
+            ticket = tickets.popleft()
+            self._depth -= 1
+            if not tickets:
+                del self._waiting[session_id]
+            
+            self._tick += 1
+            self._last_served[session_id] = self._tick
+            self._running[session_id] = self._running.get(session_id, 0) + 1
+            self._total_running += 1
+            ticket.set_result(None)
+    
+    def _release(self, session_id: str):
+        self._total_running -= 1
+        self._running[session_id] -= 1
+        if not self._running[session_id]:
+            del self._running[session_id]
+            if session_id not in self._waiting:
+                self._last_served.pop(session_id, None)
+        self._dispatch()
+    
+    def _withdraw(self, session_id: str, ticket: asyncio.Future):
+        tickets = self._waiting.get(session_id)
+        if tickets is None or ticket not in tickets:
+            return
+        
+        tickets.remove(ticket)
+        self._depth -= 1
+        if not tickets:
+            del self._waiting[session_id]
+            if session_id not in self._running:
+                self._last_served.pop(session_id, None)
+
+
+# Global execution queue
+execution_queue = ExecutionQueue(
+    max_concurrency=settings.execution_max_concurrency,
+    per_session_concurrency=settings.execution_per_session_concurrency,
+    max_queue_depth=settings.execution_max_queue_depth
+)
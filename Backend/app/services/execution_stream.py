@@ -0,0 +1,68 @@
+import uuid
+from typing import Awaitable, Callable
+from app.models.schemas import ExecutionResult
+
+
+class ExecutionStream:
+    """
+    Publishes the output of one execution to every socket in its session.
+    
+    Output chunks go out as sequenced execution_output events while the
+    program runs, followed by a single execution_done event with timings.
+    At most max_bytes of output are streamed; nothing is retained here, so
+    server memory does not grow with the size of the program's output.
+    """
+    
+    def __init__(
+        self,
+        session_id: str,
+        broadcast: Callable[[str, dict], Awaitable[None]],
+        max_bytes: int = 64 * 1024
+    ):
+        self.session_id = session_id
+        self.execution_id = uuid.uuid4().hex
+        self.max_bytes = max_bytes
+        self.seq = 0
+        self.sent_bytes = 0
+        self.truncated = False
+        self._broadcast = broadcast
+    
+    async def output(self, text: str):
+        """Stream one chunk of program output."""
+        if self.truncated:
+            return
+        
+        data = text.encode("utf-8", "replace")
+        room = self.max_bytes - self.sent_bytes
+        if len(data) > room:
+            data = data[:room]
+            text = data.decode("utf-8", "ignore")
+            self.truncated = True
+        
+        if not text:
+            return
+        
+        self.seq += 1
+        self.sent_bytes += len(data)
+        await self._broadcast(self.session_id, {
+            "event": "execution_output",
+            "executionId": self.execution_id,
+            "seq": self.seq,
+            "data": text
+        })
+    
+    async def done(self, result: ExecutionResult):
+        """Announce the end of the execution."""
+        self.seq += 1
+        await self._broadcast(self.session_id, {
+            "event": "execution_done",
+            "executionId": self.execution_id,
+            "seq": self.seq,
+            "data": {
+                "error": result.error,
+                "executionTime": result.executionTime,
+                "queueWaitTime": result.queueWaitTime,
+                "outputBytes": self.sent_bytes,
+                "truncated": self.truncated
+            }
+        })
@@ -0,0 +1,387 @@
+"""
+Pool of long-lived Node.js worker processes for JavaScript/TypeScript.
+
+Each worker runs node_worker.js and executes one job at a time in a fresh
+vm context; jobs and results are exchanged as JSON lines over stdin/stdout.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Callable, Awaitable, Tuple
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "node_worker.js")
+
+# Grace period for the worker to report its own timeout before it is killed
+KILL_GRACE_SECONDS = 0.5
+
+# Fields (and their types) of the "done" reply to each op
+RUN_REPLY = {"output": (str,), "error": (str, type(None)), "truncated": (bool,)}
+TRANSPILE_REPLY = {"code": (str, type(None)), "error": (str, type(None))}
+
+INVALID_REPLY = "ResourceError: the worker sent an invalid reply and was replaced"
+
+
+# Backoff between attempts to start a replacement worker
+RESPAWN_MIN_SECONDS = 0.5
+RESPAWN_MAX_SECONDS = 30
+
+
+class NodeWorkerCrashed(Exception):
+    """The worker process exited or broke the protocol while running a job."""
+
+
+class NodeWorkerUnavailable(Exception):
+    """No worker became idle within the acquire timeout."""
+
+
+class _NodeWorker:
+    """Handle on one node process."""
+    
+    def __init__(self, process: asyncio.subprocess.Process):
+        self.process = process
+        self.jobs = 0
+    
+    async def send(self, message: Dict[str, Any]):
+        self.process.stdin.write(json.dumps(message).encode() + b"\n")
+        await self.process.stdin.drain()
+    
+    async def receive(self) -> Dict[str, Any]:
+        line = await self.process.stdout.readline()
+        if not line:
+            raise NodeWorkerCrashed()
+        try:
+            message = json.loads(line)
+        except ValueError:
+            raise NodeWorkerCrashed(INVALID_REPLY)
+        if not isinstance(message, dict) or not isinstance(message.get("type"), str):
+            raise NodeWorkerCrashed(INVALID_REPLY)
+        return message
+    
+    async def kill(self):
+        if self.process.returncode is None:
+            try:
+                self.process.kill()
+            except ProcessLookupError:
+                pass
+        await self.process.wait()
+
+
+class NodeWorkerPool:
+    """
+    Pool of reusable Node.js workers.
+    
+    Workers are started on first use (or by start()) and serve up to
+    max_jobs_per_worker jobs before being recycled. Every job gets a fresh
+    vm context, a timeout enforced both inside the worker and by killing
+    the process, and the V8 heap is capped with --max-old-space-size.
+    
+    TypeScript is transpiled in a worker once per distinct source and the
+    JavaScript is kept in an LRU keyed by the source hash.
+    
+    Workers that are discarded are replaced by one background task, which
+    retries with backoff while starting a worker fails. A job that gets no
+    worker within acquire_timeout_seconds fails with an EnvironmentError
+    instead of waiting forever.
+    """
+    
+    def __init__(
+        self,
+        size: int = 2,
+        timeout_seconds: float = 5,
+        memory_limit_mb: int = 256,
+        max_output_bytes: int = 64 * 1024,
+        node_binary: str = "node",
+        max_jobs_per_worker: int = 100,
+        transpile_cache_size: int = 256,
+        spawn_timeout_seconds: float = 10,
+        acquire_timeout_seconds: Optional[float] = None
+    ):
+        self.size = size
+        self.timeout_seconds = timeout_seconds
+        self.memory_limit_mb = memory_limit_mb
+        self.max_output_bytes = max_output_bytes
+        self.node_binary = node_binary
+        self.max_jobs_per_worker = max(1, max_jobs_per_worker)
+        self.transpile_cache_size = transpile_cache_size
+        self.spawn_timeout_seconds = spawn_timeout_seconds
+        # Long enough for a busy worker to finish and a replacement to start
+        self.acquire_timeout_seconds = (
+            acquire_timeout_seconds if acquire_timeout_seconds is not None
+            else spawn_timeout_seconds + timeout_seconds + KILL_GRACE_SECONDS
+        )
+        
+        self._idle: Optional[asyncio.Queue] = None
+        self._replenisher: Optional[asyncio.Task] = None
+        self._spawn_error: Optional[str] = None
+        self._workers: set = set()
+        self._spawning = 0
+        self._version: Optional[str] = None
+        self._transpiled: "OrderedDict[str, Tuple[Optional[str], Optional[str]]]" = OrderedDict()
+        
+        # Metrics
+        self.spawned = 0
+        self.spawn_failures = 0
+        self.replaced = 0
+        self.jobs = 0
+        self.transpile_hits = 0
+        self.transpile_misses = 0
+    
+    def version(self) -> str:
+        """Version of the node binary, as reported by the first worker that started."""
+        # Never blocks: until a worker has started (at startup with prestart) it is unknown
+        return self._version or "unknown"
+    
+    async def start(self):
+        """Start the workers if they are not running yet."""
+        if self._idle is None:
+            self._idle = asyncio.Queue()
+        
+        idle = self._idle
+        while len(self._workers) + self._spawning < self.size:
+            try:
+                await self._spawn_into(idle)
+            except (OSError, asyncio.TimeoutError, NodeWorkerCrashed) as e:
+                self._spawn_failed(e)
+                # Keep trying in the background
+                self._replenish()
+                return
+    
+    async def shutdown(self):
+        """Kill every worker."""
+        self._idle = None
+        if self._replenisher is not None:
+            self._replenisher.cancel()
+            try:
+                await self._replenisher
+            except asyncio.CancelledError:
+                pass
+            self._replenisher = None
+        workers = list(self._workers)
+        self._workers.clear()
+        for worker in workers:
+            await worker.kill()
+    
+    async def run(
+        self,
+        code: str,
+        on_output: Optional[Callable[[str], Awaitable[None]]] = None,
+        stdin: str = ""
+    ) -> Dict[str, Any]:
+        """
+        Run JavaScript in an idle worker.
+        
+        Returns a dict with "output", "error" and "truncated", in the same
+        shape as PythonWorkerPool.run.
+        """
+        message = {
+            "op": "run",
+            "code": code,
+            "stdin": stdin,
+            "stream": on_output is not None,
+            "timeoutMs": int(self.timeout_seconds * 1000)
+        }
+        try:
+            return await self._request(message, RUN_REPLY, on_output, self.timeout_seconds + KILL_GRACE_SECONDS)
+        except asyncio.TimeoutError:
+            return {
+                "output": "",
+                "error": f"TimeoutError: execution exceeded {self.timeout_seconds} seconds",
+                "truncated": False
+            }
+        except NodeWorkerCrashed as e:
+            return {
+                "output": "",
+                "error": str(e) or "ResourceError: execution was terminated (memory limit exceeded)",
+                "truncated": False
+            }
+        except NodeWorkerUnavailable:
+            return {"output": "", "error": self._unavailable_error(), "truncated": False}
+        except OSError:
+            return {
+                "output": "",
+                "error": f"EnvironmentError: cannot start {self.node_binary}",
+                "truncated": False
+            }
+    
+    async def transpile(self, source: str) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Transpile TypeScript to JavaScript.
+        
+        Returns (javascript, None) or (None, error). Results are cached by
+        source hash, so a repeated submission is only transpiled once.
+        """
+        key = hashlib.sha256(source.encode("utf-8")).hexdigest()
+        cached = self._transpiled.get(key)
+        if cached is not None:
+            self._transpiled.move_to_end(key)
+            self.transpile_hits += 1
+            return cached
+        
+        self.transpile_misses += 1
+        try:
+            reply = await self._request(
+                {"op": "transpile", "code": source}, TRANSPILE_REPLY, None, self.spawn_timeout_seconds
+            )
+        except (asyncio.TimeoutError, NodeWorkerCrashed):
+            return None, "ResourceError: TypeScript compilation was terminated"
+        except NodeWorkerUnavailable:
+            return None, self._unavailable_error()
+        except OSError:
+            return None, f"EnvironmentError: cannot start {self.node_binary}"
+        
+        result = (reply.get("code"), reply.get("error"))
+        self._transpiled[key] = result
+        if len(self._transpiled) > self.transpile_cache_size:
+            self._transpiled.popitem(last=False)
+        return result
+    
+    def stats(self) -> Dict[str, Any]:
+        """Pool and transpile cache counters."""
+        return {
+            "size": self.size,
+            "idle": self._idle.qsize() if self._idle is not None else 0,
+            "spawned": self.spawned,
+            "spawnFailures": self.spawn_failures,
+            "replaced": self.replaced,
+            "jobs": self.jobs,
+            "transpileCacheSize": len(self._transpiled),
+            "transpileHits": self.transpile_hits,
+            "transpileMisses": self.transpile_misses,
+        }
+    
+    async def _request(
+        self,
+        message: Dict[str, Any],
+        reply_fields: Dict[str, tuple],
+        on_output: Optional[Callable[[str], Awaitable[None]]],
+        timeout: float
+    ) -> Dict[str, Any]:
+        """
+        Send one job to an idle worker and wait for its "done" reply.
+        
+        A reply that is not in the expected shape raises NodeWorkerCrashed
+        and the worker is replaced.
+        """
+        if self._idle is None:
+            self._idle = asyncio.Queue()
+        idle = self._idle
+        
+        # Grow lazily up to size; a missing node binary surfaces here as OSError
+        if idle.empty() and len(self._workers) + self._spawning < self.size:
+            await self._spawn_into(idle)
+        
+        try:
+            worker = await asyncio.wait_for(idle.get(), self.acquire_timeout_seconds)
+        except asyncio.TimeoutError:
+            self._replenish()
+            raise NodeWorkerUnavailable()
+        self.jobs += 1
+        healthy = False
+        
+        try:
+            await worker.send(message)
+            deadline = time.monotonic() + timeout
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError()
+                reply = await asyncio.wait_for(worker.receive(), remaining)
+                if reply["type"] == "done":
+                    if not all(isinstance(reply.get(k), types) for k, types in reply_fields.items()):
+                        raise NodeWorkerCrashed(INVALID_REPLY)
+                    break
+                if reply["type"] != "chunk" or not isinstance(reply.get("data"), str):
+                    raise NodeWorkerCrashed(INVALID_REPLY)
+                if on_output is not None:
+                    await on_output(reply["data"])
+            
+            healthy = True
+            return reply
+        finally:
+            worker.jobs += 1
+            if healthy and worker.jobs < self.max_jobs_per_worker and self._idle is idle:
+                idle.put_nowait(worker)
+            else:
+                if not healthy:
+                    self.replaced += 1
+                self._workers.discard(worker)
+                await worker.kill()
+                if self._idle is idle:
+                    # Replace in the background so queued jobs are not stranded
+                    self._replenish()
+    
+    def _replenish(self):
+        """Make sure the background task that tops the pool back up is running."""
+        if self._idle is None or (self._replenisher is not None and not self._replenisher.done()):
+            return
+        self._replenisher = asyncio.get_running_loop().create_task(self._keep_filled(self._idle))
+    
+    async def _keep_filled(self, idle: asyncio.Queue):
+        """Start workers until the pool is full again, backing off while starting fails."""
+        delay = RESPAWN_MIN_SECONDS
+        while self._idle is idle and len(self._workers) + self._spawning < self.size:
+            try:
+                await self._spawn_into(idle)
+            except (OSError, asyncio.TimeoutError, NodeWorkerCrashed) as e:
+                self._spawn_failed(e)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, RESPAWN_MAX_SECONDS)
+            else:
+                delay = RESPAWN_MIN_SECONDS
+    
+    def _spawn_failed(self, error: Exception):
+        self.spawn_failures += 1
+        self._spawn_error = str(error) or type(error).__name__
+        print(f"Error starting Node.js worker: {error!r}")
+    
+    def _unavailable_error(self) -> str:
+        reason = f" (last start failed: {self._spawn_error})" if self._spawn_error else ""
+        return (
+            f"EnvironmentError: no Node.js worker became available within "
+            f"{self.acquire_timeout_seconds:g} seconds{reason}"
+        )
+    
+    async def _spawn_into(self, idle: asyncio.Queue):
+        """Start a worker and hand it to the idle queue once it is ready."""
+        self._spawning += 1
+        try:
+            worker = await self._spawn()
+        finally:
+            self._spawning -= 1
+        
+        if self._idle is idle:
+            self._workers.add(worker)
+            idle.put_nowait(worker)
+        else:
+            await worker.kill()
+    
+    async def _spawn(self) -> _NodeWorker:
+        process = await asyncio.create_subprocess_exec(
+            self.node_binary,
+            f"--max-old-space-size={self.memory_limit_mb}",
+            "--disallow-code-generation-from-strings",
+            WORKER_SCRIPT,
+            str(self.max_output_bytes),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+            # Lines carry whole results; allow well past the output cap
+            limit=max(1024 * 1024, self.max_output_bytes * 8)
+        )
+        worker = _NodeWorker(process)
+        try:
+            ready = await asyncio.wait_for(worker.receive(), self.spawn_timeout_seconds)
+        except BaseException:
+            await worker.kill()
+            raise
+        
+        if not isinstance(ready.get("version"), str):
+            await worker.kill()
+            raise NodeWorkerCrashed(INVALID_REPLY)
+        self._version = ready["version"]
+        self._spawn_error = None
+        self.spawned += 1
+        return worker
@@ -0,0 +1,337 @@
+// Long-lived Node.js worker for running JavaScript/TypeScript submissions.
+//
+// Protocol: one JSON object per line on stdin/stdout.
+//   <- {"op": "run", "code", "stdin", "stream", "timeoutMs"}
+//   -> {"type": "chunk", "data"} ... {"type": "done", "output", "error", "truncated"}
+//   <- {"op": "transpile", "code"}
+//   -> {"type": "done", "code", "error"}
+//
+// Every job runs in a fresh vm context that only sees console, timers,
+// prompt() and an empty module object, so globals never leak between jobs.
+// Those globals are built by a bootstrap script inside the context, so user
+// code never holds an object of the worker's own realm and cannot reach (or
+// pollute) its prototypes. The process is started with
+// --disallow-code-generation-from-strings, which also closes the usual
+// constructor.constructor escape out of vm.
+"use strict";
+
+const vm = require("vm");
+const util = require("util");
+const readline = require("readline");
+
+const MAX_OUTPUT_BYTES = parseInt(process.argv[2] || "65536", 10);
+const TRUNCATED_MARKER = "\n[output truncated]";
+const CHUNK_BYTES = 4096;
+const CHUNK_INTERVAL_MS = 50;
+
+let currentJob = null;
+
+function send(message) {
+  process.stdout.write(JSON.stringify(message) + "\n");
+}
+
+function formatError(err) {
+  try {
+    if (err && typeof err === "object" && "name" in err && "message" in err) {
+      return `${err.name}: ${err.message}`;
+    }
+    return `Error: ${String(err)}`;
+  } catch (e) {
+    // A thrown value whose name, message or toString throws itself
+    return "Error: (unprintable value thrown)";
+  }
+}
+
+class CappedWriter {
+  constructor(maxBytes, emit) {
+    this.maxBytes = maxBytes;
+    this.size = 0;
+    this.truncated = false;
+    this.parts = [];
+    this.emit = emit;
+    this.pending = [];
+    this.pendingSize = 0;
+    this.lastEmit = Date.now();
+  }
+
+  write(text) {
+    if (this.truncated) {
+      return;
+    }
+
+    let data = Buffer.from(text, "utf8");
+    const room = this.maxBytes - this.size;
+    if (data.length > room) {
+      // Drop a multi-byte character cut in half
+      text = data.subarray(0, room).toString("utf8").replace(/\uFFFD$/, "");
+      data = Buffer.from(text, "utf8");
+      this.truncated = true;
+    }
+
+    this.parts.push(text);
+    this.size += data.length;
+
+    if (this.emit) {
+      this.pending.push(text);
+      this.pendingSize += data.length;
+      if (this.pendingSize >= CHUNK_BYTES || Date.now() - this.lastEmit >= CHUNK_INTERVAL_MS) {
+        this.emitPending();
+      }
+    }
+  }
+
+  emitPending() {
+    if (this.pending.length) {
+      this.emit(this.pending.join(""));
+      this.pending = [];
+      this.pendingSize = 0;
+    }
+    this.lastEmit = Date.now();
+  }
+
+  value() {
+    return this.parts.join("");
+  }
+}
+
+// Never call into user code with worker-realm arguments (util.inspect.custom)
+const INSPECT_OPTIONS = { customInspect: false };
+
+// Evaluated in each job's context. It is handed worker functions that take
+// and return only primitives or the context's own values, and keeps them in
+// closures that user code cannot reach. Returns settle(result, done), which
+// waits for a returned promise with the context's own Promise.
+const BOOTSTRAP = `(function (write, readLine, schedule, cancel) {
+  "use strict";
+  const print = (stream) => (...args) => {
+    write(stream, ...args);
+  };
+  const timer = (repeat) => (callback, delay, ...args) => schedule(() => callback(...args), delay, repeat);
+  const module = { exports: {} };
+  Object.assign(globalThis, {
+    console: { log: print(1), info: print(1), debug: print(1), error: print(2), warn: print(2) },
+    prompt: () => readLine(),
+    setTimeout: timer(false),
+    setInterval: timer(true),
+    clearTimeout: (id) => cancel(id),
+    clearInterval: (id) => cancel(id),
+    module,
+    exports: module.exports,
+  });
+  const ContextPromise = Promise;
+  return (result, done) => ContextPromise.resolve(result).then(() => done(true), (e) => done(false, e));
+})`;
+
+function createContext(job, out, err) {
+  const stdinLines = job.stdin ? job.stdin.split("\n") : [];
+  if (stdinLines.length && stdinLines[stdinLines.length - 1] === "") {
+    stdinLines.pop();
+  }
+
+  // Timers are tracked by number so the job can wait for them and clear leftovers
+  const timers = new Map();
+  let nextTimer = 1;
+  const schedule = (callback, delay, repeat) => {
+    const id = nextTimer++;
+    const run = () => {
+      if (!repeat) {
+        timers.delete(id);
+      }
+      try {
+        callback();
+      } catch (e) {
+        job.fail(e);
+      }
+      job.checkIdle();
+    };
+    const handle = repeat ? setInterval(run, Number(delay)) : setTimeout(run, Number(delay));
+    timers.set(id, () => (repeat ? clearInterval(handle) : clearTimeout(handle)));
+    return id;
+  };
+  const cancel = (id) => {
+    const clear = timers.get(id);
+    if (clear) {
+      clear();
+      timers.delete(id);
+      job.checkIdle();
+    }
+  };
+  job.timers = timers;
+
+  const write = (stream, ...args) => {
+    (stream === 1 ? out : err).write(util.formatWithOptions(INSPECT_OPTIONS, ...args) + "\n");
+  };
+  const readLine = () => (stdinLines.length ? stdinLines.shift() : null);
+
+  const context = vm.createContext({}, { codeGeneration: { strings: false, wasm: false } });
+  job.settle = vm.runInContext(BOOTSTRAP, context)(write, readLine, schedule, cancel);
+  return context;
+}
+
+async function runJob(job) {
+  const deadline = Date.now() + job.timeoutMs;
+  const out = new CappedWriter(MAX_OUTPUT_BYTES, job.stream ? (data) => send({ type: "chunk", data }) : null);
+  const err = new CappedWriter(MAX_OUTPUT_BYTES, null);
+  let error = null;
+  let onIdle = null;
+
+  const state = {
+    stdin: job.stdin,
+    timers: null,
+    settle: null,
+    fail(e) {
+      if (error === null) {
+        error = formatError(e);
+      }
+      if (onIdle) {
+        onIdle();
+      }
+    },
+    checkIdle() {
+      if (onIdle && state.timers.size === 0) {
+        onIdle();
+      }
+    },
+  };
+  currentJob = state;
+
+  try {
+    const context = createContext(state, out, err);
+    const result = vm.runInContext(job.code, context, {
+      filename: "main.js",
+      timeout: job.timeoutMs,
+      breakOnSigint: false,
+    });
+
+    // Wait for a returned promise and for pending timers, up to the deadline
+    await new Promise((resolve) => {
+      let timer = null;
+      let pendingPromise = Boolean(result && typeof result.then === "function");
+      onIdle = () => {
+        if (error !== null || (state.timers.size === 0 && !pendingPromise)) {
+          clearTimeout(timer);
+          resolve();
+        }
+      };
+      if (pendingPromise) {
+        state.settle(result, (ok, e) => {
+          pendingPromise = false;
+          if (ok) {
+            onIdle();
+          } else {
+            state.fail(e);
+          }
+        });
+      }
+      timer = setTimeout(() => {
+        if (error === null) {
+          error = `TimeoutError: execution exceeded ${job.timeoutMs / 1000} seconds`;
+        }
+        resolve();
+      }, Math.max(0, deadline - Date.now()));
+      onIdle();
+    });
+  } catch (e) {
+    if (e && e.code === "ERR_SCRIPT_EXECUTION_TIMEOUT") {
+      error = `TimeoutError: execution exceeded ${job.timeoutMs / 1000} seconds`;
+    } else {
+      error = formatError(e);
+    }
+  } finally {
+    currentJob = null;
+    if (state.timers) {
+      for (const clear of state.timers.values()) {
+        clear();
+      }
+    }
+  }
+
+  if (job.stream) {
+    out.emitPending();
+  }
+
+  let output = out.value();
+  if (out.truncated) {
+    output += TRUNCATED_MARKER;
+  }
+  const errorOutput = err.value();
+  if (errorOutput && error === null) {
+    error = errorOutput;
+  }
+  send({ type: "done", output, error, truncated: out.truncated });
+}
+
+let typescript;
+
+function transpile(source) {
+  if (typescript === undefined) {
+    try {
+      typescript = require("typescript");
+    } catch (e) {
+      typescript = null;
+    }
+  }
+
+  if (typescript) {
+    const result = typescript.transpileModule(source, {
+      reportDiagnostics: true,
+      compilerOptions: {
+        target: typescript.ScriptTarget.ES2020,
+        module: typescript.ModuleKind.CommonJS,
+      },
+    });
+    const diagnostic = (result.diagnostics || []).find(
+      (d) => d.category === typescript.DiagnosticCategory.Error
+    );
+    if (diagnostic) {
+      const message = typescript.flattenDiagnosticMessageText(diagnostic.messageText, "\n");
+      return { code: null, error: `SyntaxError: ${message}` };
+    }
+    return { code: result.outputText, error: null };
+  }
+
+  const { stripTypeScriptTypes } = require("module");
+  if (typeof stripTypeScriptTypes === "function") {
+    try {
+      return { code: stripTypeScriptTypes(source, { mode: "transform" }), error: null };
+    } catch (e) {
+      return { code: null, error: formatError(e) };
+    }
+  }
+
+  return {
+    code: null,
+    error: "EnvironmentError: TypeScript needs the 'typescript' package (on NODE_PATH) or Node.js 22.13+",
+  };
+}
+
+// Async user code can reject without anyone listening
+process.on("unhandledRejection", (e) => {
+  if (currentJob) {
+    currentJob.fail(e);
+  }
+});
+process.on("uncaughtException", (e) => {
+  if (currentJob) {
+    currentJob.fail(e);
+  } else {
+    throw e;
+  }
+});
+
+const lines = readline.createInterface({ input: process.stdin });
+let queue = Promise.resolve();
+
+lines.on("line", (line) => {
+  const job = JSON.parse(line);
+  queue = queue.then(async () => {
+    if (job.op === "transpile") {
+      send({ type: "done", ...transpile(job.code) });
+    } else {
+      await runJob(job);
+    }
+  });
+});
+lines.on("close", () => queue.then(() => process.exit(0)));
+
+send({ type: "ready", version: process.version });
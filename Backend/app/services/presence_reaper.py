@@ -0,0 +1,162 @@
+import asyncio
+import time
+from typing import Optional, Callable, Dict, Set, Tuple
+from app.config import settings
+from app.services.timer_wheel import TimerWheel
+
+TYPING = "typing"
+IDLE = "idle"
+
+
+class PresenceReaper:
+    """
+    Expires typing flags and removes users whose activity has lapsed.
+    
+    Activity (REST calls, WebSocket messages and Yjs updates) restarts a
+    user's idle timer; setting isTyping starts a typing timer. Timers live
+    in a hashed timer wheel. Each tick, everything that fired is grouped by
+    session and applied as one batched database write and one broadcast per
+    session. Users with an open socket are never removed for idling.
+    
+    The wheel only knows this process's activity, so socket activity is
+    also recorded as the user's lastActivity (at most once per
+    activity_write_seconds) and a user is only deleted if the stored
+    lastActivity is past the idle timeout too. Activity seen by another
+    worker therefore keeps a user present.
+    """
+    
+    def __init__(
+        self,
+        typing_timeout_seconds: float = 5,
+        idle_timeout_seconds: float = 1800,
+        tick_seconds: float = 1.0,
+        is_connected: Optional[Callable[[str, str], bool]] = None,
+        activity_write_seconds: float = 30
+    ):
+        self.typing_timeout_seconds = typing_timeout_seconds
+        self.idle_timeout_seconds = idle_timeout_seconds
+        self.wheel = TimerWheel(tick_seconds)
+        self.is_connected = is_connected or (lambda session_id, user_id: False)
+        self.activity_write_seconds = activity_write_seconds
+        self.db = None
+        self._task: Optional[asyncio.Task] = None
+        # When socket activity was last recorded, per (session_id, user_id)
+        self._recorded: Dict[Tuple[str, str], float] = {}
+        
+        # Metrics
+        self.typing_expired = 0
+        self.users_removed = 0
+    
+    def start(self, db):
+        self.db = db
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+    
+    async def stop(self):
+        if self._task is None:
+            return
+        
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+    
+    def touch(self, session_id: str, user_id: str, idle_for_seconds: float = 0):
+        """Record activity: the user expires idle_timeout_seconds from now."""
+        self.wheel.schedule((IDLE, session_id, user_id), self.idle_timeout_seconds - idle_for_seconds)
+    
+    async def record_activity(self, session_id: str, user_id: str):
+        """Socket activity: restart the idle timer and keep the stored lastActivity recent."""
+        self.touch(session_id, user_id)
+        
+        now = time.time()
+        key = (session_id, user_id)
+        if self.db is None or now - self._recorded.get(key, 0) < self.activity_write_seconds:
+            return
+        self._recorded[key] = now
+        try:
+            await self.db.update_presence(session_id, user_id, last_activity=int(now * 1000), notify=False)
+        except Exception as e:
+            print(f"Error recording activity: {e}")
+    
+    def typing(self, session_id: str, user_id: str, is_typing: bool):
+        """Start (or clear) the timer that turns a typing flag off."""
+        if is_typing:
+            self.wheel.schedule((TYPING, session_id, user_id), self.typing_timeout_seconds)
+        else:
+            self.wheel.cancel((TYPING, session_id, user_id))
+        self.touch(session_id, user_id)
+    
+    def forget(self, session_id: str, user_id: str):
+        self.wheel.cancel((TYPING, session_id, user_id))
+        self.wheel.cancel((IDLE, session_id, user_id))
+        self._recorded.pop((session_id, user_id), None)
+    
+    def track_session(self, session, now_ms: int):
+        """Start timers for users of a session that are not tracked yet (e.g. after a restart)."""
+        for user in session.users:
+            if (IDLE, session.id, user.id) not in self.wheel:
+                self.touch(session.id, user.id, max(0, now_ms - user.lastActivity) / 1000)
+            if user.isTyping and (TYPING, session.id, user.id) not in self.wheel:
+                self.wheel.schedule((TYPING, session.id, user.id), self.typing_timeout_seconds)
+    
+    async def tick(self):
+        """Advance the wheel one tick and apply what expired."""
+        batches: Dict[str, Tuple[Set[str], Set[str]]] = {}
+        for kind, session_id, user_id in self.wheel.tick():
+            stop_typing, remove = batches.setdefault(session_id, (set(), set()))
+            if kind == TYPING:
+                stop_typing.add(user_id)
+            elif self.is_connected(session_id, user_id):
+                # Still connected: check again after another full timeout
+                self.touch(session_id, user_id)
+            else:
+                remove.add(user_id)
+                self.wheel.cancel((TYPING, session_id, user_id))
+        
+        idle_before = int(time.time() * 1000) - int(self.idle_timeout_seconds * 1000)
+        for session_id, (stop_typing, remove) in batches.items():
+            stop_typing -= remove
+            if not stop_typing and not remove:
+                continue
+            
+            session = await self.db.expire_presence(session_id, sorted(stop_typing), sorted(remove), idle_before)
+            # Without a change nobody was removed
+            kept = {u.id for u in session.users} if session is not None else remove
+            self.typing_expired += len(stop_typing)
+            for user_id in remove:
+                if user_id in kept:
+                    # Active elsewhere (e.g. on another worker): check again later
+                    self.touch(session_id, user_id)
+                else:
+                    self.users_removed += 1
+                    self._recorded.pop((session_id, user_id), None)
+    
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.wheel.tick_seconds)
+            try:
+                await self.tick()
+            except Exception as e:
+                print(f"Error expiring presence: {e}")
+
+
+def _is_connected(session_id: str, user_id: str) -> bool:
+    from app.routers.websocket import manager
+    from app.services.crdt_documents import document_store
+    hub = manager.hubs.get(session_id)
+    if hub is not None and user_id in hub.user_ids:
+        return True
+    document = document_store.documents.get(session_id)
+    return document is not None and user_id in document.peer_users.values()
+
+
+presence_reaper = PresenceReaper(
+    typing_timeout_seconds=settings.typing_timeout_seconds,
+    idle_timeout_seconds=settings.user_idle_timeout_seconds,
+    tick_seconds=settings.presence_tick_seconds,
+    is_connected=_is_connected,
+    activity_write_seconds=settings.presence_snapshot_seconds
+)
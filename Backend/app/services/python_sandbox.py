@@ -0,0 +1,508 @@
+"""
+Pre-forked worker processes for running untrusted Python submissions.
+
+This module only depends on the standard library: it is imported again in
+every freshly spawned worker process.
+"""
+import asyncio
+import io
+import multiprocessing
+import signal
+import sys
+import time
+from collections import deque
+from contextlib import redirect_stdout, redirect_stderr
+from typing import Optional, Dict, Any, Callable, Awaitable
+
+try:
+    import resource
+except ImportError:  # pragma: no cover - non-POSIX platforms
+    resource = None
+
+
+SAFE_BUILTINS = {
+    'print': print,
+    'input': input,
+    'len': len,
+    'range': range,
+    'str': str,
+    'int': int,
+    'float': float,
+    'list': list,
+    'dict': dict,
+    'tuple': tuple,
+    'set': set,
+    'True': True,
+    'False': False,
+    'None': None,
+}
+
+TRUNCATED_MARKER = "\n[output truncated]"
+
+
+class _CappedWriter(io.TextIOBase):
+    """
+    Text sink that keeps at most max_bytes of output.
+    
+    When emit is given, output is also handed over in chunks as it is
+    produced: once chunk_bytes have accumulated or chunk_interval seconds
+    have passed since the previous chunk.
+    """
+    
+    def __init__(
+        self,
+        max_bytes: int,
+        emit: Optional[Callable[[str], None]] = None,
+        chunk_bytes: int = 4096,
+        chunk_interval: float = 0.05
+    ):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.truncated = False
+        self._parts = []
+        self._emit = emit
+        self._chunk_bytes = chunk_bytes
+        self._chunk_interval = chunk_interval
+        self._pending = []
+        self._pending_size = 0
+        self._last_emit = time.monotonic()
+    
+    def writable(self) -> bool:
+        return True
+    
+    def write(self, text: str) -> int:
+        if self.truncated:
+            return len(text)
+        
+        data = text.encode("utf-8", "replace")
+        room = self.max_bytes - self.size
+        if len(data) > room:
+            data = data[:room]
+            text = data.decode("utf-8", "ignore")
+            self.truncated = True
+        
+        self._parts.append(text)
+        self.size += len(data)
+        
+        if self._emit is not None:
+            self._pending.append(text)
+            self._pending_size += len(data)
+            if (self._pending_size >= self._chunk_bytes
+                    or time.monotonic() - self._last_emit >= self._chunk_interval):
+                self.emit_pending()
+        return len(text)
+    
+    def emit_pending(self):
+        """Hand over any output not yet emitted as a chunk."""
+        if self._pending:
+            self._emit("".join(self._pending))
+            self._pending = []
+            self._pending_size = 0
+        self._last_emit = time.monotonic()
+    
+    def getvalue(self) -> str:
+        return "".join(self._parts)
+
+
+def _current_vm_bytes() -> Optional[int]:
+    """Virtual memory size of this process, if /proc is available."""
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmSize:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def _apply_memory_limit(memory_limit_mb: int):
+    if resource is None or memory_limit_mb <= 0:
+        return
+    
+    # The limit is on top of what the bare interpreter already maps
+    limit = (_current_vm_bytes() or 0) + memory_limit_mb * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _apply_cpu_limit(cpu_seconds: int):
+    if resource is None or cpu_seconds <= 0:
+        return
+    
+    # RLIMIT_CPU counts the whole process lifetime, so extend it per job
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    soft = int(usage.ru_utime + usage.ru_stime) + cpu_seconds + 1
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+
+def run_job(
+    code: str,
+    max_output_bytes: int,
+    emit: Optional[Callable[[str], None]] = None,
+    stdin: str = ""
+) -> Dict[str, Any]:
+    """
+    Execute code in a restricted namespace and collect its output.
+    
+    If emit is given, stdout is also streamed to it in chunks.
+    """
+    output_buffer = _CappedWriter(max_output_bytes, emit)
+    error_buffer = _CappedWriter(max_output_bytes)
+    error_msg = None
+    
+    previous_stdin = sys.stdin
+    sys.stdin = io.StringIO(stdin)
+    try:
+        with redirect_stdout(output_buffer), redirect_stderr(error_buffer):
+            exec(code, {'__builtins__': dict(SAFE_BUILTINS)})
+    except MemoryError:
+        error_msg = "MemoryError: memory limit exceeded"
+    except Exception as e:
+        error_msg = f"{type(e).__name__}: {str(e)}"
+    finally:
+        sys.stdin = previous_stdin
+    
+    if emit is not None:
+        output_buffer.emit_pending()
+    
+    output = output_buffer.getvalue()
+    if output_buffer.truncated:
+        output += TRUNCATED_MARKER
+    
+    error_output = error_buffer.getvalue()
+    if error_output and not error_msg:
+        error_msg = error_output
+    
+    return {"output": output, "error": error_msg, "truncated": output_buffer.truncated}
+
+
+def worker_main(conn, memory_limit_mb: int, cpu_limit_seconds: int, max_output_bytes: int):
+    """Entry point of a worker process: run jobs until the pipe closes."""
+    # The parent handles Ctrl+C; a worker must not die half-way through a reply
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _apply_memory_limit(memory_limit_mb)
+    
+    # Warm up the execution path before reporting ready
+    run_job("pass", max_output_bytes)
+    conn.send(("ready", None))
+    
+    def emit(text: str):
+        conn.send(("chunk", text))
+    
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, OSError):
+            return
+        
+        _apply_cpu_limit(cpu_limit_seconds)
+        result = run_job(job["code"], max_output_bytes, emit if job["stream"] else None, job["stdin"])
+        conn.send(("done", result))
+
+
+def _percentile(samples, fraction: float) -> Optional[float]:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * fraction))], 2)
+
+
+class _Worker:
+    """Handle on one worker process and its end of the pipe."""
+    
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+        self.jobs = 0
+    
+    def kill(self):
+        """Kill the process; on the event loop it is reaped once it exits, without waiting for it."""
+        try:
+            self.conn.close()
+        except OSError:
+            pass
+        if self.process.is_alive():
+            self.process.kill()
+        
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Off the loop (a spawn thread): waiting here blocks nobody
+            self.process.join(timeout=1)
+            return
+        
+        sentinel = self.process.sentinel
+        
+        def reap():
+            loop.remove_reader(sentinel)
+            self.process.join(timeout=0)
+        
+        loop.add_reader(sentinel, reap)
+
+
+class WorkerCrashed(Exception):
+    """The worker process exited while running a job."""
+
+
+class PythonWorkerPool:
+    """
+    Pool of warm, pre-started Python worker processes.
+    
+    Each submission runs in a worker with a wall-clock timeout, CPU and
+    address-space rlimits and a cap on captured output. By default a worker
+    serves a single job and is then recycled, so no state leaks between
+    submissions; replacements are started in the background whenever the
+    number of idle (or starting) workers drops below low_watermark, which
+    keeps interpreter startup off the request path. With the "forkserver"
+    start method, workers are forked from a server process that has already
+    imported this module, which is much cheaper than a fresh interpreter.
+    
+    A worker that times out or dies is killed and replaced, so a runaway
+    submission can never block the event loop or starve later jobs. A job
+    that gets no worker within acquire_timeout_seconds (e.g. because workers
+    keep failing to start) fails with an EnvironmentError instead of waiting
+    forever.
+    """
+    
+    def __init__(
+        self,
+        size: int = 2,
+        timeout_seconds: float = 5,
+        memory_limit_mb: int = 256,
+        cpu_limit_seconds: Optional[int] = None,
+        max_output_bytes: int = 64 * 1024,
+        start_method: str = "forkserver",
+        max_jobs_per_worker: int = 1,
+        low_watermark: int = 1,
+        spawn_timeout_seconds: float = 10,
+        acquire_timeout_seconds: Optional[float] = None
+    ):
+        self.size = size
+        self.timeout_seconds = timeout_seconds
+        self.memory_limit_mb = memory_limit_mb
+        self.cpu_limit_seconds = cpu_limit_seconds if cpu_limit_seconds is not None else int(timeout_seconds)
+        self.max_output_bytes = max_output_bytes
+        self.max_jobs_per_worker = max(1, max_jobs_per_worker)
+        self.low_watermark = min(max(1, low_watermark), size)
+        self.spawn_timeout_seconds = spawn_timeout_seconds
+        # Long enough for a busy worker to finish and a replacement to start
+        self.acquire_timeout_seconds = (
+            acquire_timeout_seconds if acquire_timeout_seconds is not None
+            else spawn_timeout_seconds + timeout_seconds
+        )
+        
+        if start_method not in multiprocessing.get_all_start_methods():
+            start_method = "spawn"
+        self.start_method = start_method
+        self._context = multiprocessing.get_context(start_method)
+        if start_method == "forkserver":
+            # Fork workers from a server that already imported the sandbox
+            self._context.set_forkserver_preload([__name__])
+        
+        self._idle: Optional[asyncio.Queue] = None
+        self._workers: set = set()
+        self._spawning = 0
+        self._spawn_error: Optional[str] = None
+        
+        # Metrics
+        self.spawned = 0
+        self.spawn_failures = 0
+        self.replaced = 0
+        self.recycled = 0
+        self.jobs = 0
+        self._startup_ms = deque(maxlen=256)
+        self._acquire_ms = deque(maxlen=256)
+    
+    async def start(self):
+        """Start the initial workers and wait until they are ready."""
+        if self._idle is not None:
+            return
+        
+        idle = asyncio.Queue()
+        self._idle = idle
+        self._spawning += self.size
+        await asyncio.gather(*[self._spawn_into(idle) for _ in range(self.size)])
+    
+    async def shutdown(self):
+        """Kill every worker."""
+        self._idle = None
+        for worker in list(self._workers):
+            worker.kill()
+        self._workers.clear()
+    
+    async def run(
+        self,
+        code: str,
+        on_output: Optional[Callable[[str], Awaitable[None]]] = None,
+        stdin: str = ""
+    ) -> Dict[str, Any]:
+        """
+        Run code in an idle worker.
+        
+        Returns a dict with "output" and "error"; "error" describes timeouts
+        and resource-limit kills as well as exceptions raised by the code.
+        If on_output is given, stdout chunks are passed to it while the code
+        runs; each chunk is awaited before the next one is read.
+        """
+        if self._idle is None:
+            # Lazy start: spawn in the background, take the first ready worker
+            self._idle = asyncio.Queue()
+            self._refill()
+        
+        idle = self._idle
+        acquire_start = time.perf_counter()
+        try:
+            worker = await asyncio.wait_for(idle.get(), self.acquire_timeout_seconds)
+        except asyncio.TimeoutError:
+            # Try again for the next job
+            self._refill()
+            reason = f" (last start failed: {self._spawn_error})" if self._spawn_error else ""
+            return {
+                "output": "",
+                "error": f"EnvironmentError: no Python worker became available within "
+                         f"{self.acquire_timeout_seconds:g} seconds{reason}",
+                "truncated": False
+            }
+        self._acquire_ms.append((time.perf_counter() - acquire_start) * 1000)
+        self.jobs += 1
+        healthy = False
+        
+        try:
+            worker.conn.send({"code": code, "stream": on_output is not None, "stdin": stdin})
+            deadline = time.monotonic() + self.timeout_seconds
+            while True:
+                kind, payload = await self._receive(worker, deadline)
+                if kind == "done":
+                    break
+                await on_output(payload)
+            
+            healthy = True
+            return payload
+        except asyncio.TimeoutError:
+            return {
+                "output": "",
+                "error": f"TimeoutError: execution exceeded {self.timeout_seconds} seconds",
+                "truncated": False
+            }
+        except (WorkerCrashed, OSError):
+            return {
+                "output": "",
+                "error": "ResourceError: execution was terminated (CPU or memory limit exceeded)",
+                "truncated": False
+            }
+        finally:
+            worker.jobs += 1
+            if healthy and worker.jobs < self.max_jobs_per_worker and self._idle is idle:
+                idle.put_nowait(worker)
+            else:
+                self._discard(worker)
+                if healthy:
+                    self.recycled += 1
+                else:
+                    self.replaced += 1
+            self._refill()
+    
+    def stats(self) -> Dict[str, Any]:
+        """Pool counters and latency percentiles (milliseconds)."""
+        return {
+            "size": self.size,
+            "startMethod": self.start_method,
+            "idle": self._idle.qsize() if self._idle is not None else 0,
+            "starting": self._spawning,
+            "spawned": self.spawned,
+            "spawnFailures": self.spawn_failures,
+            "recycled": self.recycled,
+            "replaced": self.replaced,
+            "jobs": self.jobs,
+            "startupMsP50": _percentile(self._startup_ms, 0.5),
+            "startupMsP95": _percentile(self._startup_ms, 0.95),
+            "acquireWaitMsP50": _percentile(self._acquire_ms, 0.5),
+            "acquireWaitMsP95": _percentile(self._acquire_ms, 0.95),
+        }
+    
+    def _refill(self):
+        """Top the pool back up once idle workers drop below the low watermark."""
+        idle = self._idle
+        if idle is None or idle.qsize() + self._spawning >= self.low_watermark:
+            return
+        
+        missing = self.size - len(self._workers) - self._spawning
+        for _ in range(missing):
+            self._spawning += 1
+            asyncio.get_running_loop().create_task(self._spawn_into(idle))
+    
+    async def _spawn_into(self, idle: asyncio.Queue):
+        """Start one worker in a thread and hand it to the idle queue."""
+        try:
+            worker = await asyncio.to_thread(self._spawn)
+        except Exception as e:
+            self._spawning -= 1
+            self.spawn_failures += 1
+            self._spawn_error = str(e) or type(e).__name__
+            print(f"Error starting Python worker: {e}")
+            return
+        
+        self._spawning -= 1
+        self._spawn_error = None
+        if self._idle is idle:
+            self._workers.add(worker)
+            idle.put_nowait(worker)
+        else:
+            # The pool was shut down while the worker was starting
+            worker.kill()
+    
+    def _spawn(self) -> _Worker:
+        """Start a worker process and wait for its ready signal (blocking)."""
+        started = time.perf_counter()
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(
+            target=worker_main,
+            args=(child_conn, self.memory_limit_mb, self.cpu_limit_seconds, self.max_output_bytes),
+            daemon=True
+        )
+        process.start()
+        child_conn.close()
+        
+        worker = _Worker(process, parent_conn)
+        try:
+            if not parent_conn.poll(self.spawn_timeout_seconds):
+                raise TimeoutError("worker did not become ready")
+            parent_conn.recv()
+        except (EOFError, OSError, TimeoutError):
+            worker.kill()
+            raise
+        
+        self._startup_ms.append((time.perf_counter() - started) * 1000)
+        self.spawned += 1
+        return worker
+    
+    def _discard(self, worker: _Worker):
+        worker.kill()
+        self._workers.discard(worker)
+    
+    async def _receive(self, worker: _Worker, deadline: float):
+        """Wait for the worker's next message without blocking the event loop."""
+        loop = asyncio.get_running_loop()
+        fd = worker.conn.fileno()
+        
+        while not worker.conn.poll():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise asyncio.TimeoutError()
+            
+            readable = loop.create_future()
+            loop.add_reader(fd, lambda: readable.done() or readable.set_result(None))
+            try:
+                await asyncio.wait_for(readable, remaining)
+            finally:
+                loop.remove_reader(fd)
+        
+        # A large or partly written message can take a while to read in full
+        remaining = max(deadline - time.monotonic(), 0)
+        try:
+            return await asyncio.wait_for(asyncio.to_thread(worker.conn.recv), remaining)
+        except (EOFError, OSError):
+            raise WorkerCrashed()
@@ -0,0 +1,37 @@
+import time
+from typing import Optional
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter.
+    
+    Holds up to `burst` tokens and refills at `rate` tokens per second;
+    every allowed event takes one token. Refilling is computed lazily from
+    the elapsed time, so an idle bucket costs nothing.
+    """
+    
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self._updated = time.monotonic()
+    
+    def allow(self, now: Optional[float] = None) -> bool:
+        """Take a token if one is available."""
+        self._refill(time.monotonic() if now is None else now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+    
+    def retry_after(self) -> float:
+        """Seconds until the next token is available."""
+        if self.tokens >= 1 or self.rate <= 0:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+    
+    def _refill(self, now: float):
+        elapsed = max(0.0, now - self._updated)
+        self._updated = now
+        self.tokens = min(float(self.burst), self.tokens + elapsed * self.rate)
@@ -0,0 +1,101 @@
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+from app.models.schemas import ExecutionResult
+
+
+class ExecutionResultCache:
+    """
+    Content-addressed memo of execution results.
+    
+    Entries are keyed on a hash of (language, code, stdin, runtime version),
+    expire after ttl_seconds and are evicted least-recently-used beyond
+    max_entries. Identical executions that are already running are shared:
+    later callers await the same task instead of starting another worker.
+    """
+    
+    def __init__(self, max_entries: int = 256, ttl_seconds: float = 300):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[float, ExecutionResult]]" = OrderedDict()
+        self._in_flight: Dict[str, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        # Runs that skipped the cache because their result may vary
+        self.bypassed = 0
+    
+    @staticmethod
+    def make_key(language: str, code: str, stdin: str, runtime_version: str) -> str:
+        digest = hashlib.sha256()
+        for part in (language, runtime_version, stdin, code):
+            data = part.encode("utf-8")
+            # Length-prefix each part so boundaries cannot be shifted
+            digest.update(len(data).to_bytes(8, "big"))
+            digest.update(data)
+        return digest.hexdigest()
+    
+    def get(self, key: str) -> Optional[ExecutionResult]:
+        """Return a fresh cached result, or None."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        
+        stored_at, result = entry
+        if time.monotonic() - stored_at > self.ttl_seconds:
+            del self._entries[key]
+            return None
+        
+        self._entries.move_to_end(key)
+        return result
+    
+    def put(self, key: str, result: ExecutionResult):
+        self._entries[key] = (time.monotonic(), result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+    
+    async def get_or_run(
+        self,
+        key: str,
+        run: Callable[[], Awaitable[ExecutionResult]],
+        cacheable: Callable[[ExecutionResult], bool]
+    ) -> Tuple[ExecutionResult, str]:
+        """
+        Return (result, source) where source is "hit", "coalesced" or "run".
+        
+        Only results accepted by cacheable are memoized.
+        """
+        result = self.get(key)
+        if result is not None:
+            self.hits += 1
+            return result, "hit"
+        
+        task = self._in_flight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            return await asyncio.shield(task), "coalesced"
+        
+        self.misses += 1
+        task = asyncio.ensure_future(run())
+        self._in_flight[key] = task
+        
+        def finished(done: asyncio.Task):
+            self._in_flight.pop(key, None)
+            if not done.cancelled() and done.exception() is None and cacheable(done.result()):
+                self.put(key, done.result())
+        
+        task.add_done_callback(finished)
+        # Shielded so that a cancelled first caller does not cancel the others
+        return await asyncio.shield(task), "run"
+    
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "bypassed": self.bypassed,
+        }
@@ -0,0 +1,131 @@
+from typing import Any, Dict, List, Optional
+
+# Session fields sent as plain values when they change
+SCALAR_FIELDS = ["language", "lastModifiedBy", "createdAt"]
+
+
+def diff_text(old: str, new: str) -> List[list]:
+    """
+    Describe how to turn old into new as range edits [offset, deleteCount, insertText].
+    
+    Trims the common prefix and suffix, which is linear in the document size
+    and yields a single edit for the contiguous changes typical of typing.
+    """
+    if old == new:
+        return []
+    
+    limit = min(len(old), len(new))
+    start = 0
+    while start < limit and old[start] == new[start]:
+        start += 1
+    
+    end = 0
+    while end < limit - start and old[len(old) - 1 - end] == new[len(new) - 1 - end]:
+        end += 1
+    
+    return [[start, len(old) - start - end, new[start:len(new) - end]]]
+
+
+def apply_text_edits(text: str, edits: List[list]) -> str:
+    """Apply range edits produced by diff_text, in order."""
+    for offset, delete_count, insert in edits:
+        text = text[:offset] + insert + text[offset + delete_count:]
+    return text
+
+
+def utf16_length(text: str) -> int:
+    """Length of text in UTF-16 code units, as JavaScript counts it."""
+    return len(text.encode("utf-16-le")) // 2
+
+
+def _code_point_index(text: str, units: int) -> int:
+    """The index in text that lies `units` UTF-16 code units from its start."""
+    index = seen = 0
+    for char in text:
+        if seen >= units:
+            break
+        seen += 2 if ord(char) > 0xFFFF else 1
+        index += 1
+    
+    if seen < units:
+        raise ValueError(f"Offset {units} is outside the text ({utf16_length(text)} UTF-16 code units)")
+    if seen > units:
+        raise ValueError(f"Offset {units} splits a surrogate pair")
+    return index
+
+
+def to_utf16_edits(text: str, edits: List[list]) -> List[list]:
+    """
+    Convert range edits against text from character (code point) offsets
+    to UTF-16 offsets, the unit JavaScript strings and Monaco use.
+    """
+    converted = []
+    for offset, delete_count, insert in edits:
+        converted.append([
+            utf16_length(text[:offset]),
+            utf16_length(text[offset:offset + delete_count]),
+            insert
+        ])
+        text = text[:offset] + insert + text[offset + delete_count:]
+    return converted
+
+
+def from_utf16_edits(text: str, edits: List[list]) -> List[list]:
+    """
+    Convert range edits against text from UTF-16 offsets to character
+    offsets. Raises ValueError for a range outside the text or one that
+    starts or ends inside a surrogate pair.
+    """
+    converted = []
+    for offset, delete_count, insert in edits:
+        if offset < 0 or delete_count < 0:
+            raise ValueError(f"Edit [{offset}, {delete_count}] is outside the text")
+        start = _code_point_index(text, offset)
+        end = start + _code_point_index(text[start:], delete_count)
+        converted.append([start, end - start, insert])
+        text = text[:start] + insert + text[end:]
+    return converted
+
+
+def diff_session(old: Dict[str, Any], new: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Compute a delta between two serialized sessions.
+    
+    Only the parts that changed are present: scalar fields under "fields",
+    range edits for "code" (in UTF-16 offsets, for JavaScript clients), and
+    user joins, leaves and per-user field patches. An empty dict means
+    nothing changed.
+    """
+    delta: Dict[str, Any] = {}
+    
+    fields = {k: new.get(k) for k in SCALAR_FIELDS if old.get(k) != new.get(k)}
+    if fields:
+        delta["fields"] = fields
+    
+    old_code = old.get("code", "")
+    code_edits = diff_text(old_code, new.get("code", ""))
+    if code_edits:
+        delta["code"] = to_utf16_edits(old_code, code_edits)
+    
+    old_users = {u["id"]: u for u in old.get("users", [])}
+    new_users = {u["id"]: u for u in new.get("users", [])}
+    
+    joined = [u for user_id, u in new_users.items() if user_id not in old_users]
+    left = [user_id for user_id in old_users if user_id not in new_users]
+    changed = []
+    for user_id, user in new_users.items():
+        previous: Optional[Dict[str, Any]] = old_users.get(user_id)
+        if previous is None:
+            continue
+        patch = {k: v for k, v in user.items() if previous.get(k) != v}
+        if patch:
+            changed.append({"id": user_id, **patch})
+    
+    if joined:
+        delta["usersJoined"] = joined
+    if left:
+        delta["usersLeft"] = left
+    if changed:
+        delta["usersChanged"] = changed
+    
+    return delta
@@ -0,0 +1,81 @@
+from typing import Awaitable, Callable
+from app.config import settings
+from app.models.schemas import ExecuteCodeRequest, ExecutionResult
+from app.services.code_executor import CodeExecutor
+from app.services.execution_queue import execution_queue, QueueFullError
+from app.services.execution_stream import ExecutionStream
+
+# Supported languages
+SUPPORTED_LANGUAGES = [
+    "javascript",
+    "typescript",
+    "python",
+    "java",
+    "cpp",
+    "go",
+    "rust"
+]
+
+
+class ExecutionRejected(Exception):
+    """An execution request that cannot be run; carries the HTTP status to report."""
+    
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def invalid_language_message() -> str:
+    return f"Invalid language. Supported languages: {', '.join(SUPPORTED_LANGUAGES)}"
+
+
+async def execute_in_session(
+    db,
+    session_id: str,
+    request: ExecuteCodeRequest,
+    broadcast: Callable[[str, dict], Awaitable[None]]
+) -> ExecutionResult:
+    """
+    Run code for a session through the shared execution queue.
+    
+    Output is streamed to the session as execution_output events followed by
+    execution_done. Used by both the REST endpoint and the WebSocket.
+    """
+    if request.language not in SUPPORTED_LANGUAGES:
+        raise ExecutionRejected(400, invalid_language_message())
+    
+    if len(request.code) > settings.max_code_length:
+        raise ExecutionRejected(400, f"Code exceeds maximum length of {settings.max_code_length} characters")
+    
+    if not await db.get_session(session_id):
+        raise ExecutionRejected(404, "Session not found")
+    
+    executor = CodeExecutor()
+    stream = ExecutionStream(session_id, broadcast, settings.code_execution_max_output_bytes)
+    
+    # Memoized results do not need an execution slot
+    result = executor.cached_result(request.code, request.language, request.stdin)
+    if result:
+        queue_wait_ms = 0
+        await stream.output(result.output)
+    else:
+        try:
+            result, queue_wait_ms, _ = await execution_queue.submit(
+                session_id,
+                lambda: executor.execute_code(
+                    request.code,
+                    request.language,
+                    on_output=stream.output,
+                    stdin=request.stdin
+                )
+            )
+        except QueueFullError as e:
+            raise ExecutionRejected(429, str(e))
+    
+    result = result.model_copy(update={
+        "queueWaitTime": queue_wait_ms,
+        "executionId": stream.execution_id
+    })
+    await stream.done(result)
+    return result
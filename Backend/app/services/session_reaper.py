@@ -0,0 +1,82 @@
+import asyncio
+import time
+from typing import Optional, Callable
+
+
+class SessionReaper:
+    """
+    Background task that expires idle sessions.
+    
+    Every interval it asks the database for sessions whose last activity
+    is older than the timeout (an indexed range scan), skips any that
+    still have local subscribers, and either archives them into the
+    compressed cold table (restored on the next visit) or deletes them.
+    Both paths evict the session from the cache, the write-behind buffer
+    and the listener registry, then call on_expired with its ID.
+    """
+    
+    def __init__(
+        self,
+        db,
+        timeout_minutes: int,
+        interval_seconds: float = 60,
+        mode: str = "archive",
+        batch_size: int = 500,
+        is_active: Optional[Callable[[str], bool]] = None,
+        on_expired: Optional[Callable[[str], None]] = None
+    ):
+        self.db = db
+        self.timeout_ms = timeout_minutes * 60 * 1000
+        self.interval_seconds = interval_seconds
+        self.mode = mode
+        self.batch_size = batch_size
+        self.is_active = is_active or (lambda session_id: bool(db.listeners.get(session_id)))
+        self.on_expired = on_expired
+        self._task: Optional[asyncio.Task] = None
+        
+        # Metrics
+        self.expired = 0
+    
+    def start(self):
+        if self._task is None and self.mode != "off":
+            self._task = asyncio.get_running_loop().create_task(self._run())
+    
+    async def stop(self):
+        if self._task is None:
+            return
+        
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+    
+    async def reap_once(self, now_ms: Optional[int] = None) -> int:
+        """Expire one batch of idle sessions; returns how many were removed."""
+        now_ms = now_ms if now_ms is not None else int(time.time() * 1000)
+        idle = await self.db.find_idle_sessions(now_ms - self.timeout_ms, self.batch_size)
+        
+        removed = 0
+        for session_id in idle:
+            if self.is_active(session_id):
+                continue
+            
+            if self.mode == "delete":
+                done = await self.db.delete_session(session_id)
+            else:
+                done = await self.db.archive_session(session_id)
+            if done and self.on_expired is not None:
+                self.on_expired(session_id)
+            removed += int(done)
+        
+        self.expired += removed
+        return removed
+    
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval_seconds)
+            try:
+                await self.reap_once()
+            except Exception as e:
+                print(f"Error expiring sessions: {e}")
@@ -1,8 +1,11 @@
 import secrets
 import time
-from typing import Optional
+from typing import Optional, List, Tuple
 from app.models.schemas import Session, User
 from app.database.mock_db import MockDatabase
+from app.config import settings
+from app.services.presence_reaper import presence_reaper
+from app.services.crdt_documents import document_store
 
 
 class SessionService:
@@ -41,11 +44,30 @@ class SessionService:
         return await self.db.get_session(session_id)
     
     async def update_code(self, session_id: str, code: str, user_id: str) -> Optional[Session]:
-        """Update the code in a session."""
-        # Update user's last activity
-        await self.db.update_user(session_id, user_id, {
-            "lastActivity": int(time.time() * 1000)
-        })
+        """
+        Update the code in a session.
+        
+        The change is applied to the session's collaborative document as a
+        range edit that Yjs peers receive incrementally; the code column gets
+        the document's resulting text.
+        """
+        document = await document_store.open(self.db, session_id)
+        if document is None:
+            return None
+        
+        code = await document.replace_text(code, user_id)
+        # Already written below; the next document flush has nothing to add
+        document.code = code
+        
+        now = int(time.time() * 1000)
+        presence_reaper.touch(session_id, user_id)
+        
+        if settings.code_write_behind:
+            # Broadcast right away, persist on the next batched flush
+            return await self.db.stage_code(session_id, code, user_id, now)
+        
+        # Update user's last activity (in memory, snapshotted periodically)
+        await self.db.update_presence(session_id, user_id, last_activity=now)
         
         # Update code
         return await self.db.update_session(session_id, {
@@ -53,6 +75,36 @@ class SessionService:
             "lastModifiedBy": user_id
         })
     
+    async def get_code(self, session_id: str) -> Optional[Tuple[str, int]]:
+        """The session's current code and its version."""
+        document = await document_store.open(self.db, session_id)
+        if document is None:
+            return None
+        return str(document.text), document.version
+    
+    async def patch_code(
+        self,
+        session_id: str,
+        base_version: int,
+        edits: List[Tuple[int, int, str]],
+        user_id: str
+    ) -> Optional[int]:
+        """
+        Apply range edits to the session's code.
+        
+        Only the edited range is touched and relayed to Yjs peers; the code
+        column catches up on the next document flush. Returns the new
+        version, or None if the session does not exist. Raises
+        StaleVersionError or ValueError as SessionDocument.apply_edits does.
+        """
+        document = await document_store.open(self.db, session_id)
+        if document is None:
+            return None
+        
+        version = await document.apply_edits(base_version, edits, user_id)
+        presence_reaper.touch(session_id, user_id)
+        return version
+    
     async def update_language(self, session_id: str, language: str) -> Optional[Session]:
         """Update the programming language in a session."""
         return await self.db.update_session(session_id, {"language": language})
@@ -0,0 +1,56 @@
+import math
+from typing import Dict, Hashable, List
+
+
+class TimerWheel:
+    """
+    Hashed timer wheel.
+    
+    Timers are bucketed into `slots` buckets of `tick_seconds` each; a
+    timer further away than one revolution carries a round count. Scheduling,
+    rescheduling and cancelling are O(1), and each tick only looks at one
+    bucket, so thousands of typing/idle timers cost next to nothing.
+    Expiry has tick granularity: a timer fires between `delay` and
+    `delay + tick_seconds` after it was scheduled.
+    """
+    
+    def __init__(self, tick_seconds: float = 1.0, slots: int = 64):
+        self.tick_seconds = tick_seconds
+        self._slots: List[Dict[Hashable, int]] = [{} for _ in range(slots)]
+        self._where: Dict[Hashable, int] = {}
+        self._cursor = 0
+    
+    def __len__(self) -> int:
+        return len(self._where)
+    
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._where
+    
+    def schedule(self, key: Hashable, delay_seconds: float):
+        """(Re)start the timer for key; it fires after delay_seconds."""
+        self.cancel(key)
+        
+        ticks = max(1, math.ceil(delay_seconds / self.tick_seconds))
+        slot = (self._cursor + ticks) % len(self._slots)
+        self._slots[slot][key] = (ticks - 1) // len(self._slots)
+        self._where[key] = slot
+    
+    def cancel(self, key: Hashable):
+        slot = self._where.pop(key, None)
+        if slot is not None:
+            del self._slots[slot][key]
+    
+    def tick(self) -> List[Hashable]:
+        """Advance one tick and return the keys whose timers fired."""
+        self._cursor = (self._cursor + 1) % len(self._slots)
+        bucket = self._slots[self._cursor]
+        
+        expired = []
+        for key, rounds in list(bucket.items()):
+            if rounds == 0:
+                del bucket[key]
+                del self._where[key]
+                expired.append(key)
+            else:
+                bucket[key] = rounds - 1
+        return expired
@@ -3,6 +3,9 @@ import time
 from typing import Optional, Tuple
 from app.models.schemas import User, Session
 from app.database.mock_db import MockDatabase
+from app.database.errors import UsernameTakenError
+from app.database.usernames import username_key
+from app.services.presence_reaper import presence_reaper
 
 
 class UserService:
@@ -54,7 +57,7 @@ class UserService:
             return None, None, "Session not found"
         
         # Check if username is already taken
-        if any(u.username.lower() == username.lower() for u in session.users):
+        if any(username_key(u.username) == username_key(username) for u in session.users):
             return None, None, "Username is already taken"
         
         # Get existing colors
@@ -69,13 +72,19 @@ class UserService:
             lastActivity=int(time.time() * 1000)
         )
         
-        # Add user to session
-        updated_session = await self.db.add_user(session_id, user)
+        # Add user to session; the database enforces the username check against concurrent joins
+        try:
+            updated_session = await self.db.add_user(session_id, user)
+        except UsernameTakenError:
+            return None, None, "Username is already taken"
+        if updated_session:
+            presence_reaper.touch(session_id, user.id)
         
         return user, updated_session, None
     
     async def leave_session(self, session_id: str, user_id: str) -> Optional[Session]:
         """Remove a user from a session."""
+        presence_reaper.forget(session_id, user_id)
         return await self.db.remove_user(session_id, user_id)
     
     async def set_typing_status(
@@ -84,8 +93,11 @@ class UserService:
         user_id: str, 
         is_typing: bool
     ) -> Optional[Session]:
-        """Update a user's typing status."""
-        return await self.db.update_user(session_id, user_id, {"isTyping": is_typing})
+        """Update a user's typing status (in memory); a stale typing flag expires on its own."""
+        session = await self.db.update_presence(session_id, user_id, is_typing=is_typing)
+        if session:
+            presence_reaper.typing(session_id, user_id, is_typing)
+        return session
     
     async def check_username_available(self, session_id: str, username: str) -> bool:
         """Check if a username is available in a session."""
@@ -94,4 +106,4 @@ class UserService:
         if not session:
             return False
         
-        return not any(u.username.lower() == username.lower() for u in session.users)
+        return not any(username_key(u.username) == username_key(username) for u in session.users)
@@ -0,0 +1,92 @@
+import asyncio
+import os
+import time
+from app.database.sqlite_db import SQLiteDatabase
+from app.models.schemas import Session, User
+
+DB_PATH = "bench_get_session.db"
+ITERATIONS = 2000
+USER_COUNTS = [1, 10, 50]
+
+
+async def load_two_queries(db: SQLiteDatabase, session_id: str) -> Session:
+    """The previous get_session: one query for the session, one for its users."""
+    async with db._db.execute("SELECT * FROM sessions WHERE id = ?", (session_id,)) as cursor:
+        session_data = dict(await cursor.fetchone())
+    
+    async with db._db.execute("SELECT * FROM users WHERE session_id = ?", (session_id,)) as cursor:
+        users = [
+            User(
+                id=u_row['id'],
+                username=u_row['username'],
+                color=u_row['color'],
+                isTyping=bool(u_row['is_typing']),
+                lastActivity=u_row['last_activity']
+            )
+            for u_row in await cursor.fetchall()
+        ]
+    
+    return Session(
+        id=session_data['id'],
+        code=session_data['code'],
+        language=session_data['language'],
+        createdAt=session_data['created_at'],
+        lastModifiedBy=session_data.get('last_modified_by'),
+        users=users
+    )
+
+
+async def time_loads(load, session_id: str) -> float:
+    """Average latency of one uncached load, in microseconds."""
+    start = time.perf_counter()
+    for _ in range(ITERATIONS):
+        await load(session_id)
+    return (time.perf_counter() - start) / ITERATIONS * 1_000_000
+
+
+async def main():
+    if os.path.exists(DB_PATH):
+        os.remove(DB_PATH)
+    
+    db = SQLiteDatabase(DB_PATH)
+    await db.connect()
+    
+    # Background sessions so the users table is not trivially small
+    for s in range(200):
+        await db.create_session(Session(id=f"filler{s}", code="", language="python", createdAt=0))
+        for u in range(10):
+            await db.add_user(f"filler{s}", User(
+                id=f"filler{s}-{u}", username=f"user{u}", color="hsl(37, 92%, 50%)", lastActivity=0
+            ))
+    
+    for count in USER_COUNTS:
+        session_id = f"bench{count}"
+        await db.create_session(Session(id=session_id, code="print('x')\n" * 100, language="python", createdAt=0))
+        for u in range(count):
+            await db.add_user(session_id, User(
+                id=f"{session_id}-{u}", username=f"user{u}", color="hsl(37, 92%, 50%)", lastActivity=0
+            ))
+    
+    # "Before": two queries, no users(session_id) index
+    await db._db.execute("DROP INDEX IF EXISTS idx_users_session_id")
+    before = {}
+    for count in USER_COUNTS:
+        before[count] = await time_loads(lambda sid: load_two_queries(db, sid), f"bench{count}")
+    
+    # "After": single aggregated query with the index
+    await db._db.execute("CREATE INDEX IF NOT EXISTS idx_users_session_id ON users(session_id)")
+    after = {}
+    for count in USER_COUNTS:
+        after[count] = await time_loads(db._load_session, f"bench{count}")
+    
+    print(f"get_session latency over {ITERATIONS} uncached loads (SQLite)")
+    print(f"{'users':>6} {'before (us)':>12} {'after (us)':>12} {'speedup':>8}")
+    for count in USER_COUNTS:
+        print(f"{count:>6} {before[count]:>12.1f} {after[count]:>12.1f} {before[count] / after[count]:>7.2f}x")
+    
+    await db.disconnect()
+    os.remove(DB_PATH)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,44 @@
+import asyncio
+import statistics
+import time
+from app.services.python_sandbox import PythonWorkerPool
+
+ITERATIONS = 200
+SNIPPET = "print(sum(range(10)))"
+CONFIGS = [
+    # (label, start_method, max_jobs_per_worker)
+    ("spawn, reused", "spawn", 1000),
+    ("spawn, single-use", "spawn", 1),
+    ("forkserver, single-use", "forkserver", 1),
+]
+
+
+async def time_runs(pool: PythonWorkerPool) -> list:
+    """Latency of each trivial run, one at a time, in milliseconds."""
+    samples = []
+    for _ in range(ITERATIONS):
+        start = time.perf_counter()
+        await pool.run(SNIPPET)
+        samples.append((time.perf_counter() - start) * 1000)
+        # Leave room for the background refill, as a real request gap would
+        await asyncio.sleep(0.01)
+    return samples
+
+
+async def main():
+    print(f"Python execution latency over {ITERATIONS} runs of {SNIPPET!r}")
+    print(f"{'pool':>24} {'p50 (ms)':>9} {'p95 (ms)':>9} {'startup p50 (ms)':>17}")
+    
+    for label, start_method, max_jobs in CONFIGS:
+        pool = PythonWorkerPool(size=2, start_method=start_method, max_jobs_per_worker=max_jobs)
+        await pool.start()
+        samples = sorted(await time_runs(pool))
+        stats = pool.stats()
+        await pool.shutdown()
+        
+        p95 = samples[int(len(samples) * 0.95)]
+        print(f"{label:>24} {statistics.median(samples):>9.2f} {p95:>9.2f} {stats['startupMsP50']:>17.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
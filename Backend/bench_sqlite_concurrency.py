@@ -0,0 +1,98 @@
+import asyncio
+import os
+import statistics
+import time
+from app.database.sqlite_db import SQLiteDatabase
+from app.models.schemas import Session, User
+
+DB_PATH = "bench_sqlite_concurrency.db"
+SESSIONS = 200
+USERS_PER_SESSION = 5
+READERS = 16
+WRITERS = 32
+DURATION_SECONDS = 3.0
+
+MODES = {
+    # The original setup: rollback journal, full fsync, one connection, a commit per write
+    "rollback, 1 connection": dict(
+        journal_mode="delete", synchronous="full", reader_pool_size=0, write_batch_size=1, write_batch_delay_ms=0
+    ),
+    "wal, writer + 4 readers": dict(
+        journal_mode="wal", synchronous="normal", reader_pool_size=4, write_batch_size=1, write_batch_delay_ms=0
+    ),
+    "wal + group commit": dict(journal_mode="wal", synchronous="normal", reader_pool_size=4),
+}
+
+
+async def populate(db: SQLiteDatabase):
+    for s in range(SESSIONS):
+        await db.create_session(Session(id=f"s{s}", code="print('x')\n" * 50, language="python", createdAt=0))
+        for u in range(USERS_PER_SESSION):
+            await db.add_user(f"s{s}", User(
+                id=f"s{s}-{u}", username=f"user{u}", color="hsl(37, 92%, 50%)", lastActivity=0
+            ))
+
+
+async def run_mode(options) -> dict:
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(DB_PATH + suffix):
+            os.remove(DB_PATH + suffix)
+    
+    db = SQLiteDatabase(DB_PATH, **options)
+    await db.connect()
+    await populate(db)
+    transactions = db.writes.transactions
+    
+    deadline = time.perf_counter() + DURATION_SECONDS
+    read_latencies = []
+    writes = 0
+    
+    async def reader(n: int):
+        i = n
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            # Uncached load, the path a cache miss takes
+            await db._load_session(f"s{i % SESSIONS}")
+            read_latencies.append(time.perf_counter() - start)
+            i += READERS
+    
+    async def writer(n: int):
+        nonlocal writes
+        i = n
+        while time.perf_counter() < deadline:
+            await db.update_session(f"s{i % SESSIONS}", {"code": f"print({i})\n" * 50})
+            writes += 1
+            i += WRITERS
+    
+    await asyncio.gather(*(reader(n) for n in range(READERS)), *(writer(n) for n in range(WRITERS)))
+    transactions = db.writes.transactions - transactions
+    await db.disconnect()
+    
+    read_latencies.sort()
+    return {
+        "reads": len(read_latencies) / DURATION_SECONDS,
+        "writes": writes / DURATION_SECONDS,
+        "commits": transactions / DURATION_SECONDS,
+        "p50": statistics.median(read_latencies) * 1000,
+        "p99": read_latencies[int(len(read_latencies) * 0.99)] * 1000,
+    }
+
+
+async def main():
+    results = {name: await run_mode(options) for name, options in MODES.items()}
+    
+    print(f"Uncached get_session with {READERS} readers and {WRITERS} writers for {DURATION_SECONDS}s (SQLite)")
+    print(f"{'mode':<26} {'reads/s':>9} {'writes/s':>9} {'commits/s':>10} {'p50 ms':>8} {'p99 ms':>8}")
+    for name, r in results.items():
+        print(
+            f"{name:<26} {r['reads']:>9.0f} {r['writes']:>9.0f} {r['commits']:>10.0f} "
+            f"{r['p50']:>8.2f} {r['p99']:>8.2f}"
+        )
+    
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(DB_PATH + suffix):
+            os.remove(DB_PATH + suffix)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -29,6 +29,142 @@ async def test_update_code(client: AsyncClient, sample_session, sample_user_data
     assert session["code"] == new_code
 
 
+@pytest.mark.asyncio
+async def test_patch_code(client: AsyncClient, sample_session, sample_user_data):
+    """Test editing code with range edits against a base version."""
+    from app.services.crdt_documents import document_store
+    session_id = sample_session["id"]
+    
+    join_response = await client.post(
+        f"/api/v1/sessions/{session_id}/join",
+        json=sample_user_data
+    )
+    user_id = join_response.json()["user"]["id"]
+    await client.put(
+        f"/api/v1/sessions/{session_id}/code",
+        json={"code": "print('héllo')", "userId": user_id}
+    )
+    
+    current = (await client.get(f"/api/v1/sessions/{session_id}/code")).json()
+    assert current["code"] == "print('héllo')"
+    
+    # Second edit applies to the result of the first
+    response = await client.patch(
+        f"/api/v1/sessions/{session_id}/code",
+        json={"baseVersion": current["version"], "edits": [[7, 5, "world"], [0, 0, "# hi\n"]], "userId": user_id}
+    )
+    assert response.status_code == 200
+    version = response.json()["version"]
+    assert version > current["version"]
+    
+    code = (await client.get(f"/api/v1/sessions/{session_id}/code")).json()
+    assert code == {"code": "# hi\nprint('world')", "version": version}
+    
+    # The old base is stale now
+    stale = await client.patch(
+        f"/api/v1/sessions/{session_id}/code",
+        json={"baseVersion": current["version"], "edits": [[0, 0, "x"]], "userId": user_id}
+    )
+    assert stale.status_code == 409
+    
+    out_of_range = await client.patch(
+        f"/api/v1/sessions/{session_id}/code",
+        json={"baseVersion": version, "edits": [[100, 1, ""]], "userId": user_id}
+    )
+    assert out_of_range.status_code == 400
+    
+    missing = await client.patch(
+        "/api/v1/sessions/nonexistent/code",
+        json={"baseVersion": 0, "edits": [[0, 0, "x"]], "userId": user_id}
+    )
+    assert missing.status_code == 404
+    
+    # The code column catches up on the next document flush
+    await document_store.flush()
+    session = (await client.get(f"/api/v1/sessions/{session_id}")).json()
+    assert session["code"] == "# hi\nprint('world')"
+
+
+@pytest.mark.asyncio
+async def test_patch_code_utf16_offsets(client: AsyncClient, sample_session, sample_user_data):
+    """PATCH offsets are UTF-16 code units, so an emoji counts as two."""
+    session_id = sample_session["id"]
+    
+    join_response = await client.post(f"/api/v1/sessions/{session_id}/join", json=sample_user_data)
+    user_id = join_response.json()["user"]["id"]
+    await client.put(
+        f"/api/v1/sessions/{session_id}/code",
+        json={"code": "s = '😀'; n = 1", "userId": user_id}
+    )
+    current = (await client.get(f"/api/v1/sessions/{session_id}/code")).json()
+    
+    # "n" is character 9 but UTF-16 offset 10
+    response = await client.patch(
+        f"/api/v1/sessions/{session_id}/code",
+        json={"baseVersion": current["version"], "edits": [[10, 1, "m"]], "userId": user_id}
+    )
+    assert response.status_code == 200
+    code = (await client.get(f"/api/v1/sessions/{session_id}/code")).json()
+    assert code["code"] == "s = '😀'; m = 1"
+    
+    # Deleting the emoji takes both of its code units
+    response = await client.patch(
+        f"/api/v1/sessions/{session_id}/code",
+        json={"baseVersion": code["version"], "edits": [[5, 2, "x"]], "userId": user_id}
+    )
+    assert response.status_code == 200
+    code = (await client.get(f"/api/v1/sessions/{session_id}/code")).json()
+    assert code["code"] == "s = 'x'; m = 1"
+    
+    await client.put(
+        f"/api/v1/sessions/{session_id}/code",
+        json={"code": "😀", "userId": user_id}
+    )
+    current = (await client.get(f"/api/v1/sessions/{session_id}/code")).json()
+    split = await client.patch(
+        f"/api/v1/sessions/{session_id}/code",
+        json={"baseVersion": current["version"], "edits": [[1, 0, "x"]], "userId": user_id}
+    )
+    assert split.status_code == 400
+    assert "surrogate" in split.json()["detail"]
+
+
+@pytest.mark.asyncio
+async def test_patch_code_across_reload(client: AsyncClient, sample_session, sample_user_data):
+    """A version read before the document was flushed and closed still applies after it is reloaded."""
+    from app.services.crdt_documents import document_store
+    session_id = sample_session["id"]
+    
+    join_response = await client.post(f"/api/v1/sessions/{session_id}/join", json=sample_user_data)
+    user_id = join_response.json()["user"]["id"]
+    await client.put(
+        f"/api/v1/sessions/{session_id}/code",
+        json={"code": "x = 1", "userId": user_id}
+    )
+    current = (await client.get(f"/api/v1/sessions/{session_id}/code")).json()
+    
+    # Nobody is connected or has used it for an interval: the flush persists
+    # the document and closes it
+    document_store.documents[session_id].touched -= document_store.interval
+    await document_store.flush()
+    assert session_id not in document_store.documents
+    
+    response = await client.patch(
+        f"/api/v1/sessions/{session_id}/code",
+        json={"baseVersion": current["version"], "edits": [[4, 1, "2"]], "userId": user_id}
+    )
+    assert response.status_code == 200
+    code = (await client.get(f"/api/v1/sessions/{session_id}/code")).json()
+    assert code == {"code": "x = 2", "version": response.json()["version"]}
+    
+    # Again after compaction folded the log into a snapshot
+    await document_store.documents[session_id]._compact()
+    document_store.documents[session_id].touched -= document_store.interval
+    await document_store.flush()
+    assert session_id not in document_store.documents
+    assert (await client.get(f"/api/v1/sessions/{session_id}/code")).json() == code
+
+
 @pytest.mark.asyncio
 async def test_update_language(client: AsyncClient, sample_session):
     """Test updating programming language."""
@@ -64,3 +200,135 @@ async def test_update_language_invalid(client: AsyncClient, sample_session):
 
 
 
+
+
+@pytest.mark.asyncio
+async def test_code_edits_are_coalesced_until_flush(global_mock_db):
+    """Write-behind: edits are visible immediately but persisted in one batch."""
+    from app.models.schemas import Session, User
+    
+    db = global_mock_db
+    await db.create_session(Session(id="wb", code="", language="python", createdAt=0))
+    await db.add_user("wb", User(id="u1", username="u1", color="hsl(37, 92%, 50%)", lastActivity=0))
+    
+    for i in range(50):
+        session = await db.stage_code("wb", f"x = {i}", "u1", 1000 + i)
+    
+    assert session.code == "x = 49"
+    assert (await db.get_session("wb")).code == "x = 49"
+    assert db.write_buffer.dirty_bytes == len("x = 49")
+    
+    # Nothing has reached the database yet
+    assert (await db._load_session("wb")).code == ""
+    
+    # Evicted sessions still see their buffered edits
+    db.cache.clear()
+    assert (await db.get_session("wb")).code == "x = 49"
+    
+    await db.flush_pending_writes()
+    persisted = await db._load_session("wb")
+    assert persisted.code == "x = 49"
+    assert persisted.lastModifiedBy == "u1"
+    assert persisted.users[0].lastActivity == 1049
+    assert "wb" not in db.write_buffer
+
+
+@pytest.mark.asyncio
+async def test_code_edits_visible_while_flushing(global_mock_db):
+    """A cache miss during a flush still sees the edits being committed."""
+    import asyncio
+    from app.models.schemas import Session
+    
+    db = global_mock_db
+    await db.create_session(Session(id="inflight", code="", language="python", createdAt=0))
+    await db.stage_code("inflight", "x = 1", "u1", 1000)
+    
+    started, release = asyncio.Event(), asyncio.Event()
+    flush_batch = db.write_buffer._flush_batch
+    
+    async def slow_flush(batch):
+        started.set()
+        await release.wait()
+        await flush_batch(batch)
+    
+    db.write_buffer._flush_batch = slow_flush
+    flush = asyncio.create_task(db.flush_pending_writes())
+    await started.wait()
+    
+    try:
+        db.cache.clear()
+        assert (await db.get_session("inflight")).code == "x = 1"
+        assert "inflight" in db.write_buffer
+    finally:
+        release.set()
+        await flush
+    assert "inflight" not in db.write_buffer
+    assert (await db._load_session("inflight")).code == "x = 1"
+
+
+@pytest.mark.asyncio
+async def test_code_flush_on_dirty_bytes(global_mock_db):
+    """Crossing the dirty-byte threshold flushes without waiting for the interval."""
+    import asyncio
+    from app.models.schemas import Session
+    
+    db = global_mock_db
+    db.write_buffer.interval = 60
+    db.write_buffer.max_dirty_bytes = 100
+    await db.create_session(Session(id="big", code="", language="python", createdAt=0))
+    
+    await db.stage_code("big", "#" * 200, "u1", 0)
+    for _ in range(20):
+        await asyncio.sleep(0.01)
+        if "big" not in db.write_buffer:
+            break
+    
+    assert (await db._load_session("big")).code == "#" * 200
+
+
+@pytest.mark.asyncio
+async def test_execute_code(client: AsyncClient, sample_session):
+    """Code runs through the execution queue and reports queue wait separately."""
+    session_id = sample_session["id"]
+    
+    response = await client.post(
+        f"/api/v1/sessions/{session_id}/execute",
+        json={"code": "print(6 * 7)", "language": "python"}
+    )
+    
+    assert response.status_code == 200
+    result = response.json()
+    assert result["output"] == "42\n"
+    assert result["error"] is None
+    assert result["queueWaitTime"] >= 0
+    assert result["executionTime"] >= 0
+
+
+@pytest.mark.asyncio
+async def test_execute_code_errors(client: AsyncClient, sample_session):
+    """Unknown sessions, languages and a full queue are rejected."""
+    from app.services.execution_queue import execution_queue
+    
+    response = await client.post(
+        "/api/v1/sessions/nonexistent/execute",
+        json={"code": "print(1)", "language": "python"}
+    )
+    assert response.status_code == 404
+    
+    response = await client.post(
+        f"/api/v1/sessions/{sample_session['id']}/execute",
+        json={"code": "print(1)", "language": "cobol"}
+    )
+    assert response.status_code == 400
+    
+    max_queue_depth = execution_queue.max_queue_depth
+    execution_queue.max_queue_depth = 0
+    try:
+        response = await client.post(
+            f"/api/v1/sessions/{sample_session['id']}/execute",
+            json={"code": "print(1)", "language": "python"}
+        )
+    finally:
+        execution_queue.max_queue_depth = max_queue_depth
+    assert response.status_code == 429
+    assert response.headers["retry-after"] == "1"
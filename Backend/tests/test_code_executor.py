@@ -0,0 +1,456 @@
+import asyncio
+import shutil
+import time
+import pytest
+import pytest_asyncio
+from app.services.code_executor import CodeExecutor
+from app.services.compiled_runner import CompiledRunner
+from app.services.node_sandbox import NodeWorkerPool
+from app.services.python_sandbox import PythonWorkerPool
+from app.services.result_cache import ExecutionResultCache
+
+requires_node = pytest.mark.skipif(shutil.which("node") is None, reason="node is not installed")
+
+
+@pytest_asyncio.fixture
+async def python_workers():
+    pool = PythonWorkerPool(size=1, timeout_seconds=1, memory_limit_mb=64, max_output_bytes=1000)
+    yield pool
+    await pool.shutdown()
+
+
+@pytest_asyncio.fixture
+async def node_workers():
+    pool = NodeWorkerPool(size=1, timeout_seconds=1, memory_limit_mb=64, max_output_bytes=1000)
+    yield pool
+    await pool.shutdown()
+
+
+@pytest.fixture
+def compiled(tmp_path):
+    return CompiledRunner(cache_dir=str(tmp_path / "builds"), timeout_seconds=1, max_output_bytes=1000)
+
+
+@pytest.fixture
+def executor(python_workers, node_workers, compiled):
+    return CodeExecutor(python_workers, ExecutionResultCache(), node_workers, compiled)
+
+
+@pytest.mark.asyncio
+async def test_python_execution(executor):
+    """Output and exceptions come back from the worker process."""
+    result = await executor.execute_code('print("Hello World")', "python")
+    assert result.output == "Hello World\n"
+    assert result.error is None
+    
+    result = await executor.execute_code("print(undefined_var)", "python")
+    assert result.error.startswith("NameError")
+
+
+@pytest.mark.asyncio
+async def test_python_timeout_replaces_worker(executor, python_workers):
+    """An infinite loop is killed at the timeout and the worker is replaced."""
+    start = time.monotonic()
+    result = await executor.execute_code("while True:\n    pass", "python")
+    assert time.monotonic() - start < 3
+    assert result.error.startswith("TimeoutError")
+    assert python_workers.replaced == 1
+    
+    # The replacement worker serves the next job
+    result = await executor.execute_code("print(1 + 1)", "python")
+    assert result.output == "2\n"
+
+
+@pytest.mark.asyncio
+async def test_python_workers_are_warm_and_single_use(executor, python_workers):
+    """Workers are started ahead of time and never see another job's state."""
+    await python_workers.start()
+    stats = python_workers.stats()
+    assert stats["idle"] == 1
+    assert stats["startupMsP50"] is not None
+    
+    await executor.execute_code("leaked = 42", "python")
+    result = await executor.execute_code("print(leaked)", "python")
+    assert result.error.startswith("NameError")
+    
+    stats = python_workers.stats()
+    assert stats["jobs"] == 2
+    assert stats["recycled"] == 2
+    assert stats["replaced"] == 0
+
+
+@pytest.mark.asyncio
+async def test_python_pool_stays_within_size_and_reports_spawn_failures(monkeypatch):
+    """Refills never grow the pool past its size; failing spawns surface as an error."""
+    pool = PythonWorkerPool(size=2, timeout_seconds=1, memory_limit_mb=64, low_watermark=2)
+    try:
+        await pool.start()
+        for _ in range(3):
+            await pool.run("print(1)")
+            assert len(pool._workers) + pool._spawning <= pool.size
+    finally:
+        await pool.shutdown()
+    
+    def broken_spawn():
+        raise OSError("fork failed")
+    
+    pool = PythonWorkerPool(size=1, timeout_seconds=1, acquire_timeout_seconds=0.5)
+    monkeypatch.setattr(pool, "_spawn", broken_spawn)
+    try:
+        start = time.monotonic()
+        result = await pool.run("print(1)")
+        assert time.monotonic() - start < 3
+        assert result["error"].startswith("EnvironmentError")
+        assert "fork failed" in result["error"]
+        assert pool.stats()["spawnFailures"] >= 1
+    finally:
+        await pool.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_killed_python_workers_are_reaped_off_the_loop(python_workers):
+    """Killing a worker never waits for it on the event loop; it is reaped once it has exited."""
+    await python_workers.start()
+    worker = await python_workers._idle.get()
+    process = worker.process
+    joins = []
+    real_join = process.join
+    process.join = lambda timeout=None: (joins.append(timeout), real_join(timeout))
+    
+    worker.kill()
+    assert joins == []
+    for _ in range(100):
+        if joins:
+            break
+        await asyncio.sleep(0.01)
+    assert joins == [0]
+    assert process.exitcode is not None
+    python_workers._workers.discard(worker)
+
+
+@pytest.mark.asyncio
+async def test_python_output_and_memory_limits(executor):
+    """Output is capped and memory hogs fail without taking the pool down."""
+    result = await executor.execute_code("for i in range(10000):\n    print(i)", "python")
+    assert result.output.endswith("[output truncated]")
+    assert len(result.output) < 1100
+    
+    result = await executor.execute_code("x = 'a' * (512 * 1024 * 1024)", "python")
+    assert result.error is not None
+    
+    result = await executor.execute_code("print('still alive')", "python")
+    assert result.output == "still alive\n"
+
+
+@pytest.mark.asyncio
+async def test_python_output_is_streamed(executor):
+    """Chunks arrive while the program runs and add up to the final output."""
+    chunks = []
+    
+    async def on_output(text):
+        chunks.append(text)
+    
+    code = "for i in range(300):\n    print('x' * 9)"
+    result = await executor.execute_code(code, "python", on_output)
+    
+    # 3000 bytes of output against a 1000 byte cap
+    assert "".join(chunks) == result.output.replace("\n[output truncated]", "")
+    assert len("".join(chunks)) == 1000
+
+
+@pytest.mark.asyncio
+async def test_execution_stream_sequencing():
+    """Events are numbered and capped; the done event reports timings."""
+    from app.models.schemas import ExecutionResult
+    from app.services.execution_stream import ExecutionStream
+    
+    events = []
+    
+    async def broadcast(session_id, message):
+        events.append((session_id, message))
+    
+    stream = ExecutionStream("s1", broadcast, max_bytes=8)
+    await stream.output("hello ")
+    await stream.output("world")
+    await stream.output("ignored")
+    await stream.done(ExecutionResult(output="hello world", executionTime=12, queueWaitTime=3))
+    
+    assert [m["seq"] for _, m in events] == [1, 2, 3]
+    assert [m["data"] for _, m in events[:2]] == ["hello ", "wo"]
+    done = events[-1][1]
+    assert done["event"] == "execution_done"
+    assert done["data"] == {
+        "error": None, "executionTime": 12, "queueWaitTime": 3, "outputBytes": 8, "truncated": True
+    }
+    assert {m["executionId"] for _, m in events} == {stream.execution_id}
+
+
+@pytest.mark.asyncio
+async def test_results_are_memoized(executor):
+    """Re-running identical code is served from the cache; stdin is part of the key."""
+    code = "print(input() * 2)"
+    
+    first = await executor.execute_code(code, "python", stdin="ab")
+    second = await executor.execute_code(code, "python", stdin="ab")
+    other = await executor.execute_code(code, "python", stdin="cd")
+    
+    assert first.output == "abab\n" and not first.cached
+    assert second.output == "abab\n" and second.cached
+    assert other.output == "cdcd\n" and not other.cached
+    assert executor.results.stats()["hits"] == 1
+    
+    # Timeouts are not memoized
+    await executor.execute_code("while True:\n    pass", "python")
+    assert executor.cached_result("while True:\n    pass", "python") is None
+
+
+@requires_node
+@pytest.mark.asyncio
+async def test_random_output_is_not_memoized(executor):
+    """Programs using randomness or clocks run every time."""
+    code = "console.log(Math.random())"
+    
+    first = await executor.execute_code(code, "javascript")
+    second = await executor.execute_code(code, "javascript")
+    
+    assert not first.cached and not second.cached
+    assert first.output != second.output
+    assert executor.cached_result(code, "javascript") is None
+    assert executor.results.stats()["bypassed"] == 2
+    
+    assert not executor.is_cacheable("print(set('abc'))", "python")
+    assert not executor.is_cacheable("#include <cstdlib>\nint main() { return rand(); }", "cpp")
+    assert not executor.is_cacheable("m := map[string]int{}", "go")
+    assert executor.is_cacheable("console.log(6 * 7)", "javascript")
+
+
+@pytest.mark.asyncio
+async def test_concurrent_identical_runs_are_shared(executor):
+    """Identical executions in flight share one worker run."""
+    import asyncio
+    
+    code = "total = 0\nfor i in range(200000):\n    total += i\nprint(total)"
+    results = await asyncio.gather(*[executor.execute_code(code, "python") for _ in range(5)])
+    
+    assert {r.output for r in results} == {"19999900000\n"}
+    assert executor.results.stats()["misses"] == 1
+    assert executor.results.stats()["coalesced"] == 4
+
+
+def test_cache_ttl_and_lru():
+    """Entries expire after the TTL and the least recently used is evicted first."""
+    from app.models.schemas import ExecutionResult
+    
+    cache = ExecutionResultCache(max_entries=2, ttl_seconds=60)
+    for key in ("a", "b", "c"):
+        cache.put(key, ExecutionResult(output=key, executionTime=0))
+    assert cache.get("a") is None
+    assert cache.get("c").output == "c"
+    
+    cache.ttl_seconds = -1
+    assert cache.get("c") is None
+    assert cache.make_key("python", "ab", "", "3") != cache.make_key("python", "a", "b", "3")
+
+
+@requires_node
+@pytest.mark.asyncio
+async def test_javascript_execution(executor, node_workers):
+    """JavaScript runs in a reused worker, with a fresh global scope per job."""
+    result = await executor.execute_code("var leaked = 1; console.log('sum', 1 + 2)", "javascript")
+    assert result.output == "sum 3\n"
+    assert result.error is None
+    
+    result = await executor.execute_code("console.log(typeof leaked); missing()", "javascript")
+    assert result.output == "undefined\n"
+    assert result.error.startswith("ReferenceError")
+    
+    # Async code and timers finish before the result is returned
+    code = "setTimeout(() => console.log(prompt()), 10); (async () => { await null; console.log('a') })()"
+    result = await executor.execute_code(code, "javascript", stdin="line\n")
+    assert result.output == "a\nline\n"
+    
+    # vm escapes through the Function constructor are blocked
+    result = await executor.execute_code("console.constructor.constructor('return process')()", "javascript")
+    assert result.error.startswith("EvalError")
+    assert node_workers.stats()["spawned"] == 1
+
+
+@requires_node
+@pytest.mark.asyncio
+async def test_javascript_jobs_cannot_reach_the_worker_realm(executor, node_workers):
+    """Prototype changes stay in their job's context and cannot corrupt the replies."""
+    code = (
+        "Object.getPrototypeOf(console).leaked = 1;"
+        "Object.getPrototypeOf(console.log).leaked = 2;"
+        "console.log('first')"
+    )
+    result = await executor.execute_code(code, "javascript")
+    assert result.output == "first\n"
+    
+    result = await executor.execute_code("console.log(console.leaked, console.log.leaked)", "javascript")
+    assert result.output == "undefined undefined\n"
+    
+    # Would turn every reply of the worker into a bare string if it reached its realm
+    result = await executor.execute_code(
+        "Object.getPrototypeOf(console).toJSON = () => 'broken'; console.log('third')", "javascript"
+    )
+    assert result.output == "third\n"
+    assert node_workers.stats()["replaced"] == 0
+
+
+@pytest.mark.asyncio
+async def test_node_worker_rejects_malformed_replies():
+    """A reply that is not a JSON object with a type counts as a crashed worker."""
+    from app.services.node_sandbox import NodeWorkerCrashed, _NodeWorker
+    
+    class FakeStdout:
+        def __init__(self, line):
+            self.line = line
+        
+        async def readline(self):
+            return self.line
+    
+    class FakeProcess:
+        def __init__(self, line):
+            self.stdout = FakeStdout(line)
+    
+    for line in (b'"done"\n', b'[1]\n', b'{"data": "x"}\n', b'not json\n'):
+        with pytest.raises(NodeWorkerCrashed):
+            await _NodeWorker(FakeProcess(line)).receive()
+    
+    assert await _NodeWorker(FakeProcess(b'{"type": "done"}\n')).receive() == {"type": "done"}
+
+
+@requires_node
+@pytest.mark.asyncio
+async def test_node_pool_bounds_acquire_and_retries_replacements():
+    """Jobs give up when no worker frees up, and failed replacements are retried with backoff."""
+    pool = NodeWorkerPool(size=1, timeout_seconds=1, memory_limit_mb=64, acquire_timeout_seconds=0.2)
+    try:
+        await pool.start()
+        busy = asyncio.create_task(pool.run("while (true) {}"))
+        await asyncio.sleep(0.1)
+        start = time.monotonic()
+        result = await pool.run("console.log(1)")
+        assert time.monotonic() - start < 1
+        assert result["error"].startswith("EnvironmentError: no Node.js worker")
+        
+        # The busy worker dies and its replacement cannot start yet
+        pool.node_binary = "/nonexistent/node"
+        next(iter(pool._workers)).process.kill()
+        assert (await busy)["error"].startswith("ResourceError")
+        await asyncio.sleep(0.8)
+        assert pool.stats()["spawnFailures"] >= 2
+        assert pool._replenisher is not None and not pool._replenisher.done()
+        
+        pool.node_binary = "node"
+        result = await pool.run("console.log('back')")
+        assert result["output"] == "back\n"
+    finally:
+        await pool.shutdown()
+    assert pool._replenisher is None
+
+
+@requires_node
+@pytest.mark.asyncio
+async def test_javascript_timeout_and_memory_limit(executor, node_workers):
+    """Runaway loops time out and heap hogs kill only their worker."""
+    start = time.monotonic()
+    result = await executor.execute_code("while (true) {}", "javascript")
+    assert time.monotonic() - start < 3
+    assert result.error.startswith("TimeoutError")
+    
+    result = await executor.execute_code("const a = []; while (true) a.push({ n: a.length })", "javascript")
+    assert result.error.split(":")[0] in ("ResourceError", "TimeoutError", "RangeError")
+    
+    result = await executor.execute_code("console.log('still alive')", "javascript")
+    assert result.output == "still alive\n"
+
+
+@requires_node
+@pytest.mark.asyncio
+async def test_typescript_is_transpiled_once(executor, node_workers, tmp_path, monkeypatch):
+    """TypeScript goes through the typescript package and is cached by source."""
+    # Minimal stand-in for the typescript package: strips ": number" annotations
+    package = tmp_path / "typescript"
+    package.mkdir()
+    (package / "index.js").write_text(
+        "exports.ScriptTarget = {ES2020: 7}; exports.ModuleKind = {CommonJS: 1};\n"
+        "exports.DiagnosticCategory = {Error: 1};\n"
+        "exports.transpileModule = (s) => ({outputText: s.replace(/: number/g, ''), diagnostics: []});\n"
+    )
+    monkeypatch.setenv("NODE_PATH", str(tmp_path))
+    
+    code = "const n: number = 20; console.log(n + 1)"
+    first = await executor.execute_code(code, "typescript")
+    # Different stdin misses the result cache but not the transpile cache
+    second = await executor.execute_code(code, "typescript", stdin="x")
+    
+    assert first.output == second.output == "21\n"
+    assert node_workers.stats()["transpileMisses"] == 1
+    assert node_workers.stats()["transpileHits"] == 1
+
+
+@pytest.mark.skipif(shutil.which("g++") is None, reason="g++ is not installed")
+@pytest.mark.asyncio
+async def test_cpp_build_cache_and_phase_timings(executor, compiled):
+    """Unchanged code reuses the cached binary; compile and run are timed apart."""
+    code = '#include <iostream>\nint main() { std::string s; std::cin >> s; std::cout << "hi " << s << "\\n"; }'
+    
+    first = await executor.execute_code(code, "cpp", stdin="ann")
+    second = await executor.execute_code(code, "cpp", stdin="bob")
+    assert (first.output, second.output) == ("hi ann\n", "hi bob\n")
+    assert first.compileCached is False and second.compileCached is True
+    assert first.compileTime is not None and first.runTime is not None
+    assert compiled.stats()["compiles"] == 1
+    
+    result = await executor.execute_code("int main() { return 1 }", "cpp")
+    assert result.error.startswith("CompileError")
+    assert result.runTime is None
+    
+    result = await executor.execute_code("int main() { for (;;); }", "cpp")
+    assert result.error.split(":")[0] in ("TimeoutError", "ResourceError")
+
+
+@pytest.mark.skipif(shutil.which("g++") is None, reason="g++ is not installed")
+@pytest.mark.asyncio
+async def test_cancelled_run_kills_the_program(compiled):
+    """A run cancelled mid-way (client gone, queue timeout) does not leave the program behind."""
+    import asyncio
+    import os
+    
+    code = '#include <cstdio>\n#include <unistd.h>\nint main() { printf("%d\\n", getpid()); fflush(stdout); for (;;); }'
+    pids = []
+    
+    async def on_output(text):
+        pids.append(int(text))
+    
+    run = asyncio.create_task(compiled.run(code, "cpp", on_output))
+    while not pids:
+        await asyncio.sleep(0.05)
+    run.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await run
+    
+    with pytest.raises(ProcessLookupError):
+        os.kill(pids[0], 0)
+    assert compiled.version("cpp") not in ("unknown", "unavailable")
+
+
+@pytest.mark.asyncio
+async def test_missing_toolchain_is_reported(executor, compiled):
+    """Languages without a local toolchain fail clearly and are not memoized."""
+    compiled._versions["java"] = "unavailable"
+    
+    code = "public class Main { public static void main(String[] a) {} }"
+    result = await executor.execute_code(code, "java")
+    assert result.error.startswith("EnvironmentError")
+    assert executor.cached_result(code, "java") is None
+
+
+@pytest.mark.asyncio
+async def test_unsupported_language_is_reported(executor):
+    """A language with no executor fails with an error result rather than an exception."""
+    result = await executor.execute_code("print(1)", "cobol")
+    assert result.output == "No output"
+    assert result.error == "EnvironmentError: unsupported language: cobol"
@@ -0,0 +1,203 @@
+import pytest
+from fastapi.testclient import TestClient
+from pycrdt import Doc, Text, create_sync_message, create_update_message, handle_sync_message
+from app.main import app
+from app.models.schemas import Session
+from app.services.crdt_documents import DocumentStore, TEXT_NAME, document_store
+from app.services.session_reaper import SessionReaper
+from app.services.session_service import SessionService
+
+
+class FakePeer:
+    """Stands in for a Yjs socket; applies everything it receives to its own doc."""
+    
+    def __init__(self):
+        self.doc = Doc()
+        self.text = self.doc.get(TEXT_NAME, type=Text)
+        self.received = []
+    
+    async def send_bytes(self, message: bytes):
+        self.received.append(message)
+        if message[0] == 0:
+            handle_sync_message(message[1:], self.doc)
+
+
+@pytest.mark.asyncio
+async def test_document_seeded_persisted_and_reloaded(global_mock_db):
+    """The document starts from the code column, and its updates survive a reload."""
+    db = global_mock_db
+    await db.create_session(Session(id="doc", code="print(1)", language="python", createdAt=0))
+    
+    document = await document_store.open(db, "doc")
+    assert await document_store.open(db, "doc") is document
+    assert str(document.text) == "print(1)"
+    
+    peer = FakePeer()
+    await document.connect(peer)
+    await document.handle_message(peer, create_sync_message(peer.doc))
+    assert str(peer.text) == "print(1)"
+    
+    # A REST write becomes a range edit that the peer receives incrementally
+    session = await SessionService(db).update_code("doc", "print(12)", "u1")
+    assert session.code == "print(12)"
+    assert str(peer.text) == "print(12)"
+    
+    # An edit from the peer reaches the code column on the next flush
+    peer.text.insert(len("print(12"), " + 3")
+    await document.handle_message(peer, create_update_message(peer.doc.get_update()))
+    await document_store.flush()
+    assert (await db.get_session("doc")).code == "print(12 + 3)"
+    # The peer has no user: the last known editor stays, and no user row is touched
+    await db.flush_pending_writes()
+    db.cache.invalidate("doc")
+    assert (await db.get_session("doc")).lastModifiedBy == "u1"
+    
+    await document.disconnect(peer)
+    await document_store.stop()
+    assert document_store.documents == {}
+    
+    store = DocumentStore()
+    assert str((await store.open(db, "doc")).text) == "print(12 + 3)"
+    assert await store.open(db, "missing") is None
+    await store.stop()
+
+
+@pytest.mark.asyncio
+async def test_update_log_compacts_into_snapshot(global_mock_db):
+    """After N logged updates the log is folded into a snapshot; loading reads snapshot plus tail."""
+    db = global_mock_db
+    await db.create_session(Session(id="log", code="", language="python", createdAt=0))
+    
+    store = DocumentStore(compact_after_updates=3, compact_after_bytes=1024 * 1024)
+    document = await store.open(db, "log")
+    # A connected peer keeps the document open between flushes
+    await document.connect(FakePeer())
+    for i in range(4):
+        await document.replace_text(str(document.text) + f"line {i}\n")
+        await store.flush()
+    
+    snapshot, tail, version = await db.load_document("log")
+    assert snapshot is not None
+    assert len(tail) == 1 and document.log_length == 1
+    assert version == document.version
+    
+    stats = store.stats()
+    assert stats["compactions"] == 1
+    assert stats["logLength"] == 1
+    assert stats["compactionMsMax"] >= stats["compactionMsAvg"] > 0
+    await store.stop()
+    
+    reloaded = DocumentStore()
+    document = await reloaded.open(db, "log")
+    assert str(document.text) == "line 0\nline 1\nline 2\nline 3\n"
+    assert reloaded.stats()["maxLoadedLogLength"] == 1
+    await reloaded.stop()
+
+
+@pytest.mark.asyncio
+async def test_two_processes_seed_once_and_share_edits(global_mock_db):
+    """Stores that seed the same session concurrently do not repeat the code, and see each other's edits."""
+    db = global_mock_db
+    await db.create_session(Session(id="shared", code="print(1)", language="python", createdAt=0))
+    
+    first, second = DocumentStore(), DocumentStore()
+    a = await first.open(db, "shared")
+    b = await second.open(db, "shared")
+    # Connected peers keep both documents open between flushes
+    await a.connect(FakePeer())
+    peer = FakePeer()
+    await b.connect(peer)
+    await b.handle_message(peer, create_sync_message(peer.doc))
+    await first.flush()
+    await second.flush()
+    snapshot, log, _ = await db.load_document("shared")
+    assert len(log) == 2
+    seeded = Doc()
+    for _, update in log:
+        seeded.apply_update(update)
+    assert str(seeded.get(TEXT_NAME, type=Text)) == "print(1)"
+    
+    await a.replace_text("print(1)\n# a")
+    await first.flush()
+    assert str(b.text) == "print(1)\n# a"
+    assert str(peer.text) == "print(1)\n# a"
+    assert second.stats()["pulls"] == 1
+    
+    await b.replace_text("# b\nprint(1)\n# a")
+    await second.flush()
+    assert str(a.text) == "# b\nprint(1)\n# a"
+    await first.stop()
+    await second.stop()
+    
+    reloaded = DocumentStore()
+    document = await reloaded.open(db, "shared")
+    assert str(document.text) == "# b\nprint(1)\n# a"
+    await reloaded.stop()
+    assert (await db.get_session("shared")).code == "# b\nprint(1)\n# a"
+
+
+@pytest.mark.asyncio
+async def test_documents_of_removed_sessions_are_dropped(global_mock_db):
+    """Only documents unused for an interval close; those of archived or deleted sessions are dropped unflushed."""
+    db = global_mock_db
+    for session_id in ("kept", "archived", "deleted"):
+        await db.create_session(Session(id=session_id, code="x", language="python", createdAt=0))
+    store = DocumentStore(flush_interval_seconds=60)
+    
+    # Just opened (e.g. by a PATCH about to edit it): not closed under the caller
+    kept = await store.open(db, "kept")
+    await store.flush()
+    assert store.documents["kept"] is kept
+    kept.touched -= store.interval
+    await store.flush()
+    assert "kept" not in store.documents
+    
+    # Archived by another process while edits were pending
+    archived = await store.open(db, "archived")
+    await archived.connect(FakePeer())
+    await archived.replace_text("x = 1")
+    assert await db.archive_session("archived")
+    await store.flush()
+    assert "archived" not in store.documents
+    assert archived.pending == []
+    async with db._db.execute("SELECT COUNT(*) AS n FROM document_updates WHERE session_id != 'kept'") as cursor:
+        assert (await cursor.fetchone())["n"] == 0
+    
+    # Expired by this process's reaper
+    deleted = await store.open(db, "deleted")
+    await deleted.replace_text("x = 2")
+    reaper = SessionReaper(db, timeout_minutes=1, mode="delete", is_active=lambda _: False, on_expired=store.discard)
+    assert await reaper.reap_once(10 ** 15) == 2
+    assert "deleted" not in store.documents
+    assert store.stats()["discarded"] == 2
+    await store.stop()
+    async with db._db.execute("SELECT COUNT(*) AS n FROM document_updates WHERE session_id != 'kept'") as cursor:
+        assert (await cursor.fetchone())["n"] == 0
+
+
+def test_yjs_websocket_relays_updates():
+    """Updates from one Yjs socket are relayed to the others in the session."""
+    with TestClient(app) as client:
+        session_id = client.post("/api/v1/sessions").json()["id"]
+        
+        with client.websocket_connect(f"/yjs-ws/{session_id}") as first, \
+                client.websocket_connect(f"/yjs-ws/{session_id}") as second:
+            # Both get SYNC_STEP1 from the server on connect
+            assert first.receive_bytes()[:2] == b"\x00\x00"
+            assert second.receive_bytes()[:2] == b"\x00\x00"
+            
+            doc = Doc()
+            text = doc.get(TEXT_NAME, type=Text)
+            first.send_bytes(create_sync_message(doc))
+            reply = first.receive_bytes()
+            handle_sync_message(reply[1:], doc)
+            
+            text += "x = 1"
+            first.send_bytes(create_update_message(doc.get_update()))
+            
+            other = Doc()
+            handle_sync_message(second.receive_bytes()[1:], other)
+            assert str(other.get(TEXT_NAME, type=Text)).endswith("x = 1")
+            
+            client.portal.call(document_store.flush)
+            assert client.get(f"/api/v1/sessions/{session_id}").json()["code"].endswith("x = 1")
@@ -0,0 +1,64 @@
+import asyncio
+import pytest
+from app.services.execution_queue import ExecutionQueue, QueueFullError
+
+
+@pytest.mark.asyncio
+async def test_queue_limits_and_fairness():
+    """Slots are shared round-robin across sessions within the concurrency limits."""
+    queue = ExecutionQueue(max_concurrency=2, per_session_concurrency=1, max_queue_depth=10)
+    gate = asyncio.Event()
+    started = []
+    peak = {"total": 0}
+    
+    def job(name):
+        async def run():
+            started.append(name)
+            peak["total"] = max(peak["total"], queue.running)
+            await gate.wait()
+            return name
+        return run
+    
+    # Session "a" floods the queue before "b" and "c" submit
+    tasks = [asyncio.create_task(queue.submit("a", job(f"a{i}"))) for i in range(3)]
+    tasks += [asyncio.create_task(queue.submit(s, job(s))) for s in ("b", "c")]
+    await asyncio.sleep(0)
+    
+    # One job per session at a time: a0 and b run, the rest wait
+    assert started == ["a0", "b"]
+    assert queue.depth == 3
+    
+    gate.set()
+    results = await asyncio.gather(*tasks)
+    
+    # c is served before a's backlog
+    assert started.index("c") < started.index("a1")
+    assert peak["total"] == 2
+    assert [r[0] for r in results] == ["a0", "a1", "a2", "b", "c"]
+    assert all(wait >= 0 and run >= 0 for _, wait, run in results)
+    assert queue.running == 0 and queue.depth == 0
+
+
+@pytest.mark.asyncio
+async def test_queue_backpressure_and_cancellation():
+    """A full queue rejects new jobs; cancelled waiters give their place back."""
+    queue = ExecutionQueue(max_concurrency=1, per_session_concurrency=1, max_queue_depth=1)
+    gate = asyncio.Event()
+    
+    async def blocked():
+        await gate.wait()
+    
+    running = asyncio.create_task(queue.submit("a", blocked))
+    waiting = asyncio.create_task(queue.submit("b", blocked))
+    await asyncio.sleep(0)
+    
+    with pytest.raises(QueueFullError):
+        await queue.submit("c", blocked)
+    
+    waiting.cancel()
+    await asyncio.sleep(0)
+    assert queue.depth == 0
+    
+    gate.set()
+    await running
+    assert queue.running == 0
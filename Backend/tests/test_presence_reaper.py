@@ -0,0 +1,89 @@
+import time
+import pytest
+from app.models.schemas import Session, User
+from app.services.presence_reaper import PresenceReaper
+from app.services.timer_wheel import TimerWheel
+
+
+def test_timer_wheel_rounds_and_reschedule():
+    """Timers fire on their tick, across revolutions, and rescheduling moves them."""
+    wheel = TimerWheel(tick_seconds=1, slots=4)
+    wheel.schedule("a", 1)
+    wheel.schedule("b", 6)
+    wheel.schedule("c", 3)
+    wheel.schedule("c", 9)  # rescheduled, fires once at the new time
+    wheel.schedule("d", 2)
+    wheel.cancel("d")
+    
+    fired = {tick: wheel.tick() for tick in range(1, 11)}
+    assert {tick: keys for tick, keys in fired.items() if keys} == {1: ["a"], 6: ["b"], 9: ["c"]}
+    assert len(wheel) == 0
+
+
+@pytest.mark.asyncio
+async def test_expired_presence_is_batched_per_session(global_mock_db):
+    """Everything that expires in a tick costs one write batch and one broadcast per session."""
+    db = global_mock_db
+    now = int(time.time() * 1000)
+    await db.create_session(Session(id="s1", code="", language="python", createdAt=now))
+    for name in ("ann", "bob", "cat", "dan"):
+        # Ticks are simulated, so last activity has to be older than the timeout already
+        await db.add_user("s1", User(id=name, username=name, color="hsl(37, 92%, 50%)", lastActivity=now - 10_000))
+    
+    updates = []
+    db.subscribe("s1", updates.append)
+    
+    reaper = PresenceReaper(typing_timeout_seconds=1, idle_timeout_seconds=2, tick_seconds=1,
+                            is_connected=lambda session_id, user_id: user_id == "dan")
+    reaper.db = db
+    for name in ("ann", "bob", "cat", "dan"):
+        await db.update_user("s1", name, {"isTyping": True})
+        reaper.typing("s1", name, True)
+    updates.clear()
+    
+    # Tick 1: all four typing flags expire together
+    await reaper.tick()
+    assert len(updates) == 1
+    assert not any(u.isTyping for u in updates[0].users)
+    
+    # Tick 2: idle users go, except the one with an open socket
+    reaper.touch("s1", "cat")
+    await reaper.tick()
+    assert len(updates) == 2
+    assert sorted(u.id for u in updates[1].users) == ["cat", "dan"]
+    assert reaper.users_removed == 2
+    
+    # Nothing left to expire: no write, no broadcast
+    await reaper.tick()
+    await reaper.tick()
+    assert [u.id for u in (await db.get_session("s1")).users] == ["dan"]
+    assert len(updates) == 3
+
+
+@pytest.mark.asyncio
+async def test_users_active_elsewhere_are_kept(global_mock_db):
+    """Only users whose stored lastActivity is past the timeout are removed; socket activity is recorded."""
+    db = global_mock_db
+    now = int(time.time() * 1000)
+    await db.create_session(Session(id="s1", code="", language="python", createdAt=now))
+    for name in ("ann", "bob", "cat"):
+        await db.add_user("s1", User(id=name, username=name, color="hsl(37, 92%, 50%)", lastActivity=now - 10_000))
+    
+    reaper = PresenceReaper(idle_timeout_seconds=2, tick_seconds=1, activity_write_seconds=60)
+    reaper.db = db
+    for name in ("ann", "bob", "cat"):
+        reaper.touch("s1", name)
+    
+    # Another worker saw ann recently: its snapshot reached the users table
+    await db.update_user("s1", "ann", {"lastActivity": now})
+    # cat edits over a Yjs socket of this worker, twice in a row
+    await reaper.record_activity("s1", "cat")
+    await reaper.record_activity("s1", "cat")
+    assert (await db.get_session("s1")).users[2].lastActivity >= now
+    
+    await reaper.tick()
+    await reaper.tick()
+    assert [u.id for u in (await db.get_session("s1")).users] == ["ann", "cat"]
+    assert reaper.users_removed == 1
+    # ann is checked again after another full timeout
+    assert ("idle", "s1", "ann") in reaper.wheel
@@ -0,0 +1,147 @@
+import asyncio
+import json
+import pytest
+from app.database.session_bus import InProcessBus, PostgresNotifyBus
+from app.models.schemas import Session
+
+
+def make_session(code: str = "") -> Session:
+    return Session(id="bus", code=code, language="python", createdAt=0)
+
+
+@pytest.mark.asyncio
+async def test_in_process_bus_dispatch():
+    """Sync and async subscribers both receive published updates."""
+    bus = InProcessBus()
+    received = []
+    
+    async def async_listener(session):
+        received.append(("async", session.code))
+    
+    unsubscribe = bus.subscribe("bus", lambda session: received.append(("sync", session.code)))
+    bus.subscribe("bus", async_listener)
+    
+    await bus.publish("bus", make_session("a"))
+    unsubscribe()
+    await bus.publish("bus", make_session("b"))
+    await bus.publish_delete("bus")
+    await bus.publish("bus", make_session("c"))
+    
+    assert sorted(received) == [("async", "a"), ("async", "b"), ("sync", "a")]
+
+
+@pytest.mark.asyncio
+async def test_notify_bus_applies_remote_updates():
+    """Announcements from other processes refresh state and reach local listeners."""
+    remote_calls = []
+    
+    async def on_remote_update(session_id, session, deleted):
+        remote_calls.append((session_id, deleted))
+        return session or make_session("reloaded")
+    
+    bus = PostgresNotifyBus("postgresql://unused", on_remote_update)
+    received = []
+    bus.subscribe("bus", lambda session: received.append(session.code))
+    
+    def notify(message):
+        bus._on_notify(None, 0, bus.CHANNEL, json.dumps(message))
+    
+    # Our own announcements are ignored
+    notify({"origin": bus.origin, "sessionId": "bus", "session": make_session("own").model_dump()})
+    # Inlined and oversized updates from another worker
+    notify({"origin": "other", "sessionId": "bus", "session": make_session("inline").model_dump()})
+    notify({"origin": "other", "sessionId": "bus"})
+    await asyncio.sleep(0.01)
+    
+    notify({"origin": "other", "sessionId": "bus", "deleted": True})
+    await asyncio.sleep(0.01)
+    
+    assert received == ["inline", "reloaded"]
+    assert remote_calls == [("bus", False), ("bus", False), ("bus", True)]
+    assert "bus" not in bus.listeners
+
+
+class RecordingConnection:
+    """Stand-in for the bus's asyncpg connection; records NOTIFY payloads."""
+    
+    def __init__(self):
+        self.payloads = []
+    
+    async def execute(self, query, channel, payload):
+        await asyncio.sleep(0.01)
+        self.payloads.append(json.loads(payload))
+
+
+@pytest.mark.asyncio
+async def test_notify_bus_coalesces_and_persists_before_reload():
+    """Bursts collapse to the latest state; oversized sessions are persisted before the reload notice."""
+    events = []
+    
+    async def before_reload(session_id):
+        events.append(("persist", session_id))
+    
+    async def on_remote_update(session_id, session, deleted):
+        return session
+    
+    bus = PostgresNotifyBus("postgresql://unused", on_remote_update, before_reload)
+    conn = bus._conn = RecordingConnection()
+    bus._send_lock = asyncio.Lock()
+    
+    for i in range(20):
+        await bus.publish("bus", make_session(f"x = {i}"))
+    await asyncio.gather(*bus._senders.values())
+    
+    # Nothing yielded between the publishes, so only the last one is sent
+    assert len(conn.payloads) == 1
+    assert conn.payloads[-1]["session"]["code"] == "x = 19"
+    assert events == []
+    
+    await bus.publish("bus", make_session("#" * bus.MAX_PAYLOAD_BYTES))
+    await asyncio.gather(*bus._senders.values())
+    
+    assert events == [("persist", "bus")]
+    assert conn.payloads[-1] == {"origin": bus.origin, "sessionId": "bus"}
+    assert bus.stats()["reloads"] == 1
+
+
+@pytest.mark.asyncio
+async def test_notify_bus_applies_in_order_and_reconnects():
+    """Remote updates apply in arrival order; a dropped LISTEN connection is reopened and resynced."""
+    async def on_remote_update(session_id, session, deleted):
+        # The older update is the slower one to apply
+        await asyncio.sleep(0.02 if session and session.code == "old" else 0)
+        return session or make_session("reloaded")
+    
+    bus = PostgresNotifyBus("postgresql://unused", on_remote_update)
+    bus.RECONNECT_MIN_SECONDS = 0.001
+    received = []
+    bus.subscribe("bus", lambda session: received.append(session.code))
+    
+    for code in ("old", "new"):
+        bus._on_notify(None, 0, bus.CHANNEL, json.dumps(
+            {"origin": "other", "sessionId": "bus", "session": make_session(code).model_dump()}
+        ))
+    await asyncio.sleep(0.05)
+    assert received == ["old", "new"]
+    
+    attempts = []
+    
+    async def connect():
+        attempts.append(len(attempts))
+        if len(attempts) == 1:
+            raise OSError("database unavailable")
+        bus._conn = "listen connection"
+    
+    bus._connect = connect
+    bus._conn = "dropped connection"
+    bus._on_terminated("dropped connection")
+    await asyncio.sleep(0.05)
+    
+    assert attempts == [0, 1]
+    assert bus._conn == "listen connection"
+    assert bus.stats()["reconnects"] == 1
+    # Announcements may have been missed: subscribed sessions are reloaded
+    assert received == ["old", "new", "reloaded"]
+    
+    bus._conn = None
+    await bus.stop()
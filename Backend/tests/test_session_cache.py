@@ -0,0 +1,146 @@
+import asyncio
+import sqlite3
+import pytest
+from app.database.session_cache import SessionCache
+from app.models.schemas import Session, User
+
+
+def make_session(session_id: str) -> Session:
+    return Session(id=session_id, code="", language="python", createdAt=0)
+
+
+def make_user(user_id: str) -> User:
+    return User(id=user_id, username=user_id, color="hsl(37, 92%, 50%)", lastActivity=0)
+
+
+def test_cache_lru_eviction_and_counters():
+    """Least recently used sessions are evicted first; hits and misses are counted."""
+    cache = SessionCache(max_size=2)
+    cache.put(make_session("a"))
+    cache.put(make_session("b"))
+    
+    assert cache.get("a") is not None  # "a" is now most recently used
+    cache.put(make_session("c"))       # evicts "b"
+    
+    assert "b" not in cache
+    assert cache.get("b") is None
+    assert cache.get("c") is not None
+    assert cache.stats() == {"size": 2, "maxSize": 2, "hits": 2, "misses": 1, "evictions": 1}
+
+
+def test_cache_write_through_copies():
+    """Writes replace the cached entry instead of mutating handed-out objects."""
+    cache = SessionCache()
+    original = cache.put(make_session("a"))
+    
+    cache.add_user("a", make_user("u1"))
+    updated = cache.update_user("a", "u1", {"isTyping": True, "bogus": 1})
+    updated = cache.update_session("a", {"code": "x = 1"})
+    
+    assert original.users == [] and original.code == ""
+    assert updated.code == "x = 1"
+    assert updated.users[0].isTyping is True
+    assert cache.remove_user("a", "u1").users == []
+    assert cache.update_session("missing", {"code": ""}) is None
+
+
+@pytest.mark.asyncio
+async def test_writes_are_served_from_cache(global_mock_db):
+    """Updates and read-backs do not reload the session from the database."""
+    db = global_mock_db
+    await db.create_session(make_session("cached"))
+    await db.add_user("cached", make_user("u1"))
+    
+    loads = 0
+    load_session = db._load_session
+    
+    async def counting_load(session_id):
+        nonlocal loads
+        loads += 1
+        return await load_session(session_id)
+    
+    db._load_session = counting_load
+    
+    await db.update_user("cached", "u1", {"lastActivity": 5})
+    session = await db.update_session("cached", {"code": "print(1)", "lastModifiedBy": "u1"})
+    
+    assert loads == 0
+    assert session.code == "print(1)"
+    assert session.users[0].lastActivity == 5
+    
+    # The database agrees with the cache
+    fresh = await load_session("cached")
+    assert fresh == session
+
+
+@pytest.mark.asyncio
+async def test_presence_stays_in_memory_until_snapshot(global_mock_db):
+    """Typing and activity changes skip the users table until the presence snapshot."""
+    db = global_mock_db
+    await db.create_session(make_session("presence"))
+    await db.add_user("presence", make_user("u1"))
+    
+    session = await db.update_presence("presence", "u1", is_typing=True, last_activity=42)
+    assert session.users[0].isTyping is True
+    assert session.users[0].lastActivity == 42
+    
+    # Not written yet, but still visible after the cache drops the session
+    row = await db._load_session("presence")
+    assert row.users[0].isTyping is False and row.users[0].lastActivity == 0
+    db.cache.invalidate("presence")
+    session = await db.get_session("presence")
+    assert session.users[0].isTyping is True and session.users[0].lastActivity == 42
+    
+    await db.flush_pending_writes()
+    row = await db._load_session("presence")
+    assert row.users[0].isTyping is True and row.users[0].lastActivity == 42
+    assert db.presence.dirty == 0
+    
+    # Expiring the flag is in memory too; leaving forgets the user
+    assert (await db.expire_presence("presence", ["u1"], [])).users[0].isTyping is False
+    await db.remove_user("presence", "u1")
+    assert len(db.presence) == 0
+
+
+@pytest.mark.asyncio
+async def test_sqlite_reads_do_not_wait_for_writes(global_mock_db):
+    """In WAL mode loads use the reader pool and see committed data while a write is open."""
+    db = global_mock_db
+    await db.create_session(make_session("wal"))
+    assert len(db._readers) == db.reader_pool_size > 0
+    async with db._db.execute("PRAGMA journal_mode") as cursor:
+        assert (await cursor.fetchone())[0] == "wal"
+    
+    # An uncommitted write holds the write lock; readers still get the last commit
+    await db._db.execute("UPDATE sessions SET code = 'draft' WHERE id = 'wal'")
+    assert db._db.in_transaction
+    row = await db._load_session("wal")
+    assert row.code == ""
+    
+    await db._db.commit()
+    row = await db._load_session("wal")
+    assert row.code == "draft"
+
+
+@pytest.mark.asyncio
+async def test_sqlite_writes_are_group_committed(global_mock_db):
+    """Concurrent writes share one transaction; a failing write only fails its own caller."""
+    db = global_mock_db
+    await db.create_session(make_session("group"))
+    await db.add_user("group", make_user("u1"))
+    transactions = db.writes.transactions
+    
+    results = await asyncio.gather(
+        *(db.update_session("group", {"code": f"print({i})"}) for i in range(20)),
+        db.add_user("group", make_user("u1").model_copy(update={"username": "other"})),  # duplicate primary key
+        db.add_user("group", make_user("u2")),
+        return_exceptions=True
+    )
+    
+    assert db.writes.transactions - transactions == 1
+    assert isinstance(results[20], sqlite3.IntegrityError)
+    assert [u.id for u in results[21].users] == ["u1", "u2"]
+    
+    row = await db._load_session("group")
+    assert row.code == "print(19)"
+    assert [u.id for u in row.users] == ["u1", "u2"]
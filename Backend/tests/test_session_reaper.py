@@ -0,0 +1,63 @@
+import time
+import pytest
+from app.models.schemas import Session, User
+from app.services.session_reaper import SessionReaper
+
+HOUR_MS = 60 * 60 * 1000
+
+
+async def create_session(db, session_id: str, code: str = "") -> Session:
+    session = Session(id=session_id, code=code, language="python", createdAt=int(time.time() * 1000))
+    await db.create_session(session)
+    await db.add_user(session_id, User(id=f"{session_id}-u", username="ann", color="hsl(37, 92%, 50%)", lastActivity=0))
+    return session
+
+
+@pytest.mark.asyncio
+async def test_idle_sessions_are_archived_and_restored(global_mock_db):
+    """Idle sessions move to the archive and come back unchanged on the next read."""
+    db = global_mock_db
+    await create_session(db, "idle", code="print('kept')")
+    await create_session(db, "watched")
+    db.subscribe("watched", lambda session: None)
+    
+    reaper = SessionReaper(db, timeout_minutes=60)
+    now = int(time.time() * 1000)
+    assert await reaper.reap_once(now) == 0
+    assert await reaper.reap_once(now + 2 * HOUR_MS) == 1
+    
+    # Gone from the live tables and the cache, present in the archive
+    assert "idle" not in db.cache
+    async with db._db.execute("SELECT COUNT(*) AS n FROM sessions WHERE id = 'idle'") as cursor:
+        assert (await cursor.fetchone())['n'] == 0
+    async with db._db.execute("SELECT COUNT(*) AS n FROM session_archive") as cursor:
+        assert (await cursor.fetchone())['n'] == 1
+    
+    restored = await db.get_session("idle")
+    assert restored.code == "print('kept')"
+    assert [u.username for u in restored.users] == ["ann"]
+    async with db._db.execute("SELECT COUNT(*) AS n FROM session_archive") as cursor:
+        assert (await cursor.fetchone())['n'] == 0
+    
+    # Restoring counts as activity
+    assert await db.find_idle_sessions(now + 1) == ["watched"]
+
+
+@pytest.mark.asyncio
+async def test_delete_mode_and_idle_index(global_mock_db):
+    """Delete mode drops sessions outright; the idle scan uses the index."""
+    db = global_mock_db
+    await create_session(db, "old")
+    unsubscribe = db.subscribe("old", lambda session: None)
+    unsubscribe()
+    assert "old" not in db.listeners
+    
+    reaper = SessionReaper(db, timeout_minutes=1, mode="delete")
+    assert await reaper.reap_once(int(time.time() * 1000) + HOUR_MS) == 1
+    assert await db.get_session("old") is None
+    
+    async with db._db.execute(
+        "EXPLAIN QUERY PLAN SELECT id FROM sessions WHERE last_activity < 0 ORDER BY last_activity LIMIT 1"
+    ) as cursor:
+        plan = " ".join(row[-1] for row in await cursor.fetchall())
+    assert "idx_sessions_last_activity" in plan
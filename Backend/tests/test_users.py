@@ -57,6 +57,22 @@ async def test_join_session_duplicate_username(client: AsyncClient, sample_sessi
     assert "already taken" in data["detail"].lower()
 
 
+@pytest.mark.asyncio
+async def test_concurrent_joins_cannot_share_username(client: AsyncClient, sample_session):
+    """Joins racing for one username: exactly one wins, whatever the case."""
+    import asyncio
+    session_id = sample_session["id"]
+    
+    responses = await asyncio.gather(*(
+        client.post(f"/api/v1/sessions/{session_id}/join", json={"username": name})
+        for name in ["racer", "Racer", "RACER", "racer"]
+    ))
+    
+    assert sorted(r.status_code for r in responses) == [200, 400, 400, 400]
+    session = (await client.get(f"/api/v1/sessions/{session_id}")).json()
+    assert len(session["users"]) == 1
+
+
 @pytest.mark.asyncio
 async def test_join_nonexistent_session(client: AsyncClient, sample_user_data):
     """Test joining a session that doesn't exist."""
@@ -176,3 +192,44 @@ async def test_user_color_assignment(client: AsyncClient, sample_session):
     # Verify color format (HSL)
     assert user1["color"].startswith("hsl(")
     assert user2["color"].startswith("hsl(")
+
+
+@pytest.mark.asyncio
+async def test_username_index_folds_unicode_and_renames_old_clashes(tmp_path):
+    """Usernames collide under Unicode case folding, and clashing rows from before are resolved at startup."""
+    import sqlite3
+    from app.database.errors import UsernameTakenError
+    from app.database.sqlite_db import SQLiteDatabase
+    from app.models.schemas import User
+    
+    # A database from before username_key: SQLite's lower() let these two in
+    path = str(tmp_path / "old.db")
+    connection = sqlite3.connect(path)
+    connection.executescript("""
+        CREATE TABLE sessions (id TEXT PRIMARY KEY, code TEXT, language TEXT, created_at INTEGER, last_modified_by TEXT);
+        CREATE TABLE users (id TEXT PRIMARY KEY, session_id TEXT, username TEXT, color TEXT,
+                            is_typing BOOLEAN, last_activity INTEGER);
+        CREATE UNIQUE INDEX idx_users_session_username ON users(session_id, lower(username));
+        INSERT INTO sessions VALUES ('s1', '', 'python', 0, NULL);
+        INSERT INTO users VALUES ('old', 's1', 'Émile', 'hsl(0, 0%, 0%)', 0, 1);
+        INSERT INTO users VALUES ('new', 's1', 'émile', 'hsl(0, 0%, 0%)', 0, 2);
+        INSERT INTO users VALUES ('taken', 's1', 'Émile (2)', 'hsl(0, 0%, 0%)', 0, 0);
+    """)
+    connection.close()
+    
+    db = SQLiteDatabase(path)
+    await db.connect()
+    try:
+        # The most recently active keeps the name; the others take the next free suffix
+        users = {u.id: u.username for u in (await db.get_session("s1")).users}
+        assert users == {"old": "Émile (3)", "new": "émile", "taken": "Émile (2)"}
+        with pytest.raises(UsernameTakenError):
+            await db.add_user("s1", User(id="u3", username="ÉMILE", color="hsl(0, 0%, 0%)", lastActivity=3))
+        with pytest.raises(UsernameTakenError):
+            await db.add_user("s1", User(id="u6", username="émile (3)", color="hsl(0, 0%, 0%)", lastActivity=3))
+        # Folding goes beyond lower(): "ß" and "SS" are the same name
+        await db.add_user("s1", User(id="u4", username="straße", color="hsl(0, 0%, 0%)", lastActivity=4))
+        with pytest.raises(UsernameTakenError):
+            await db.add_user("s1", User(id="u5", username="STRASSE", color="hsl(0, 0%, 0%)", lastActivity=5))
+    finally:
+        await db.disconnect()
@@ -2,7 +2,9 @@ import pytest
 from httpx import AsyncClient, ASGITransport
 from fastapi.testclient import TestClient
 from app.main import app
+import asyncio
 import json
+import time
 
 
 def test_websocket_connection():
@@ -84,3 +86,303 @@ async def test_multiple_websocket_clients(client: AsyncClient, sample_session):
     # For now, we'll skip it or use a simpler synchronous version
     # The functionality is tested in test_websocket_receives_updates
     pass
+
+
+class CountingWebSocket:
+    """Minimal WebSocket stand-in that counts outgoing frames."""
+    
+    def __init__(self):
+        self.sent = []
+    
+    async def accept(self):
+        pass
+    
+    async def send_text(self, text: str):
+        self.sent.append(text)
+
+
+@pytest.mark.asyncio
+async def test_broadcast_sends_grow_linearly(global_mock_db):
+    """One update in a room of N sockets costs N sends, not N squared."""
+    from app.models.schemas import Session
+    from app.routers.websocket import ConnectionManager
+    
+    manager = ConnectionManager()
+    
+    for room_size in (1, 5, 20):
+        session_id = f"room{room_size}"
+        await global_mock_db.create_session(Session(
+            id=session_id, code="", language="python", createdAt=0
+        ))
+        sockets = [CountingWebSocket() for _ in range(room_size)]
+        for socket in sockets:
+            await manager.connect(socket, session_id, global_mock_db)
+        
+        # A single subscription per session regardless of room size
+        assert len(global_mock_db.listeners[session_id]) == 1
+        
+        await global_mock_db.update_session(session_id, {"code": "x = 1"})
+        
+        assert sum(len(socket.sent) for socket in sockets) == room_size
+        assert all(json.loads(socket.sent[0])["data"]["code"] == "x = 1" for socket in sockets)
+        
+        # Last socket out tears the hub down
+        for socket in sockets:
+            manager.disconnect(socket, session_id)
+        assert session_id not in manager.hubs
+        assert not global_mock_db.listeners.get(session_id)
+
+
+class StalledWebSocket(CountingWebSocket):
+    """Stand-in for a client that never drains its socket."""
+    
+    async def send_text(self, text: str):
+        await asyncio.sleep(3600)
+
+
+class ClosedWebSocket(CountingWebSocket):
+    async def send_text(self, text: str):
+        raise RuntimeError("socket closed")
+
+
+@pytest.mark.asyncio
+async def test_slow_and_dead_sockets(global_mock_db, monkeypatch):
+    """A stalled socket does not hold up the write; a hub of dead sockets releases itself."""
+    from app.config import settings
+    from app.models.schemas import Session
+    from app.routers.websocket import ConnectionManager
+    
+    monkeypatch.setattr(settings, "ws_send_timeout_seconds", 0.2)
+    db = global_mock_db
+    manager = ConnectionManager()
+    
+    session = await db.create_session(Session(id="slow", code="", language="python", createdAt=0))
+    fast, stalled = CountingWebSocket(), StalledWebSocket()
+    await manager.connect(fast, "slow", db, session)
+    await manager.connect(stalled, "slow", db, session)
+    
+    start = time.perf_counter()
+    await db.update_session("slow", {"code": "x = 1"})
+    assert time.perf_counter() - start < 1
+    assert len(fast.sent) == 1
+    assert manager.hubs["slow"].connections == {fast}
+    
+    session = await db.create_session(Session(id="dead", code="", language="python", createdAt=0))
+    await manager.connect(ClosedWebSocket(), "dead", db, session)
+    await db.update_session("dead", {"code": "x = 1"})
+    assert "dead" not in manager.hubs
+    assert not db.listeners.get("dead")
+
+
+def test_diff_text_round_trip():
+    """Range edits from diff_text rebuild the new text."""
+    from app.services.session_delta import apply_text_edits, diff_text
+    
+    cases = [("", "abc"), ("abc", ""), ("hello world", "hello brave world"), ("aaaa", "aa"), ("same", "same")]
+    for old, new in cases:
+        assert apply_text_edits(old, diff_text(old, new)) == new
+    
+    assert diff_text("print(1)", "print(12)") == [[7, 0, "2"]]
+
+
+def test_delta_code_uses_utf16_offsets():
+    """Code deltas count UTF-16 code units, like the JavaScript client."""
+    from app.services.session_delta import diff_session, from_utf16_edits, to_utf16_edits
+    
+    old = {"code": "a = '😀'; b = 1", "users": []}
+    new = {"code": "a = '😀'; b = 2", "users": []}
+    assert diff_session(old, new)["code"] == [[14, 1, "2"]]
+    
+    text = "😀😀x"
+    edits = [[1, 1, "y"], [0, 0, "🎉"]]
+    assert from_utf16_edits(text, to_utf16_edits(text, edits)) == edits
+    with pytest.raises(ValueError):
+        from_utf16_edits(text, [[1, 0, "z"]])
+
+
+@pytest.mark.asyncio
+async def test_delta_protocol(global_mock_db):
+    """Delta sockets get versioned changes only; full sockets keep snapshots."""
+    from app.models.schemas import Session, User
+    from app.routers.websocket import ConnectionManager
+    
+    db = global_mock_db
+    session = await db.create_session(Session(id="delta", code="print(1)", language="python", createdAt=0))
+    manager = ConnectionManager()
+    full_socket, delta_socket = CountingWebSocket(), CountingWebSocket()
+    await manager.connect(full_socket, "delta", db, session)
+    hub = await manager.connect(delta_socket, "delta", db, session, delta=True)
+    
+    await db.add_user("delta", User(id="u1", username="u1", color="hsl(37, 92%, 50%)", lastActivity=0))
+    await db.update_user("delta", "u1", {"isTyping": True})
+    await db.update_session("delta", {"code": "print(12)", "lastModifiedBy": "u1"})
+    # A write that changes nothing is not broadcast
+    await db.update_session("delta", {"language": "python"})
+    
+    deltas = [json.loads(frame) for frame in delta_socket.sent]
+    fulls = [json.loads(frame) for frame in full_socket.sent]
+    
+    assert [d["version"] for d in deltas] == [1, 2, 3]
+    assert all(d["event"] == "session_delta" and d["baseVersion"] == d["version"] - 1 for d in deltas)
+    assert deltas[0]["data"]["usersJoined"][0]["id"] == "u1"
+    assert deltas[1]["data"] == {"usersChanged": [{"id": "u1", "isTyping": True}]}
+    assert deltas[2]["data"] == {"fields": {"lastModifiedBy": "u1"}, "code": [[7, 0, "2"]]}
+    
+    assert [f["event"] for f in fulls] == ["session_update"] * 3
+    assert fulls[-1]["data"]["code"] == "print(12)"
+    assert hub.snapshot_message()["version"] == 3
+
+
+def test_websocket_resync():
+    """A client that detects a version gap can request a full snapshot."""
+    with TestClient(app) as client:
+        session_id = client.post("/api/v1/sessions").json()["id"]
+        
+        with client.websocket_connect(f"/api/v1/ws/sessions/{session_id}?protocol=delta") as websocket:
+            initial = websocket.receive_json()
+            assert initial["event"] == "session_update"
+            assert initial["version"] == 0
+            
+            client.put(f"/api/v1/sessions/{session_id}/language", json={"language": "go"})
+            delta = websocket.receive_json()
+            assert delta == {
+                "event": "session_delta",
+                "version": 1,
+                "baseVersion": 0,
+                "data": {"fields": {"language": "go"}}
+            }
+            
+            websocket.send_text(json.dumps({"type": "resync"}))
+            snapshot = websocket.receive_json()
+            assert snapshot["version"] == 1
+            assert snapshot["data"]["language"] == "go"
+
+
+def test_websocket_receives_execution_output():
+    """Running code streams its output to every socket in the session."""
+    with TestClient(app) as client:
+        session_id = client.post("/api/v1/sessions").json()["id"]
+        
+        with client.websocket_connect(f"/api/v1/ws/sessions/{session_id}") as websocket:
+            websocket.receive_json()
+            
+            response = client.post(
+                f"/api/v1/sessions/{session_id}/execute",
+                json={"code": "print('streamed')", "language": "python"}
+            )
+            execution_id = response.json()["executionId"]
+            
+            output = websocket.receive_json()
+            assert output["event"] == "execution_output"
+            assert output["executionId"] == execution_id
+            assert output["seq"] == 1
+            assert output["data"] == "streamed\n"
+            
+            done = websocket.receive_json()
+            assert done["event"] == "execution_done"
+            assert done["seq"] == 2
+            assert done["data"]["error"] is None
+
+
+def _receive_ack(websocket, seq):
+    """Read frames until the ack for seq; returns (ack, frames before it)."""
+    frames = []
+    while True:
+        frame = websocket.receive_json()
+        if frame.get("type") == "ack" and frame["seq"] == seq:
+            return frame, frames
+        frames.append(frame)
+
+
+def test_websocket_inbound_messages(sample_user_data):
+    """Typing, code, language and execute messages are applied and acked by seq."""
+    with TestClient(app) as client:
+        session_id = client.post("/api/v1/sessions").json()["id"]
+        user_id = client.post(f"/api/v1/sessions/{session_id}/join", json=sample_user_data).json()["user"]["id"]
+        
+        with client.websocket_connect(f"/api/v1/ws/sessions/{session_id}?protocol=delta&userId={user_id}") as websocket:
+            websocket.receive_json()
+            
+            websocket.send_text(json.dumps({"type": "typing", "seq": 1, "isTyping": True}))
+            ack, frames = _receive_ack(websocket, 1)
+            assert ack["ok"] is True
+            # The lastActivity recorded (without a broadcast) on connect rides along
+            assert [(u["id"], u["isTyping"]) for u in frames[0]["data"]["usersChanged"]] == [(user_id, True)]
+            assert ack["version"] == frames[0]["version"]
+            
+            websocket.send_text(json.dumps({"type": "code_update", "seq": 2, "code": "print(7)"}))
+            ack, _ = _receive_ack(websocket, 2)
+            assert ack["ok"] is True
+            assert client.get(f"/api/v1/sessions/{session_id}").json()["code"] == "print(7)"
+            
+            websocket.send_text(json.dumps({"type": "language_update", "seq": 3, "language": "cobol"}))
+            ack, _ = _receive_ack(websocket, 3)
+            assert ack["ok"] is False and ack["status"] == 400
+            
+            websocket.send_text(json.dumps({"type": "execute", "seq": 4, "code": "print(7)", "language": "python"}))
+            ack, frames = _receive_ack(websocket, 4)
+            assert ack["ok"] is True
+            assert ack["data"]["output"] == "7\n"
+            assert [f["event"] for f in frames] == ["execution_output", "execution_done"]
+
+
+def test_websocket_ignores_non_object_messages_and_cancels_executions(monkeypatch):
+    """JSON that is not an object is ignored, and running executions die with their socket."""
+    from app.routers import websocket as websocket_module
+    
+    events = []
+    
+    async def hanging_execution(db, hub, user_id, message, limits):
+        events.append("started")
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            events.append("cancelled")
+            raise
+    
+    monkeypatch.setattr(websocket_module, "handle_client_message", hanging_execution)
+    
+    with TestClient(app) as client:
+        session_id = client.post("/api/v1/sessions").json()["id"]
+        
+        with client.websocket_connect(f"/api/v1/ws/sessions/{session_id}") as websocket:
+            websocket.receive_json()
+            
+            for payload in ("[]", "1", '"x"', "null"):
+                websocket.send_text(payload)
+            websocket.send_text(json.dumps({"type": "ping"}))
+            assert websocket.receive_json()["type"] == "pong"
+            
+            websocket.send_text(json.dumps({"type": "execute", "seq": 1, "code": "", "language": "python"}))
+            for _ in range(100):
+                if events:
+                    break
+                time.sleep(0.01)
+        
+        for _ in range(100):
+            if "cancelled" in events:
+                break
+            time.sleep(0.01)
+        assert events == ["started", "cancelled"]
+
+
+def test_websocket_rate_limit(monkeypatch):
+    """Messages beyond the per-connection burst are rejected with 429."""
+    from app.config import settings
+    monkeypatch.setattr(settings, "ws_message_burst", 2)
+    monkeypatch.setattr(settings, "ws_message_rate_per_second", 0.01)
+    
+    with TestClient(app) as client:
+        session_id = client.post("/api/v1/sessions").json()["id"]
+        
+        with client.websocket_connect(f"/api/v1/ws/sessions/{session_id}") as websocket:
+            websocket.receive_json()
+            
+            statuses = []
+            for seq in range(3):
+                websocket.send_text(json.dumps({"type": "language_update", "seq": seq, "language": "go"}))
+                ack, _ = _receive_ack(websocket, seq)
+                statuses.append(ack.get("status"))
+            
+            assert statuses == [None, None, 429]
+            assert ack["retryAfterMs"] > 0
@@ -40,6 +40,7 @@ const Session = () => {
   const [onlineUserIds, setOnlineUserIds] = useState<Set<string>>(new Set());
 
   const typingTimeoutRef = useRef<NodeJS.Timeout | null>(null);
+  const currentUserId = currentUser?.id;
 
   // Initialize Yjs
   useEffect(() => {
@@ -48,7 +49,10 @@ const Session = () => {
     const doc = new Y.Doc();
     const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
     const wsUrl = `${protocol}//${window.location.host}/yjs-ws`;
-    const wsProvider = new WebsocketProvider(wsUrl, sessionId, doc);
+    // With userId the server attributes edits to the user and counts them as activity
+    const wsProvider = new WebsocketProvider(wsUrl, sessionId, doc, {
+      params: currentUserId ? { userId: currentUserId } : {},
+    });
 
     wsProvider.on('connection-error', (event: any) => {
       console.error("Yjs Connection Error:", event);
@@ -101,7 +105,7 @@ const Session = () => {
       doc.destroy();
       awareness.off('change', handleAwarenessChange);
     }
-  }, [sessionId]);
+  }, [sessionId, currentUserId]);
 
   // Load session
   useEffect(() => {
@@ -184,7 +188,7 @@ const Session = () => {
       } else {
         setSession(updatedSession);
       }
-    });
+    }, currentUser?.id);
 
     return () => {
       unsubscribe();
@@ -250,8 +254,8 @@ const Session = () => {
 
   const handleCodeChange = useCallback((code: string) => {
     if (!sessionId || !currentUser) return;
+    // The code reaches the server through the Yjs document, which it derives the session code from
     setSession(prev => prev ? ({ ...prev, code }) : null);
-    api.updateCode(sessionId, code, currentUser.id);
   }, [sessionId, currentUser]);
 
   const handleLanguageChange = useCallback((language: string) => {
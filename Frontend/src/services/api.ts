@@ -54,11 +54,22 @@ class WebSocketManager {
     private listeners: Set<(session: Session) => void> = new Set();
     private reconnectTimeout: NodeJS.Timeout | null = null;
     private sessionId: string | null = null;
+    private userId: string | null = null;
 
-    connect(sessionId: string, callback: (session: Session) => void): () => void {
+    connect(sessionId: string, callback: (session: Session) => void, userId?: string): () => void {
         this.sessionId = sessionId;
         this.listeners.add(callback);
 
+        // The socket keeps its user present on the server, so reopen it once the user is known
+        if (userId && userId !== this.userId && this.ws) {
+            this.ws.onclose = null;
+            this.ws.close();
+            this.ws = null;
+        }
+        if (userId) {
+            this.userId = userId;
+        }
+
         if (!this.ws || this.ws.readyState !== WebSocket.OPEN) {
             this.createConnection(sessionId);
         }
@@ -73,7 +84,8 @@ class WebSocketManager {
     }
 
     private createConnection(sessionId: string) {
-        const wsUrl = `${WS_BASE_URL}${API_PREFIX}/ws/sessions/${sessionId}`;
+        const query = this.userId ? `?userId=${encodeURIComponent(this.userId)}` : '';
+        const wsUrl = `${WS_BASE_URL}${API_PREFIX}/ws/sessions/${sessionId}${query}`;
 
         this.ws = new WebSocket(wsUrl);
 
@@ -129,6 +141,7 @@ class WebSocketManager {
         }
 
         this.sessionId = null;
+        this.userId = null;
     }
 
     sendPing() {
@@ -226,8 +239,8 @@ export const api = {
 
 
     // Subscribe to session updates via WebSocket
-    subscribe(sessionId: string, callback: (session: Session) => void): () => void {
-        return wsManager.connect(sessionId, callback);
+    subscribe(sessionId: string, callback: (session: Session) => void, userId?: string): () => void {
+        return wsManager.connect(sessionId, callback, userId);
     },
 
     // Check if username is available
@@ -182,7 +182,7 @@ export const api = {
   },
 
   // Subscribe to session updates
-  subscribe(sessionId: string, callback: Listener): () => void {
+  subscribe(sessionId: string, callback: Listener, userId?: string): () => void {
     if (!listeners.has(sessionId)) {
       listeners.set(sessionId, new Set());
     }
@@ -17,10 +17,9 @@ export default defineConfig(({ mode }) => ({
         ws: true
       },
       '/yjs-ws': {
-        target: process.env.WS_TARGET || 'ws://localhost:1234',
+        target: process.env.WS_TARGET || 'ws://localhost:8000',
         ws: true,
-        changeOrigin: true,
-        rewrite: (path) => path.replace(/^\/yjs-ws/, '')
+        changeOrigin: true
       }
     }
   },